@@ -0,0 +1,227 @@
+from dotenv import load_dotenv
+import threading
+import hashlib
+import json
+import os
+import db
+
+load_dotenv()
+
+FETCH_TIMEOUT = float(os.getenv('ALERT_FETCH_TIMEOUT', 15))
+CHUNK_SIZE = 64 * 1024
+
+ALERT_COLUMNS = ['entity_id', 'line', 'alert_type', 'header', 'description', 'content_hash', 'created_at', 'updated_at']
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+class _Reader:
+    # Text buffer over an iterator of byte chunks that only holds the part of
+    # the document that has not been decoded yet
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.eof = True
+            chunk = b''
+        data = self._pending + chunk
+        # Hold back a trailing partial UTF-8 sequence until the next chunk
+        cut = len(data)
+        if not self.eof:
+            for i in range(1, min(4, len(data)) + 1):
+                byte = data[-i]
+                if byte & 0xC0 == 0x80:
+                    continue
+                if byte & 0x80:
+                    needed = 2 if byte & 0xE0 == 0xC0 else 3 if byte & 0xF0 == 0xE0 else 4
+                    if needed > i:
+                        cut = len(data) - i
+                break
+        self._pending = data[cut:]
+        self.buf = self.buf[self.pos:] + data[:cut].decode('utf-8')
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed alert feed: expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and not isinstance(value, (dict, list, str)):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+def iter_entities(chunks, found=None):
+    # Yields each element of the top-level "entity" array as soon as it has
+    # been received, without holding the whole document in memory. The
+    # top-level keys seen are added to `found`, so the caller can tell an
+    # empty or truncated feed from one with no alerts.
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if found is not None:
+            found.add(key)
+        if key == 'entity':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() == ',':
+                        reader.pos += 1
+                        continue
+                    reader.expect(']')
+                    break
+        else:
+            reader.value()
+        if reader.peek() == ',':
+            reader.pos += 1
+            continue
+        reader.expect('}')
+        return
+
+def classify_alert(header):
+    header_lower = header.lower()
+    if 'delay' in header_lower:
+        return 'delay'
+    elif 'suspended' in header_lower:
+        return 'suspended'
+    elif 'skipped' in header_lower:
+        return 'stops_skipped'
+    elif 'express' in header_lower or 'local' in header_lower:
+        return 'express_to_local'
+    elif 'reduced' in header_lower:
+        return 'reduced_service'
+    elif 'planned' in header_lower:
+        return 'planned_work'
+    else:
+        return 'service_change'
+
+def _first_translation(text):
+    translations = (text or {}).get('translation') or []
+    return translations[0].get('text', '') if translations else ''
+
+def parse_entity(entity, lines):
+    # Returns one (entity_id, line) -> alert dict entry per affected line we track
+    if 'alert' not in entity:
+        return {}
+    alert = entity['alert']
+
+    affected_lines = set()
+    for informed in alert.get('informed_entity', []):
+        route_id = informed.get('route_id', '').strip().upper()
+        if route_id in lines:
+            affected_lines.add(route_id)
+    if not affected_lines:
+        return {}
+
+    header = _first_translation(alert.get('header_text'))
+    description = _first_translation(alert.get('description_text'))
+    content_hash = hashlib.sha1(json.dumps(alert, sort_keys=True).encode('utf-8')).hexdigest()
+    entity_id = str(entity.get('id') or content_hash)
+
+    return {
+        (entity_id, line): {
+            'entity_id': entity_id,
+            'line': line,
+            'alert_type': classify_alert(header),
+            'header': header,
+            'description': description,
+            'content_hash': content_hash
+        }
+        for line in affected_lines
+    }
+
+class AlertStore:
+    """Content hashes of the alerts currently stored, keyed by (entity_id, line).
+
+    diff() compares one scrape against it so only real inserts, updates and
+    deletes reach the database.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, conn):
+        rows = conn.run("SELECT entity_id, line, content_hash FROM alerts WHERE entity_id IS NOT NULL")
+        with self._lock:
+            self._hashes = {(r[0], r[1]): r[2] for r in rows}
+            self.loaded = True
+
+    def diff(self, current):
+        with self._lock:
+            new = [a for key, a in current.items() if key not in self._hashes]
+            updated = [a for key, a in current.items()
+                       if key in self._hashes and self._hashes[key] != a['content_hash']]
+            removed = [key for key in self._hashes if key not in current]
+        return new, updated, removed
+
+    def commit(self, current):
+        with self._lock:
+            self._hashes = {key: a['content_hash'] for key, a in current.items()}
+
+def write_diff(conn, new, updated, removed, now):
+    # created_at is kept from the first time an alert was seen; updates only
+    # touch the content columns
+    upserts = new + updated
+    if upserts:
+        db.insert_many(
+            conn, 'alerts', ALERT_COLUMNS,
+            [(a['entity_id'], a['line'], a['alert_type'], a['header'], a['description'],
+              a['content_hash'], now, now) for a in upserts],
+            suffix="""
+                ON CONFLICT (entity_id, line) DO UPDATE SET
+                    alert_type = EXCLUDED.alert_type,
+                    header = EXCLUDED.header,
+                    description = EXCLUDED.description,
+                    content_hash = EXCLUDED.content_hash,
+                    updated_at = EXCLUDED.updated_at
+            """
+        )
+    if removed:
+        conn.run("""
+            DELETE FROM alerts a
+            USING unnest(CAST(:entity_ids AS text[]), CAST(:lines AS text[])) AS r(entity_id, line)
+            WHERE a.entity_id = r.entity_id AND a.line = r.line
+        """, entity_ids=[k[0] for k in removed], lines=[k[1] for k in removed])
+    # Rows written before alerts had stable ids
+    conn.run("DELETE FROM alerts WHERE entity_id IS NULL")
+
+store = AlertStore()
@@ -0,0 +1,284 @@
+from dotenv import load_dotenv
+from array import array
+import threading
+import time
+import math
+import os
+import db
+import live
+import metrics
+
+load_dotenv()
+
+# A slot (one hour of the week) sees one sample per scrape cycle during that
+# hour, so 3600 / FEEDS_INTERVAL_SECONDS a week: 120 at 30s
+FEEDS_INTERVAL_SECONDS = float(os.getenv('FEEDS_INTERVAL_SECONDS', 30))
+SAMPLES_PER_WEEK = 3600 / FEEDS_INTERVAL_SECONDS
+# Weeks of a slot's history the moving mean and variance reflect, about
+# 1 / alpha samples; the weight of each new sample is derived from it
+BASELINE_WEEKS = float(os.getenv('ANOMALY_BASELINE_WEEKS', 4))
+ALPHA = float(os.getenv('ANOMALY_ALPHA', 1 / (SAMPLES_PER_WEEK * BASELINE_WEEKS)))
+# Weeks of samples a slot needs before it can flag anything
+MIN_WEEKS = float(os.getenv('ANOMALY_MIN_WEEKS', 2))
+MIN_SAMPLES = int(os.getenv('ANOMALY_MIN_SAMPLES', SAMPLES_PER_WEEK * MIN_WEEKS))
+# Standard deviations above the slot's mean that count as abnormal
+Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 3.0))
+# Open delays a line needs before it can be abnormal at all, so a quiet
+# line going from 0 to 2 isn't a burst
+MIN_DELAYS = int(os.getenv('ANOMALY_MIN_DELAYS', 5))
+# Consecutive abnormal cycles before an anomaly starts, and normal ones
+# before it ends
+START_CYCLES = int(os.getenv('ANOMALY_START_CYCLES', 2))
+END_CYCLES = int(os.getenv('ANOMALY_END_CYCLES', 4))
+# An open anomaly last updated longer ago than this would have ended had
+# anyone been watching; load() closes it instead of resuming it
+RESUME_SECONDS = float(os.getenv('ANOMALY_RESUME_SECONDS', END_CYCLES * FEEDS_INTERVAL_SECONDS))
+# Floor on the standard deviation; a slot that has always been 0 would
+# otherwise flag the first delay
+MIN_STD = float(os.getenv('ANOMALY_MIN_STD', 1.0))
+CHECKPOINT_SECONDS = float(os.getenv('ANOMALY_CHECKPOINT_SECONDS', 300))
+
+SLOTS = 7 * 24
+
+anomalies_started = metrics.registry.counter(
+    'subway_anomalies_started_total', 'Delay anomalies detected', ['line'])
+anomalies_active = metrics.registry.gauge(
+    'subway_anomalies_active', 'Whether a line currently has an open delay anomaly', ['line'])
+
+def hour_of_week(ts):
+    return ts.weekday() * 24 + ts.hour
+
+class LineBaseline:
+    """Exponentially weighted mean and variance of a line's open-delay count
+    for each hour of the week, in fixed arrays."""
+
+    def __init__(self):
+        self.mean = array('d', bytes(8 * SLOTS))
+        self.var = array('d', bytes(8 * SLOTS))
+        self.samples = array('q', bytes(8 * SLOTS))
+
+    def update(self, slot, value, alpha=ALPHA):
+        # Until a slot has 1/alpha samples this is a plain running mean, so
+        # early cycles aren't outweighed by the zero it started from
+        n = self.samples[slot] + 1
+        a = max(alpha, 1.0 / n)
+        diff = value - self.mean[slot]
+        step = a * diff
+        self.mean[slot] += step
+        self.var[slot] = (1 - a) * (self.var[slot] + diff * step)
+        self.samples[slot] = n
+
+    def score(self, slot, value):
+        std = max(math.sqrt(self.var[slot]), MIN_STD)
+        return (value - self.mean[slot]) / std, std
+
+class Anomaly:
+    __slots__ = ('id', 'line', 'started_at', 'updated_at', 'ended_at', 'peak_delays',
+                 'expected_delays', 'baseline_std', 'score', 'normal_cycles')
+
+    def __init__(self, line, started_at, delays, expected, std, score):
+        self.id = None
+        self.line = line
+        self.started_at = started_at
+        self.updated_at = started_at
+        self.ended_at = None
+        self.peak_delays = delays
+        self.expected_delays = expected
+        self.baseline_std = std
+        self.score = score
+        self.normal_cycles = 0
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'line': self.line,
+            'started_at': self.started_at,
+            'ended_at': self.ended_at,
+            'peak_delays': self.peak_delays,
+            'expected_delays': round(self.expected_delays, 1),
+            'baseline_std': round(self.baseline_std, 2),
+            'score': round(self.score, 1)
+        }
+
+class AnomalyDetector:
+    """Flags lines whose open-delay count is far above what is normal for
+    that line at that hour of the week.
+
+    observe() runs once per scrape cycle. A line goes abnormal after
+    START_CYCLES cycles over the threshold and back to normal after
+    END_CYCLES under it. Baselines are not updated while a line is
+    abnormal, so a long disruption doesn't become the new normal.
+    """
+
+    def __init__(self):
+        self._baselines = {}
+        self._active = {}
+        self._pending = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._checkpointed_at = time.monotonic()
+        self.loaded = False
+
+    def _baseline(self, line):
+        baseline = self._baselines.get(line)
+        if baseline is None:
+            baseline = self._baselines[line] = LineBaseline()
+        return baseline
+
+    def observe(self, open_counts, seen_lines, now):
+        # open_counts: line -> open delay events (DelayTracker.open_counts());
+        # only lines whose feed was parsed this cycle are scored. Returns the
+        # anomalies that started, grew or ended, for write().
+        slot = hour_of_week(now)
+        changed = []
+        with self._lock:
+            for line in seen_lines:
+                value = open_counts.get(line, 0)
+                baseline = self._baseline(line)
+                score, std = baseline.score(slot, value)
+                trained = baseline.samples[slot] >= MIN_SAMPLES
+                abnormal = trained and value >= MIN_DELAYS and score >= Z_THRESHOLD
+                anomaly = self._active.get(line)
+
+                if anomaly is not None:
+                    anomaly.updated_at = now
+                    if abnormal:
+                        anomaly.normal_cycles = 0
+                        if value > anomaly.peak_delays:
+                            anomaly.peak_delays = value
+                            anomaly.score = score
+                            changed.append(anomaly)
+                        continue
+                    anomaly.normal_cycles += 1
+                    if anomaly.normal_cycles >= END_CYCLES:
+                        anomaly.ended_at = now
+                        del self._active[line]
+                        anomalies_active.set(0, line=line)
+                        changed.append(anomaly)
+                    continue
+
+                if abnormal:
+                    streak = self._pending.get(line, 0) + 1
+                    if streak >= START_CYCLES:
+                        self._pending.pop(line, None)
+                        anomaly = Anomaly(line, now, value, baseline.mean[slot], std, score)
+                        self._active[line] = anomaly
+                        anomalies_started.inc(line=line)
+                        anomalies_active.set(1, line=line)
+                        changed.append(anomaly)
+                    else:
+                        self._pending[line] = streak
+                    continue
+                self._pending.pop(line, None)
+                baseline.update(slot, value)
+                self._dirty.add((line, slot))
+        return changed
+
+    def is_trained(self, line, now):
+        with self._lock:
+            baseline = self._baselines.get(line)
+            return baseline is not None and baseline.samples[hour_of_week(now)] >= MIN_SAMPLES
+
+    def active(self):
+        with self._lock:
+            return dict(self._active)
+
+    def write(self, conn, changed):
+        for anomaly in changed:
+            if anomaly.id is None:
+                anomaly.id = conn.run("""
+                    INSERT INTO delay_anomalies
+                        (line, created_at, updated_at, ended_at, peak_delays, expected_delays, baseline_std, score)
+                    VALUES (:line, :started_at, :updated_at, :ended_at, :peak, :expected, :std, :score)
+                    RETURNING id
+                """, line=anomaly.line, started_at=anomaly.started_at, updated_at=anomaly.updated_at,
+                    ended_at=anomaly.ended_at, peak=anomaly.peak_delays, expected=round(anomaly.expected_delays, 2),
+                    std=round(anomaly.baseline_std, 2), score=round(anomaly.score, 2))[0][0]
+                live.publish(conn, 'anomaly', anomaly.line, anomaly.as_dict())
+            else:
+                conn.run("""
+                    UPDATE delay_anomalies
+                    SET updated_at = :updated_at, ended_at = :ended_at, peak_delays = :peak, score = :score
+                    WHERE id = :id
+                """, id=anomaly.id, updated_at=anomaly.updated_at, ended_at=anomaly.ended_at,
+                    peak=anomaly.peak_delays, score=round(anomaly.score, 2))
+                if anomaly.ended_at is not None:
+                    live.publish(conn, 'anomaly', anomaly.line, anomaly.as_dict())
+
+    def checkpoint(self, conn, force=False):
+        # Upserts the slots updated since the last checkpoint; returns how
+        # many were written
+        if not force and time.monotonic() - self._checkpointed_at < CHECKPOINT_SECONDS:
+            return 0
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for line, slot in dirty:
+                baseline = self._baselines[line]
+                rows.append((line, slot, baseline.mean[slot], baseline.var[slot], baseline.samples[slot]))
+        try:
+            db.insert_many(conn, 'delay_baselines', ['line', 'hour_of_week', 'mean', 'variance', 'samples'], rows,
+                           suffix="""
+                ON CONFLICT (line, hour_of_week) DO UPDATE SET
+                    mean = EXCLUDED.mean,
+                    variance = EXCLUDED.variance,
+                    samples = EXCLUDED.samples,
+                    updated_at = CURRENT_TIMESTAMP
+            """)
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        self._checkpointed_at = time.monotonic()
+        return len(rows)
+
+    def load(self, conn, lines=None):
+        # Restores the baselines from the last checkpoint and resumes the
+        # anomalies still open in the table, so a reload after a failed
+        # cycle or a shard handover doesn't start (and alert on) them again.
+        # Ones nobody has updated for RESUME_SECONDS are closed where they
+        # were last seen, as are all but the newest of a line's open rows.
+        # With `lines`, only those lines are loaded (see
+        # shards.py).
+        lines = list(lines) if lines else None
+        conn.run("""
+            UPDATE delay_anomalies SET ended_at = updated_at
+            WHERE ended_at IS NULL
+            AND (updated_at <= NOW() - :seconds * INTERVAL '1 second'
+                 OR id < (SELECT MAX(id) FROM delay_anomalies newer
+                          WHERE newer.line = delay_anomalies.line AND newer.ended_at IS NULL))
+            AND (CAST(:lines AS text[]) IS NULL OR line = ANY(CAST(:lines AS text[])))
+        """, seconds=RESUME_SECONDS, lines=lines)
+        open_rows = conn.run("""
+            SELECT id, line, created_at, updated_at, peak_delays, expected_delays, baseline_std, score
+            FROM delay_anomalies
+            WHERE ended_at IS NULL
+            AND (CAST(:lines AS text[]) IS NULL OR line = ANY(CAST(:lines AS text[])))
+            ORDER BY id
+        """, lines=lines)
+        rows = conn.run("""
+            SELECT line, hour_of_week, mean, variance, samples FROM delay_baselines
+            WHERE CAST(:lines AS text[]) IS NULL OR line = ANY(CAST(:lines AS text[]))
+        """, lines=lines)
+        with self._lock:
+            for line in self._active:
+                anomalies_active.set(0, line=line)
+            self._baselines = {}
+            self._active = {}
+            self._pending = {}
+            self._dirty = set()
+            for line, slot, mean, variance, samples in rows:
+                baseline = self._baseline(line)
+                baseline.mean[slot] = mean
+                baseline.var[slot] = variance
+                baseline.samples[slot] = samples
+            for anomaly_id, line, started_at, updated_at, peak, expected, std, score in open_rows:
+                anomaly = Anomaly(line, started_at, peak, float(expected), float(std), float(score))
+                anomaly.id = anomaly_id
+                anomaly.updated_at = updated_at
+                self._active[line] = anomaly
+                anomalies_active.set(1, line=line)
+            self.loaded = True
+        return len(rows)
+
+detector = AnomalyDetector()
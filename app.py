@@ -1,206 +1,386 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Blueprint, jsonify, request, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-import pg8000.native
-import resend
+import time
+import db
 import os
+from datetime import timedelta
+from cache import cached, response_cache, expire_version_check
+import live
+import hot_window
+import stations
+import write_behind
+import budgets
+from budgets import budget
+import metrics
+import pagination
+import serialize
+from serialize import rows_response, json_response
+from pagination import BadRequest
 
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
+# Run before a worker takes traffic: open pooled connections and render the
+# busiest cached routes once
+WARM_UP = os.getenv('WEB_WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+WARM_UP_CONNECTIONS = int(os.getenv('WEB_WARM_UP_CONNECTIONS', 2))
+WARM_UP_PATHS = [p for p in os.getenv(
+    'WEB_WARM_UP_PATHS', '/api/lines,/api/stats,/api/worst-times,/api/stations/worst').split(',') if p]
 
-resend.api_key = os.getenv('RESEND_API_KEY')
+api = Blueprint('api', __name__)
 
-def get_db_connection():
-    return pg8000.native.Connection(
-        host=os.getenv('DB_HOST'),
-        port=int(os.getenv('DB_PORT', 5432)),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        ssl_context=True
-    )
+# Read routes run under a @budget (budgets.py): they read from a replica when
+# one is caught up, with a statement timeout and a row budget, and answer
+# from the cache or with a 503 for a while after going over it. Queries
+# that can return many rows end in LIMIT :budget_limit, which the budgeted
+# connection fills in with the rows the route has left.
 
-@app.route('/api/health')
+def create_app(warm_up=None):
+    # Importing this module has no side effects; gunicorn builds the app in
+    # each worker with `gunicorn 'app:create_app()'`
+    app = Flask(__name__)
+    # Paginated routes advertise the next page in these headers
+    CORS(app, expose_headers=['X-Next-Cursor', 'Link'])
+    # Per-route latency histograms and GET /metrics
+    metrics.init_app(app)
+    # gzip/brotli for JSON responses, negotiated per client
+    serialize.init_app(app)
+    app.register_blueprint(api)
+
+    # Each gunicorn worker gets its own pool, sized separately from the scheduler's
+    db.init_pool(max_size=int(os.getenv('WEB_DB_POOL_SIZE', 4)))
+    # Report and upvote writes are buffered and flushed in batches
+    write_behind.init_reports()
+
+    # Any live event means the scraper (or another worker) just wrote something
+    live.broker.on_event = lambda event: expire_version_check()
+
+    if WARM_UP if warm_up is None else warm_up:
+        run_warm_up(app)
+    return app
+
+def run_warm_up(app):
+    # Failures are logged, not raised: a worker that boots while the
+    # database is down still comes up and serves what it can
+    start = time.perf_counter()
+    try:
+        opened = db.get_pool().warm(WARM_UP_CONNECTIONS)
+    except Exception as e:
+        print(f"❌ Warm-up could not open database connections: {e}")
+        return
+    stations.directory()
+    primed = 0
+    with app.test_client() as client:
+        for path in WARM_UP_PATHS:
+            try:
+                if client.get(path).status_code == 200:
+                    primed += 1
+            except Exception as e:
+                print(f"❌ Warm-up request to {path} failed: {e}")
+    print(f"🔥 Warmed up in {(time.perf_counter() - start) * 1000:.0f}ms: "
+          f"{opened} connections, {primed}/{len(WARM_UP_PATHS)} routes cached")
+
+@api.app_errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify({'error': str(e)}), 400
+
+@api.route('/api/health')
 def health():
-    return jsonify({'status': 'ok'})
+    return jsonify({'status': 'ok', 'db_pool': db.pool_metrics(), 'db_replicas': db.replica_metrics(), 'cache': response_cache.metrics(), 'live_clients': live.broker.client_count(), 'write_behind': write_behind.reports.metrics()})
 
-@app.route('/api/lines')
+# Rows are serialized straight from the query's tuples, in this order
+LINE_FIELDS = ['line', 'total_delays', 'avg_delay', 'max_delay', 'last_updated']
+
+@api.route('/api/lines')
+@budget(timeout_ms=2000, max_rows=500, max_lag=60)
+@cached(ttl=60)
 def get_lines():
-    conn = get_db_connection()
-    rows = conn.run("""
-        SELECT 
-            line,
-            COUNT(*) as total_delays,
-            ROUND(AVG(delay_minutes)::numeric, 1) as avg_delay,
-            MAX(delay_minutes) as max_delay,
-            MAX(timestamp) as last_updated
-        FROM delays
-        WHERE timestamp > NOW() - INTERVAL '24 hours'
-        GROUP BY line
-        ORDER BY total_delays DESC
-    """)
-    conn.close()
-    result = []
-    for row in rows:
-        result.append({
-            'line': row[0],
-            'total_delays': row[1],
-            'avg_delay': str(row[2]),
-            'max_delay': str(row[3]),
-            'last_updated': str(row[4])
-        })
-    return jsonify(result)
-
-@app.route('/api/stats')
+    # Served from the scheduler's in-memory hot window when it is reachable
+    hot = hot_window.fetch_lines()
+    if hot is not None:
+        rows = [(line, s['total_delays'], str(s['avg_delay']), str(s['max_delay']), s['last_updated'])
+                for line, s in hot.items() if s['total_delays']]
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return rows_response(rows, LINE_FIELDS)
+    
+    with budgets.connection() as conn:
+        rows = conn.run("""
+            SELECT 
+                line,
+                SUM(delay_count) as total_delays,
+                ROUND(SUM(delay_sum) / NULLIF(SUM(delay_count), 0), 1) as avg_delay,
+                MAX(delay_max) as max_delay,
+                MAX(last_delay_at) as last_updated
+            FROM delay_rollups_hourly
+            WHERE bucket > DATE_TRUNC('hour', NOW() - INTERVAL '24 hours')
+            GROUP BY line
+            ORDER BY total_delays DESC
+            LIMIT :budget_limit
+        """)
+    return rows_response(rows, LINE_FIELDS)
+
+@api.route('/api/stats')
+@budget(timeout_ms=2000, max_rows=10, max_lag=60)
+@cached(ttl=60)
 def get_stats():
-    conn = get_db_connection()
-    rows = conn.run("""
-        SELECT 
-            COUNT(*) as total_delays_recorded,
-            COUNT(DISTINCT line) as lines_tracked,
-            ROUND(AVG(delay_minutes)::numeric, 1) as overall_avg_delay,
-            MAX(timestamp) as last_scrape
-        FROM delays
-    """)
-    conn.close()
+    with budgets.connection() as conn:
+        rows = conn.run("""
+            SELECT 
+                COALESCE(SUM(delay_count), 0) as total_delays_recorded,
+                COUNT(DISTINCT line) as lines_tracked,
+                ROUND(SUM(delay_sum) / NULLIF(SUM(delay_count), 0), 1) as overall_avg_delay,
+                MAX(last_delay_at) as last_scrape
+            FROM delay_rollups_daily
+        """)
     row = rows[0]
-    return jsonify({
+    return json_response({
         'total_delays_recorded': row[0],
         'lines_tracked': row[1],
-        'overall_avg_delay': str(row[2]),
-        'last_scrape': str(row[3])
+        'overall_avg_delay': row[2],
+        'last_scrape': row[3]
     })
 
-@app.route('/api/worst-times')
+@api.route('/api/worst-times')
+@budget(timeout_ms=5000, max_rows=100, max_lag=600)
+@cached(ttl=300)
 def get_worst_times():
-    conn = get_db_connection()
-    rows = conn.run("""
-        SELECT 
-            EXTRACT(HOUR FROM timestamp) as hour_of_day,
-            COUNT(*) as delay_count,
-            ROUND(AVG(delay_minutes)::numeric, 1) as avg_delay
-        FROM delays
-        GROUP BY EXTRACT(HOUR FROM timestamp)
-        ORDER BY hour_of_day ASC
-    """)
-    conn.close()
-    result = []
-    for row in rows:
-        result.append({
-            'hour_of_day': row[0],
-            'delay_count': row[1],
-            'avg_delay': str(row[2])
-        })
-    return jsonify(result)
-
-@app.route('/api/lines/<line>/history')
+    with budgets.connection() as conn:
+        rows = conn.run("""
+            SELECT 
+                EXTRACT(HOUR FROM bucket) as hour_of_day,
+                SUM(delay_count) as delay_count,
+                ROUND(SUM(delay_sum) / NULLIF(SUM(delay_count), 0), 1) as avg_delay
+            FROM delay_rollups_hourly
+            GROUP BY EXTRACT(HOUR FROM bucket)
+            ORDER BY hour_of_day ASC
+            LIMIT :budget_limit
+        """)
+    return rows_response(rows, ['hour_of_day', 'delay_count', 'avg_delay'])
+
+@api.route('/api/lines/<line>/history')
+@budget(timeout_ms=5000, max_rows=3000, max_lag=120)
+@cached(ttl=120)
 def get_line_history(line):
-    conn = get_db_connection()
-    rows = conn.run("""
-        SELECT 
-            DATE_TRUNC('hour', timestamp) as hour,
-            COUNT(*) as delay_count,
-            ROUND(AVG(delay_minutes)::numeric, 1) as avg_delay
-        FROM delays
-        WHERE line = :line
-        AND timestamp > NOW() - INTERVAL '7 days'
-        GROUP BY DATE_TRUNC('hour', timestamp)
-        ORDER BY hour ASC
-    """, line=line.upper())
-    conn.close()
-    result = []
-    for row in rows:
-        result.append({
-            'hour': str(row[0]),
-            'delay_count': row[1],
-            'avg_delay': str(row[2])
-        })
-    return jsonify(result)
-
-@app.route('/api/reports', methods=['POST'])
+    # ?bucket=5m|1h|1d (default 1h) over ?since=&until= or ?hours= / ?days=
+    # (default the last 7 days). 5-minute buckets come from the raw events,
+    # the others from the rollup tables.
+    bucket = request.args.get('bucket', '1h')
+    if bucket not in pagination.BUCKETS:
+        raise BadRequest(f"bucket must be one of {', '.join(pagination.BUCKETS)}")
+    source, max_range = pagination.BUCKETS[bucket]
+    since, until = pagination.time_range(timedelta(days=7), max_range)
+
+    with budgets.connection() as conn:
+        if source == 'delays':
+            rows = conn.run("""
+                SELECT
+                    bucket,
+                    bucket as hour,
+                    delay_count,
+                    avg_delay
+                FROM (
+                    SELECT
+                        DATE_TRUNC('hour', timestamp) + FLOOR(EXTRACT(MINUTE FROM timestamp) / 5) * INTERVAL '5 minutes' as bucket,
+                        COUNT(*) as delay_count,
+                        ROUND(AVG(delay_minutes), 1) as avg_delay
+                    FROM delays
+                    WHERE line = :line
+                    AND timestamp >= :since AND timestamp < :until
+                    GROUP BY 1
+                ) buckets
+                ORDER BY bucket ASC
+                LIMIT :budget_limit
+            """, line=line.upper(), since=since, until=until)
+        else:
+            unit = 'hour' if bucket == '1h' else 'day'
+            rows = conn.run(f"""
+                SELECT 
+                    bucket,
+                    bucket as hour,
+                    delay_count,
+                    ROUND(delay_sum / NULLIF(delay_count, 0), 1) as avg_delay
+                FROM {source}
+                WHERE line = :line
+                AND bucket >= DATE_TRUNC('{unit}', CAST(:since AS timestamp)) AND bucket < :until
+                ORDER BY bucket ASC
+                LIMIT :budget_limit
+            """, line=line.upper(), since=since, until=until)
+    # 'hour' repeats 'bucket' for clients written against the hourly-only
+    # version
+    return rows_response(rows, ['bucket', 'hour', 'delay_count', 'avg_delay'])
+
+# Stations are GTFS parent stations; platform ids (101N) resolve to their
+# station. Both routes are read from the scheduler's station board, which is
+# rebuilt after every scrape, and fall back to the delays table.
+
+# The worst-stations fallback reads one row per (stop, line) with an open
+# delay: about 1,000 platform ids with a few lines each at most
+@api.route('/api/stations/worst')
+@budget(timeout_ms=3000, max_rows=3000)
+@cached(ttl=30)
+def get_worst_stations():
+    # Stations with the most open delays right now
+    limit = pagination.parse_limit(default=10, maximum=stations.WORST_SIZE)
+    worst = hot_window.fetch_worst_stations(limit)
+    if worst is None:
+        with budgets.connection() as conn:
+            worst = stations.query_worst(conn, limit)
+    return json_response(worst)
+
+@api.route('/api/stations/<station_id>')
+@budget(timeout_ms=2000, max_rows=1000)
+@cached(ttl=30)
+def get_station(station_id):
+    hot = hot_window.fetch_station(station_id)
+    if hot is not None:
+        station = hot['station']
+    elif stations.directory().index_of(station_id) is None:
+        station = None
+    else:
+        with budgets.connection() as conn:
+            station = stations.query_station(conn, station_id)
+    if station is None:
+        return jsonify({'error': 'unknown station'}), 404
+    return json_response(station)
+
+@api.route('/api/reports', methods=['POST'])
 def submit_report():
-    data = request.get_json()
+    # Buffered and written in a batch within WRITE_BEHIND_FLUSH_SECONDS; the
+    # id is reserved up front so the report can be upvoted straight away.
+    # Checked here, since a bad row would otherwise only fail at flush time.
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise BadRequest('a JSON object body is required')
     line = data.get('line')
     issue_type = data.get('issue_type')
-    description = data.get('description', '')
-    conn = get_db_connection()
-    conn.run(
-        "INSERT INTO reports (line, issue_type, description) VALUES (:line, :issue_type, :description)",
-        line=line, issue_type=issue_type, description=description
-    )
-    conn.close()
-    return jsonify({'success': True})
+    description = data.get('description') or ''
+    if not isinstance(line, str) or not line.strip():
+        raise BadRequest('line is required')
+    if len(line) > write_behind.LINE_MAX_LENGTH:
+        raise BadRequest(f"line must be at most {write_behind.LINE_MAX_LENGTH} characters")
+    if not isinstance(issue_type, str) or not issue_type.strip():
+        raise BadRequest('issue_type is required')
+    if len(issue_type) > write_behind.ISSUE_TYPE_MAX_LENGTH:
+        raise BadRequest(f"issue_type must be at most {write_behind.ISSUE_TYPE_MAX_LENGTH} characters")
+    if not isinstance(description, str):
+        raise BadRequest('description must be a string')
+    report = write_behind.reports.submit(line, issue_type, description)
+    return jsonify({'success': True, 'id': report.id})
+
+# Reports are paged newest first with ?limit= and ?cursor= (from the
+# X-Next-Cursor header of the previous page), over the last ?hours= (default
+# 2, up to a week)
+REPORTS_MAX_RANGE = timedelta(days=7)
 
-@app.route('/api/reports/recent', methods=['GET'])
+def _report_rows(where, params, default_limit, line=None):
+    limit, after_cursor, cursor_params = pagination.page_params(default_limit)
+    since, until = pagination.time_range(timedelta(hours=2), REPORTS_MAX_RANGE)
+    with budgets.connection() as conn:
+        rows = conn.run(f"""
+            SELECT id, line, issue_type, description, upvotes, created_at 
+            FROM reports 
+            WHERE {where} AND created_at > :since AND created_at <= :until AND {after_cursor}
+            ORDER BY created_at DESC, id DESC 
+            LIMIT :fetch""",
+            since=since, until=until, fetch=limit + 1, **params, **cursor_params
+        )
+    # Buffered upvotes and reports not yet written show up right away; new
+    # reports are the newest rows, so they only belong on the first page
+    rows = write_behind.reports.overlay(rows, line=line, since=since, until=until, include_new=not cursor_params)
+    return pagination.finish_page(rows, limit, created_at_index=5)
+
+def _reports_response(rows, next_cursor):
+    return pagination.page_headers(
+        rows_response(rows, ['id', 'line', 'issue_type', 'description', 'upvotes', 'created_at']), next_cursor)
+
+@api.route('/api/reports/recent', methods=['GET'])
+@budget(timeout_ms=2000, max_rows=pagination.MAX_LIMIT + 1, replica=False)
 def get_recent_reports():
-    limit = request.args.get('limit', 10, type=int)
-    conn = get_db_connection()
-    reports = conn.run(
-        """SELECT id, line, issue_type, description, upvotes, created_at 
-           FROM reports 
-           WHERE created_at > NOW() - INTERVAL '2 hours' 
-           ORDER BY created_at DESC 
-           LIMIT :limit""",
-        limit=limit
-    )
-    conn.close()
-    return jsonify([{
-        'id': r[0],
-        'line': r[1],
-        'issue_type': r[2],
-        'description': r[3],
-        'upvotes': r[4],
-        'created_at': str(r[5])
-    } for r in reports])
-
-@app.route('/api/reports/<line>', methods=['GET'])
+    rows, next_cursor = _report_rows('TRUE', {}, default_limit=10)
+    return _reports_response(rows, next_cursor)
+
+@api.route('/api/reports/<line>', methods=['GET'])
+@budget(timeout_ms=2000, max_rows=pagination.MAX_LIMIT + 1, replica=False)
 def get_reports(line):
-    conn = get_db_connection()
-    reports = conn.run(
-        "SELECT id, line, issue_type, description, upvotes, created_at FROM reports WHERE line = :line AND created_at > NOW() - INTERVAL '2 hours' ORDER BY created_at DESC",
-        line=line
-    )
-    conn.close()
-    return jsonify([{
-        'id': r[0],
-        'line': r[1],
-        'issue_type': r[2],
-        'description': r[3],
-        'upvotes': r[4],
-        'created_at': str(r[5])
-    } for r in reports])
-
-@app.route('/api/reports/<int:report_id>/upvote', methods=['POST'])
+    rows, next_cursor = _report_rows('line = :line', {'line': line}, default_limit=pagination.DEFAULT_LIMIT, line=line)
+    return _reports_response(rows, next_cursor)
+
+@api.route('/api/reports/<int:report_id>/upvote', methods=['POST'])
 def upvote_report(report_id):
-    conn = get_db_connection()
-    conn.run(
-        "UPDATE reports SET upvotes = upvotes + 1 WHERE id = :id",
-        id=report_id
-    )
-    conn.close()
+    # Coalesced per report and applied in one batched UPDATE per flush. An
+    # upvote for a report another worker hasn't flushed yet is retried until
+    # its row shows up (WRITE_BEHIND_UPVOTE_RETRY_SECONDS).
+    if report_id > write_behind.REPORT_ID_MAX:
+        raise BadRequest('report id is out of range')
+    write_behind.reports.upvote(report_id)
     return jsonify({'success': True})
 
+ANOMALY_FIELDS = ['id', 'line', 'started_at', 'updated_at', 'ended_at', 'peak_delays',
+                  'expected_delays', 'baseline_std', 'score']
+
+@api.route('/api/anomalies', methods=['GET'])
+@budget(timeout_ms=2000, max_rows=pagination.MAX_LIMIT + 1)
+@cached(ttl=30)
+def get_anomalies():
+    # Delay bursts flagged by anomalies.py, newest first and paged like the
+    # reports routes. ?line= for one line, ?active=true for ongoing ones.
+    limit, after_cursor, cursor_params = pagination.page_params()
+    where = [after_cursor]
+    params = dict(cursor_params)
+    line = request.args.get('line')
+    if line:
+        where.append('line = :line')
+        params['line'] = line.upper()
+    if request.args.get('active', '').lower() in ('1', 'true', 'yes'):
+        where.append('ended_at IS NULL')
+    with budgets.connection() as conn:
+        rows = conn.run(f"""
+            SELECT id, line, created_at, updated_at, ended_at, peak_delays,
+                   expected_delays, baseline_std, score
+            FROM delay_anomalies
+            WHERE {' AND '.join(where)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT :fetch""",
+            fetch=limit + 1, **params
+        )
+    rows, next_cursor = pagination.finish_page(rows, limit, created_at_index=2)
+    return pagination.page_headers(rows_response(rows, ANOMALY_FIELDS), next_cursor)
+
 # ✅ NEW — alerts route
-@app.route('/api/alerts/<line>', methods=['GET'])
+@api.route('/api/alerts/<line>', methods=['GET'])
+@budget(timeout_ms=2000, max_rows=pagination.MAX_LIMIT + 1)
+@cached(ttl=60)
 def get_alerts(line):
-    conn = get_db_connection()
-    alerts = conn.run(
-        "SELECT id, line, alert_type, header, description, created_at FROM alerts WHERE line = :line ORDER BY created_at DESC",
-        line=line.upper()
-    )
-    conn.close()
-    return jsonify([{
-        'id': a[0],
-        'line': a[1],
-        'alert_type': a[2],
-        'header': a[3],
-        'description': a[4],
-        'created_at': str(a[5])
-    } for a in alerts])
-
-@app.route('/api/subscribe', methods=['POST'])
+    # Newest first, paged like the reports routes
+    limit, after_cursor, cursor_params = pagination.page_params()
+    with budgets.connection() as conn:
+        alerts = conn.run(f"""
+            SELECT id, line, alert_type, header, description, created_at 
+            FROM alerts 
+            WHERE line = :line AND {after_cursor}
+            ORDER BY created_at DESC, id DESC
+            LIMIT :fetch""",
+            line=line.upper(), fetch=limit + 1, **cursor_params
+        )
+    alerts, next_cursor = pagination.finish_page(alerts, limit, created_at_index=5)
+    return pagination.page_headers(
+        rows_response(alerts, ['id', 'line', 'alert_type', 'header', 'description', 'created_at']), next_cursor)
+
+@api.route('/api/live')
+@api.route('/api/live/<line>')
+def live_updates(line=None):
+    # Server-Sent Events: line_stats, alert and report diffs as they happen.
+    # Subscribe to one line via the path or several with ?lines=A,C,E.
+    if line:
+        lines = [line.upper()]
+    else:
+        lines = [line.strip().upper() for line in request.args.get('lines', '').split(',') if line.strip()]
+    return Response(live.sse_stream(lines), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@api.route('/api/subscribe', methods=['POST'])
 def subscribe():
     data = request.get_json()
     email = data.get('email')
@@ -209,33 +389,30 @@ def subscribe():
     if not email or not line:
         return jsonify({'error': 'Email and line required'}), 400
 
-    conn = get_db_connection()
     try:
-        conn.run(
-            "INSERT INTO email_subscriptions (email, line) VALUES (:email, :line)",
-            email=email, line=line
-        )
-        conn.close()
+        with db.connection() as conn:
+            conn.run(
+                "INSERT INTO email_subscriptions (email, line) VALUES (:email, :line)",
+                email=email, line=line
+            )
         return jsonify({'success': True, 'message': f'Subscribed to Line {line} alerts!'})
     except Exception as e:
-        conn.close()
         if 'unique' in str(e).lower():
             return jsonify({'success': True, 'message': 'Already subscribed!'})
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/unsubscribe', methods=['POST'])
+@api.route('/api/unsubscribe', methods=['POST'])
 def unsubscribe():
     data = request.get_json()
     email = data.get('email')
     line = data.get('line')
-    conn = get_db_connection()
-    conn.run(
-        "DELETE FROM email_subscriptions WHERE email = :email AND line = :line",
-        email=email, line=line
-    )
-    conn.close()
+    with db.connection() as conn:
+        conn.run(
+            "DELETE FROM email_subscriptions WHERE email = :email AND line = :line",
+            email=email, line=line
+        )
     return jsonify({'success': True})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
+    create_app().run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
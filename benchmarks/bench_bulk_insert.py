@@ -0,0 +1,76 @@
+# Compares the old per-row INSERT path with db.insert_many on a synthetic
+# 10k-row scrape cycle. Writes go to a TEMP table, so the real delays table
+# is never touched.
+#
+#   python benchmarks/bench_bulk_insert.py [--rows 10000] [--batch-size 500]
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db
+from scraper import LINES
+
+COLUMNS = ['line', 'stop_id', 'delay_seconds', 'delay_minutes', 'timestamp']
+
+def synthetic_cycle(n):
+    now = datetime.now()
+    rows = []
+    for _ in range(n):
+        delay_seconds = random.randint(121, 900)
+        rows.append((
+            random.choice(LINES),
+            f"{random.randint(100, 999)}{random.choice('NS')}",
+            delay_seconds,
+            round(delay_seconds / 60, 1),
+            now
+        ))
+    return rows
+
+def per_row(conn, rows):
+    conn.run("START TRANSACTION")
+    for row in rows:
+        conn.run(
+            "INSERT INTO bench_delays (line, stop_id, delay_seconds, delay_minutes, timestamp) VALUES (:line, :stop_id, :delay_seconds, :delay_minutes, :timestamp)",
+            line=row[0], stop_id=row[1], delay_seconds=row[2], delay_minutes=row[3], timestamp=row[4]
+        )
+    conn.run("COMMIT")
+
+def bulk(conn, rows, batch_size):
+    conn.run("START TRANSACTION")
+    db.insert_many(conn, 'bench_delays', COLUMNS, rows, batch_size=batch_size)
+    conn.run("COMMIT")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=db.BATCH_SIZE)
+    args = parser.parse_args()
+
+    rows = synthetic_cycle(args.rows)
+    with db.connection() as conn:
+        conn.run("CREATE TEMP TABLE bench_delays (LIKE delays INCLUDING DEFAULTS)")
+
+        start = time.perf_counter()
+        per_row(conn, rows)
+        per_row_time = time.perf_counter() - start
+        conn.run("TRUNCATE bench_delays")
+
+        start = time.perf_counter()
+        bulk(conn, rows, args.batch_size)
+        bulk_time = time.perf_counter() - start
+
+        conn.run("DROP TABLE bench_delays")
+
+    print(f"Rows per cycle:  {args.rows}")
+    print(f"Per-row inserts: {per_row_time:.2f}s ({args.rows / per_row_time:,.0f} rows/s)")
+    print(f"Bulk inserts:    {bulk_time:.2f}s ({args.rows / bulk_time:,.0f} rows/s, batch size {args.batch_size})")
+    print(f"Speedup:         {per_row_time / bulk_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
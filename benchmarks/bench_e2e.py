@@ -0,0 +1,277 @@
+# End-to-end benchmark: replays a recording (see replay.py) through
+# scrape_all_feeds() / scrape_alerts() against a local stand-in for the MTA
+# endpoints, then drives the API with a concurrent load generator.
+#
+# Needs a local Postgres configured through the usual DB_* variables; use a
+# scratch database, since the replayed cycles are written for real.
+#
+#   python benchmarks/bench_e2e.py [--recording NAME] [--init-db]
+#       [--concurrency 16] [--duration 30] [--target http://127.0.0.1:8000]
+#
+# By default it replays benchmarks/fixtures/recorded, captured from the live
+# feeds with `python benchmarks/replay.py record` (needs network), when that
+# exists. Otherwise it replays the synthetic recording, generating it first
+# if needed, so the benchmark runs from the tree alone. Each recording is
+# reported and baselined under its own name.
+#
+# Results are compared with the saved baseline for the recording, and any
+# metric more than --tolerance worse is flagged. --save-baseline replaces
+# the baseline with this run.
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+
+from replay import FIXTURE_DIR, RECORDED, SYNTHETIC, SYNTHETIC_CYCLES, ReplayServer, synthetic
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# (method, path, weight); {line} and {report_id} are filled per request
+ENDPOINTS = [
+    ('GET', '/api/lines', 20),
+    ('GET', '/api/stats', 10),
+    ('GET', '/api/worst-times', 5),
+    ('GET', '/api/lines/{line}/history', 10),
+    ('GET', '/api/alerts/{line}', 10),
+    ('GET', '/api/reports/recent', 10),
+    ('GET', '/api/reports/{line}', 10),
+    ('POST', '/api/reports', 3),
+    ('POST', '/api/reports/{report_id}/upvote', 2),
+    ('GET', '/api/health', 1)
+]
+
+# Metrics where a higher number is better; everything else is a duration
+HIGHER_IS_BETTER = ('rows_per_second', 'requests_per_second')
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+def replay_scrapes(server, cycles):
+    import scraper
+
+    results = []
+    for cycle in range(cycles):
+        start = time.perf_counter()
+        delays = scraper.scrape_all_feeds()
+        feeds_time = time.perf_counter() - start
+        alerts = scraper.scrape_alerts()
+        cycle_time = time.perf_counter() - start
+        if delays is None or alerts is None:
+            raise RuntimeError(f"Scrape failed on replayed cycle {cycle}")
+        # Delay events upserted or closed plus alert rows upserted or deleted
+        rows = (delays['changed'] + delays['closed'] +
+                len(alerts['new']) + len(alerts['updated']) + len(alerts['removed']))
+        results.append({'cycle_time': cycle_time, 'feeds_time': feeds_time, 'rows': rows})
+        server.advance()
+
+    total_time = sum(r['cycle_time'] for r in results)
+    cycle_times = [r['cycle_time'] for r in results]
+    return {
+        'cycles': len(results),
+        'cycle_time_p50': percentile(cycle_times, 50),
+        'cycle_time_max': max(cycle_times),
+        'feeds_time_p50': percentile([r['feeds_time'] for r in results], 50),
+        'rows_written': sum(r['rows'] for r in results),
+        'rows_per_second': sum(r['rows'] for r in results) / total_time if total_time else 0
+    }
+
+def start_app(port):
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    httpd = make_server('127.0.0.1', port, create_app(), threaded=True)
+    threading.Thread(target=httpd.serve_forever, name='bench-app', daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+def run_load(target, concurrency, duration, lines):
+    weighted = [e for e in ENDPOINTS for _ in range(e[2])]
+    latencies = {}
+    errors = {}
+    report_ids = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            method, path, _ = rng.choice(weighted)
+            if '{report_id}' in path:
+                with lock:
+                    if not report_ids:
+                        continue
+                    report_id = rng.choice(report_ids)
+                url = target + path.format(report_id=report_id)
+            else:
+                url = target + path.format(line=rng.choice(lines))
+            body = None
+            if path == '/api/reports':
+                body = {'line': rng.choice(lines), 'issue_type': 'delay', 'description': 'bench load test'}
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, json=body, timeout=30)
+                ok = response.status_code < 500
+                if ok and path == '/api/reports/recent':
+                    # Upvotes go to recently submitted reports
+                    with lock:
+                        report_ids[:] = [r['id'] for r in response.json()] or report_ids
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.setdefault(path, []).append(elapsed)
+                if not ok:
+                    errors[path] = errors.get(path, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    endpoints = {}
+    for path, samples in sorted(latencies.items()):
+        endpoints[path] = {
+            'requests': len(samples),
+            'errors': errors.get(path, 0),
+            'p50': percentile(samples, 50),
+            'p95': percentile(samples, 95),
+            'p99': percentile(samples, 99)
+        }
+    total = sum(len(s) for s in latencies.values())
+    return {'requests': total, 'requests_per_second': total / wall if wall else 0, 'endpoints': endpoints}
+
+def flatten_metrics(results):
+    metrics = {f"scrape.{k}": v for k, v in results['scrape'].items() if k != 'cycles'}
+    if 'load' in results:
+        metrics['load.requests_per_second'] = results['load']['requests_per_second']
+        for path, stats in results['load']['endpoints'].items():
+            for p in ('p50', 'p95', 'p99'):
+                metrics[f"load.{path}.{p}"] = stats[p]
+    return metrics
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    current = flatten_metrics(results)
+    previous = flatten_metrics(baseline)
+    for key, value in current.items():
+        old = previous.get(key)
+        if not old or value is None or key.endswith('rows_written'):
+            continue
+        change = (value - old) / old
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        if worse > tolerance:
+            regressions.append((key, old, value, change))
+    return regressions
+
+def print_results(results):
+    scrape = results['scrape']
+    print(f"\nScrape: {scrape['cycles']} cycles, p50 {scrape['cycle_time_p50'] * 1000:.0f}ms "
+          f"(feeds {scrape['feeds_time_p50'] * 1000:.0f}ms), max {scrape['cycle_time_max'] * 1000:.0f}ms, "
+          f"{scrape['rows_written']} rows at {scrape['rows_per_second']:.0f} rows/s")
+    if 'load' in results:
+        load = results['load']
+        print(f"Load: {load['requests']} requests, {load['requests_per_second']:.0f} req/s")
+        print(f"  {'endpoint':<34} {'reqs':>6} {'errs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for path, s in load['endpoints'].items():
+            print(f"  {path:<34} {s['requests']:>6} {s['errors']:>5} "
+                  f"{s['p50'] * 1000:>8.1f} {s['p95'] * 1000:>8.1f} {s['p99'] * 1000:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', help='directory name under benchmarks/fixtures '
+                        f"(default: {RECORDED} if present, else {SYNTHETIC})")
+    parser.add_argument('--cycles', type=int, help='scrape cycles to replay (default: every recorded cycle)')
+    parser.add_argument('--init-db', action='store_true', help='create tables before replaying')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of API load; 0 skips it')
+    parser.add_argument('--target', help='benchmark an already running API instead of an in-process server')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before a metric is flagged')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    if args.recording is None:
+        recorded = os.path.isdir(os.path.join(FIXTURE_DIR, RECORDED))
+        args.recording = RECORDED if recorded else SYNTHETIC
+    recording = os.path.join(FIXTURE_DIR, args.recording)
+    if args.recording == SYNTHETIC and not os.path.isdir(recording):
+        synthetic(recording, SYNTHETIC_CYCLES)
+    if not os.path.isdir(recording):
+        parser.error(f"no recording at {recording}")
+    if args.recording == SYNTHETIC:
+        print("Replaying the synthetic recording; capture the live feeds with "
+              "`python benchmarks/replay.py record` to time their real shape.")
+    server = ReplayServer(recording).start()
+    # Must be set before feeds/scraper are imported
+    os.environ['MTA_FEED_BASE_URL'] = server.url
+    print(f"Replaying {len(server.cycles)} recorded cycles from {recording} on {server.url}")
+
+    if args.init_db:
+        import init_db
+        init_db.init_database()
+
+    from scraper import LINES
+
+    results = {
+        'recording': args.recording,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'scrape': replay_scrapes(server, args.cycles or len(server.cycles))
+    }
+
+    if args.duration > 0:
+        httpd = None
+        target = args.target
+        if not target:
+            httpd, target = start_app(args.port)
+        try:
+            results['load'] = run_load(target.rstrip('/'), args.concurrency, args.duration, LINES)
+        finally:
+            if httpd is not None:
+                httpd.shutdown()
+    server.stop()
+
+    print_results(results)
+
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.recording}.json")
+    regressions = []
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\nCompared with baseline from {baseline['started_at']}:")
+        if regressions:
+            for key, old, new, change in regressions:
+                print(f"  ⚠️ REGRESSION {key}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+        else:
+            print(f"  No regressions beyond {args.tolerance:.0%}")
+    else:
+        print(f"\nNo baseline at {baseline_path}; run with --save-baseline to create one")
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {baseline_path}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Load-tests the notification pipeline against FakeSender: N subscribers for
+# one synthetic line, fanned out through the real queue, rate limiter and
+# email_alert_log bookkeeping. Log rows for the synthetic line are removed
+# afterwards.
+#
+#   python benchmarks/bench_email_fanout.py [--subscribers 5000] [--rate 10]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db
+from notifications import NotificationPipeline, FakeSender
+
+BENCH_LINE = 'BENCH'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--rate', type=float, default=10, help='provider requests per second')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    args = parser.parse_args()
+
+    sender = FakeSender(latency=args.latency, failure_rate=args.failure_rate)
+    pipeline = NotificationPipeline(sender=sender, workers=args.workers, rate=args.rate,
+                                    burst=args.workers, batch_size=args.batch_size)
+    pipeline.start()
+    emails = [f"subscriber{i}@example.com" for i in range(args.subscribers)]
+
+    start = time.perf_counter()
+    with db.connection() as conn:
+        job = pipeline.log(conn, BENCH_LINE, 4.2, emails)
+    pipeline.submit(job)
+    enqueue_time = time.perf_counter() - start
+    pipeline._queue.join()
+    total_time = time.perf_counter() - start
+    pipeline.stop()
+
+    with db.connection() as conn:
+        statuses = conn.run(
+            "SELECT status, COUNT(*) FROM email_alert_log WHERE line = :line GROUP BY status",
+            line=BENCH_LINE
+        )
+        conn.run("DELETE FROM email_alert_log WHERE line = :line", line=BENCH_LINE)
+
+    print(f"Subscribers:    {args.subscribers}")
+    print(f"Enqueue time:   {enqueue_time * 1000:.0f}ms (time the scrape thread is blocked)")
+    print(f"Delivery time:  {total_time:.1f}s ({args.subscribers / total_time:,.0f} emails/s)")
+    print(f"Provider calls: {sender.calls} ({pipeline.stats['retries']} retries)")
+    print(f"Log statuses:   {dict(statuses)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# Compares the old per-train, per-stop loop from scrape_all_feeds with the
+# columnar extract.flatten / extract.delayed path on one feed snapshot.
+#
+#   python benchmarks/bench_extract.py [--fixture PATH] [--repeat 20]
+#
+# Without a recorded fixture it times a generated FeedMessage (same wire
+# format, ~20% of stops delayed), so it runs straight from the tree. To time
+# the live feed's shape, record a fixture first (needs network):
+#   python benchmarks/bench_extract.py --record
+# A recording under fixtures/ is then used by default; --synthetic times the
+# generated feed anyway.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nyct_gtfs import NYCTFeed
+from nyct_gtfs.compiled_gtfs import gtfs_realtime_pb2
+import requests
+
+import extract
+from feeds import feed_url, group_by_feed, route_to_line
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+DEFAULT_LINES = ['A', 'C', 'E']
+
+def fixture_path(lines):
+    return os.path.join(FIXTURE_DIR, feed_url(lines[0]).rsplit('%2F', 1)[-1] + '.pb')
+
+def record(lines, path):
+    response = requests.get(feed_url(lines[0]), timeout=30)
+    response.raise_for_status()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(response.content)
+    print(f"Recorded {len(response.content)} bytes to {path}")
+
+def synthetic_feed(lines, trips=600, stops=30, delayed_share=0.2, seed=13, cycle=0):
+    # Trips and stops depend only on seed; delays also vary with cycle, so
+    # consecutive cycles look like successive snapshots of the same service
+    layout = random.Random(seed)
+    delays = random.Random(f"{seed}:{cycle}")
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = '1.0'
+    now = int(time.time())
+    message.header.timestamp = now
+    for i in range(trips):
+        entity = message.entity.add()
+        entity.id = str(i)
+        line = layout.choice(lines)
+        trip = entity.trip_update.trip
+        trip.trip_id = f"{i:06d}_{line}..N{layout.randint(10, 99)}R"
+        trip.route_id = line
+        trip.start_date = datetime.now().strftime('%Y%m%d')
+        for s in range(stops):
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = f"{line}{s:02d}{layout.choice('NS')}"
+            update.arrival.time = now + s * 90
+            if delays.random() < delayed_share:
+                update.arrival.delay = delays.randint(121, 900)
+    return message.SerializeToString()
+
+def nested_loop(content, url, lines):
+    # The loop scrape_all_feeds used before extract.py. nyct_gtfs's
+    # StopTimeUpdate has no `delay`, so the raw GTFS-rt field is read through
+    # the wrapper to make both paths find the same delays.
+    feed = NYCTFeed(url, fetch_immediately=False)
+    feed.load_gtfs_bytes(content)
+    delays = []
+    trains_by_line = {line: 0 for line in lines}
+    delays_by_line = {line: 0 for line in lines}
+    for train in feed.trips:
+        line = route_to_line(train.route_id)
+        if line not in trains_by_line:
+            continue
+        trains_by_line[line] += 1
+        for stop in train.stop_time_updates:
+            raw = stop._stop_time_update
+            event = raw.arrival if raw.HasField('arrival') else raw.departure
+            delay_seconds = getattr(stop, 'delay', event.delay) or 0
+            if delay_seconds > 120:
+                delays.append({
+                    'line': line,
+                    'trip_id': train.trip_id,
+                    'stop_id': stop.stop_id,
+                    'delay_seconds': delay_seconds,
+                    'delay_minutes': round(delay_seconds / 60, 1),
+                    'timestamp': datetime.now()
+                })
+                delays_by_line[line] += 1
+    return delays, delays_by_line
+
+def vectorized(content, lines):
+    snapshot = extract.flatten(content, lines)
+    delays, delays_by_line = extract.delayed(snapshot)
+    return delays, dict(zip(snapshot.lines, delays_by_line.tolist()))
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, samples
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', default=','.join(DEFAULT_LINES),
+                        help='lines served by one feed, e.g. A,C,E')
+    parser.add_argument('--fixture')
+    parser.add_argument('--record', action='store_true', help='download the live feed to --fixture and exit')
+    parser.add_argument('--synthetic', action='store_true', help='time a generated feed instead of a recorded one')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    lines = args.lines.split(',')
+    if len(group_by_feed(lines)) != 1:
+        parser.error('--lines must all come from the same feed')
+    url = feed_url(lines[0])
+    path = args.fixture or fixture_path(lines)
+
+    if args.record:
+        record(lines, path)
+        return
+
+    if args.fixture and not os.path.exists(path):
+        parser.error(f"no fixture at {path}")
+    synthetic = args.synthetic or not os.path.exists(path)
+    if synthetic:
+        content = synthetic_feed(lines)
+        source = 'synthetic feed'
+        print("Timing a synthetic feed; record the live one with --record to time its real shape.")
+    else:
+        with open(path, 'rb') as f:
+            content = f.read()
+        source = path
+
+    print(f"Fixture: {source}, {len(content)} bytes")
+    (old_delays, old_counts), old = timed(lambda: nested_loop(content, url, lines), args.repeat)
+    (new_delays, new_counts), new = timed(lambda: vectorized(content, lines), args.repeat)
+
+    def key(d):
+        return (d['trip_id'], d['stop_id'], d['delay_seconds'])
+    assert sorted(map(key, old_delays)) == sorted(map(key, new_delays)), 'paths disagree on delayed stops'
+    assert old_counts == new_counts, 'paths disagree on per-line counts'
+
+    print(f"Delayed stops: {len(new_delays)}  per line: {new_counts}")
+    print(f"Nested loop:  median {statistics.median(old) * 1000:7.2f}ms  min {min(old) * 1000:7.2f}ms")
+    print(f"Vectorized:   median {statistics.median(new) * 1000:7.2f}ms  min {min(new) * 1000:7.2f}ms")
+    print(f"Speedup:      {statistics.median(old) / statistics.median(new):.1f}x"
+          + (" (synthetic feed)" if synthetic else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Compares the old per-row dict + str() + jsonify route body with
+# serialize.RowEncoder (orjson and stdlib paths, buffered and streamed) on a
+# large synthetic history payload shaped like /api/lines/<line>/history rows,
+# and reports compressed sizes.
+#
+#   python benchmarks/bench_serialize.py [--rows 50000] [--repeat 10]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, jsonify
+
+import serialize
+
+FIELDS = ['bucket', 'hour', 'delay_count', 'avg_delay']
+
+def history_rows(n):
+    start = datetime(2026, 1, 1)
+    rows = []
+    for i in range(n):
+        bucket = start + timedelta(minutes=5 * i)
+        rows.append((bucket, bucket, random.randint(1, 40), Decimal(random.randint(21, 150)) / 10))
+    return rows
+
+def old_route(rows):
+    # As the routes were
+    result = []
+    for row in rows:
+        result.append({
+            'bucket': str(row[0]),
+            'hour': str(row[1]),
+            'delay_count': row[2],
+            'avg_delay': str(row[3])
+        })
+    return jsonify(result).get_data()
+
+def row_encoder(rows, use_orjson):
+    saved = serialize.orjson
+    if not use_orjson:
+        serialize.orjson = None
+    try:
+        return serialize.RowEncoder(FIELDS).encode_rows(rows)
+    finally:
+        serialize.orjson = saved
+
+def streamed(rows):
+    return b''.join(serialize.RowEncoder(FIELDS).iter_rows(rows))
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return result, statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    random.seed(18)
+    rows = history_rows(args.rows)
+    app = Flask(__name__)
+
+    with app.app_context():
+        baseline, old = timed(lambda: old_route(rows), args.repeat)
+    cases = [('dicts + str() + jsonify', baseline, old)]
+    if serialize.orjson is not None:
+        body, t = timed(lambda: row_encoder(rows, True), args.repeat)
+        cases.append(('RowEncoder (orjson)', body, t))
+    else:
+        print("orjson is not installed; skipping the orjson path")
+    body, t = timed(lambda: row_encoder(rows, False), args.repeat)
+    cases.append(('RowEncoder (stdlib)', body, t))
+    body, t = timed(lambda: streamed(rows), args.repeat)
+    cases.append(('RowEncoder streamed', body, t))
+
+    import json
+    expected = json.loads(baseline)
+    print(f"{args.rows} rows, median of {args.repeat} runs")
+    for name, body, t in cases:
+        assert json.loads(body) == expected, f"{name} output differs from the old route"
+        print(f"  {name:<26} {t * 1000:8.1f}ms  {old / t:5.1f}x  {len(body) / 1024:8.0f} KiB")
+
+    body = cases[-1][1]
+    compressed, t = timed(lambda: serialize.compress(body, 'gzip'), args.repeat)
+    print(f"  gzip level {serialize.GZIP_LEVEL:<15} {t * 1000:8.1f}ms         {len(compressed) / 1024:8.0f} KiB")
+    if serialize.brotli is not None:
+        compressed, t = timed(lambda: serialize.compress(body, 'br'), args.repeat)
+        print(f"  brotli quality {serialize.BROTLI_QUALITY:<11} {t * 1000:8.1f}ms         {len(compressed) / 1024:8.0f} KiB")
+    else:
+        print("  brotli is not installed; skipping")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Web worker startup: time from a fresh interpreter to the first response,
+# split into importing app.py, create_app() (including the warm-up when it is
+# on) and the first request, with and without the warm-up. Each run is a new
+# process so nothing is cached between runs.
+#
+# Routes that read the database need the usual DB_* variables; without a
+# database the warm-up fails fast and only /api/health is meaningful.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--path /api/lines]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in the child process; prints one JSON line of timings in seconds
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app(warm_up=sys.argv[2] == '1')
+created = time.perf_counter()
+with flask_app.test_client() as client:
+    status = client.get(sys.argv[1]).status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': done - created, 'total': done - start, 'status': status}))
+'''
+
+def run_once(path, warm_up):
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, path, '1' if warm_up else '0'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/api/health')
+    args = parser.parse_args()
+
+    print(f"First request to {args.path}, median of {args.runs} fresh processes")
+    for warm_up in (False, True):
+        runs = [run_once(args.path, warm_up) for _ in range(args.runs)]
+        timings = {k: statistics.median(r[k] for r in runs) for k in ('import', 'create_app', 'first_request', 'total')}
+        print(f"  warm-up {'on ' if warm_up else 'off'}  import {timings['import'] * 1000:7.1f}ms  "
+              f"create_app {timings['create_app'] * 1000:7.1f}ms  "
+              f"first request {timings['first_request'] * 1000:7.1f}ms (HTTP {runs[-1]['status']})  "
+              f"total {timings['total'] * 1000:7.1f}ms")
+
+if __name__ == "__main__":
+    main()
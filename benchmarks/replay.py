@@ -0,0 +1,184 @@
+# Recorded MTA feeds and a local HTTP stand-in that serves them back, one
+# scrape cycle at a time.
+#
+# A recording is a directory of cycles, each holding one protobuf per
+# realtime feed plus the alerts JSON:
+#
+#   fixtures/<recording>/000/gtfs-ace.pb
+#   fixtures/<recording>/000/subway-alerts.json
+#   fixtures/<recording>/001/...
+#
+# Record from the live MTA endpoints (needs network):
+#   python benchmarks/replay.py record [--name recorded] [--cycles 3] [--interval 60]
+# or generate a synthetic one:
+#   python benchmarks/replay.py synthetic [--name synthetic] [--cycles 10]
+#
+# bench_e2e.py replays fixtures/recorded when there is one, and otherwise
+# the synthetic recording, which it generates on first use.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+import argparse
+import threading
+import hashlib
+import random
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDED = 'recorded'
+SYNTHETIC = 'synthetic'
+SYNTHETIC_CYCLES = 10
+ALERTS_FILE = 'subway-alerts.json'
+
+def endpoint_name(url):
+    # .../nyct%2Fgtfs-ace -> gtfs-ace, .../camsys%2Fsubway-alerts.json -> subway-alerts.json
+    return unquote(urlparse(url).path).rsplit('/', 1)[-1]
+
+def feed_file(url):
+    name = endpoint_name(url)
+    return name if name.endswith('.json') else name + '.pb'
+
+def cycle_dirs(recording):
+    return sorted(
+        os.path.join(recording, d) for d in os.listdir(recording)
+        if os.path.isdir(os.path.join(recording, d))
+    )
+
+def record(recording, cycles, interval):
+    import requests
+    from feeds import group_by_feed
+    from scraper import LINES, ALERT_FEED_URL
+
+    urls = list(group_by_feed(LINES)) + [ALERT_FEED_URL]
+    for cycle in range(cycles):
+        started = time.monotonic()
+        path = os.path.join(recording, f"{cycle:03d}")
+        os.makedirs(path, exist_ok=True)
+        for url in urls:
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+            with open(os.path.join(path, feed_file(url)), 'wb') as f:
+                f.write(response.content)
+        print(f"Recorded cycle {cycle + 1}/{cycles} to {path}")
+        if cycle < cycles - 1:
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+def synthetic_alerts(lines, cycle, seed=13, count=20):
+    # A stable core of alerts plus a few that come and go between cycles
+    rng = random.Random(f"{seed}:{cycle}")
+    entities = []
+    for i in range(count):
+        if i >= count - 5 and rng.random() < 0.5:
+            continue
+        line = lines[i % len(lines)]
+        header = f"[{line}] Trains are running with delays while we address a signal problem ({i})"
+        if i % 7 == 0:
+            header += f" Updated {cycle}"
+        entities.append({
+            'id': f"lmm:alert:{seed}{i:04d}",
+            'alert': {
+                'informed_entity': [{'agency_id': 'MTASBWY', 'route_id': line}],
+                'header_text': {'translation': [{'text': header, 'language': 'en'}]},
+                'description_text': {'translation': [{'text': 'Expect longer waits.', 'language': 'en'}]}
+            }
+        })
+    return json.dumps({'header': {'timestamp': int(time.time())}, 'entity': entities}).encode('utf-8')
+
+def synthetic(recording, cycles, trips=600, stops=30):
+    from bench_extract import synthetic_feed
+    from feeds import group_by_feed
+    from scraper import LINES, ALERT_FEED_URL
+
+    for cycle in range(cycles):
+        path = os.path.join(recording, f"{cycle:03d}")
+        os.makedirs(path, exist_ok=True)
+        for seed, (url, lines) in enumerate(group_by_feed(LINES).items()):
+            with open(os.path.join(path, feed_file(url)), 'wb') as f:
+                f.write(synthetic_feed(lines, trips=trips, stops=stops, seed=seed, cycle=cycle))
+        with open(os.path.join(path, feed_file(ALERT_FEED_URL)), 'wb') as f:
+            f.write(synthetic_alerts(LINES, cycle))
+        print(f"Generated cycle {cycle + 1}/{cycles} in {path}")
+
+class ReplayServer:
+    """Serves one recorded cycle at a time under the MTA's URL paths.
+
+    Responses carry an ETag of the body, so the scraper's conditional GETs
+    behave as they do against the real endpoints.
+    """
+
+    def __init__(self, recording, port=0):
+        self.cycles = cycle_dirs(recording)
+        if not self.cycles:
+            raise ValueError(f"No recorded cycles in {recording}")
+        self.index = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name='replay-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def advance(self):
+        # Moves to the next cycle, wrapping around; returns False on wrap
+        with self._lock:
+            self.index = (self.index + 1) % len(self.cycles)
+            return self.index != 0
+
+    def _serve(self, handler):
+        with self._lock:
+            self.requests += 1
+            path = os.path.join(self.cycles[self.index], feed_file(handler.path))
+        if not os.path.exists(path):
+            handler.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if handler.headers.get('If-None-Match') == etag:
+            handler.send_response(304)
+            handler.end_headers()
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json' if path.endswith('.json') else 'application/x-protobuf')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('ETag', etag)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['record', 'synthetic'])
+    parser.add_argument('--name')
+    parser.add_argument('--cycles', type=int, help='default 3 recorded or 10 synthetic cycles')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between recorded cycles')
+    args = parser.parse_args()
+
+    name = args.name or (RECORDED if args.command == 'record' else SYNTHETIC)
+    recording = os.path.join(FIXTURE_DIR, name)
+    if args.command == 'record':
+        record(recording, args.cycles or 3, args.interval)
+    else:
+        synthetic(recording, args.cycles or SYNTHETIC_CYCLES)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Runs several sharded scheduler workers against a replayed recording and
+# a real database, kills one part way through and prints the lease and
+# cycle status before and after its feeds move to the survivors.
+#
+# Needs the usual DB_* variables and a recording (see replay.py):
+#
+#   python benchmarks/run_shards.py [--recording synthetic] [--workers 3]
+#       [--interval 10] [--cycles 6]
+
+import argparse
+import subprocess
+import signal
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from replay import FIXTURE_DIR, ReplayServer
+import shards
+import db
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def spawn(worker_id, server_url, interval, lease):
+    env = dict(os.environ,
+               SCRAPE_SHARDING='1',
+               SCHEDULER_WORKER_ID=worker_id,
+               SCRAPE_LEASE_SECONDS=str(lease),
+               FEEDS_INTERVAL_SECONDS=str(interval),
+               MTA_FEED_BASE_URL=server_url,
+               HOT_WINDOW_PORT='0',
+               METRICS_PORT='0')
+    return subprocess.Popen([sys.executable, 'scheduler.py'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def report(title):
+    with db.connection() as conn:
+        workers, leases, recent = shards.status(conn, cycles=5)
+    print(f"\n{title}")
+    for worker_id, _, _, live in workers:
+        owned = [feed for feed, owner, _, held in leases if owner == worker_id and held]
+        print(f"  {worker_id:<10} {'live' if live else 'gone':<5} {', '.join(owned) or '-'}")
+    for cycle, _, state, ok, failed, n_missing, n_workers, _ in recent:
+        print(f"  cycle {cycle}: {state}, {ok} ok / {failed} failed / {n_missing} missing from {n_workers} worker(s)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', default='synthetic')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=10)
+    parser.add_argument('--cycles', type=int, default=6, help='cycles to run before and after the kill')
+    args = parser.parse_args()
+
+    server = ReplayServer(os.path.join(FIXTURE_DIR, args.recording)).start()
+    lease = args.interval * 3
+    procs = {f"worker-{i}": spawn(f"worker-{i}", server.url, args.interval, lease) for i in range(args.workers)}
+    try:
+        time.sleep(args.interval * args.cycles)
+        report("Before the kill:")
+
+        victim = sorted(procs)[-1]
+        procs.pop(victim).send_signal(signal.SIGKILL)
+        print(f"\nKilled {victim}; its leases expire after {lease:.0f}s")
+        time.sleep(lease + args.interval * args.cycles)
+        report("After the kill:")
+    finally:
+        for proc in procs.values():
+            proc.send_signal(signal.SIGTERM)
+        for proc in procs.values():
+            proc.wait(timeout=30)
+        server.stop()
+
+if __name__ == "__main__":
+    main()
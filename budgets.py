@@ -0,0 +1,142 @@
+from flask import request, g, jsonify, has_request_context
+from pg8000.exceptions import DatabaseError
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from functools import wraps
+import threading
+import time
+import os
+import db
+import metrics
+from cache import response_cache, request_key, entry_response, current_data_version
+
+load_dotenv()
+
+# Defaults for routes that don't set their own budget
+STATEMENT_TIMEOUT_MS = int(os.getenv('API_STATEMENT_TIMEOUT_MS', 3000))
+MAX_ROWS = int(os.getenv('API_MAX_ROWS', 10000))
+# After a route goes over budget it stops querying for this long and serves
+# its cached responses, stale or not, or a 503
+SHED_SECONDS = float(os.getenv('API_BUDGET_SHED_SECONDS', 15))
+
+QUERY_CANCELED = '57014'
+
+budget_exceeded = metrics.registry.counter(
+    'subway_query_budget_exceeded_total', 'Requests that went over their route\'s query budget', ['route', 'reason'])
+degraded = metrics.registry.counter(
+    'subway_degraded_responses_total', 'Requests answered without querying because of a query budget',
+    ['route', 'outcome'])
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+class Budget:
+    __slots__ = ('timeout_ms', 'max_rows', 'replica', 'max_lag', 'rows')
+
+    def __init__(self, timeout_ms, max_rows, replica, max_lag):
+        self.timeout_ms = timeout_ms
+        self.max_rows = max_rows
+        self.replica = replica
+        self.max_lag = max_lag
+        self.rows = 0
+
+class BudgetedConnection:
+    # Passes every statement the rows left in the request's budget, plus one
+    # to tell an exact fit from going over, as :budget_limit for its own
+    # LIMIT; a statement that returns more anyway still counts against the
+    # budget. A statement_timeout cancel becomes BudgetExceeded.
+    def __init__(self, conn, budget):
+        self._conn = conn
+        self._budget = budget
+
+    def run(self, sql, **params):
+        left = self._budget.max_rows - self._budget.rows
+        try:
+            rows = self._conn.run(sql, budget_limit=left + 1, **params)
+        except DatabaseError as e:
+            if e.args and isinstance(e.args[0], dict) and e.args[0].get('C') == QUERY_CANCELED:
+                raise BudgetExceeded('timeout', f"statement ran past {self._budget.timeout_ms}ms") from e
+            raise
+        if rows:
+            if len(rows) > left:
+                raise BudgetExceeded('rows', f"over {self._budget.max_rows} rows")
+            self._budget.rows += len(rows)
+        return rows
+
+def _begin(conn, budget):
+    conn.run("START TRANSACTION READ ONLY")
+    conn.run("SELECT set_config('statement_timeout', :ms, true)", ms=str(budget.timeout_ms))
+
+def _caught_up(conn, version):
+    # Whether this connection has replayed the data_version the response
+    # will be cached under; a lagging replica would otherwise fill the cache
+    # with older data under the newer version until the next scrape
+    if version is None:
+        return True
+    rows = conn.run("SELECT version FROM data_version WHERE id = 1")
+    return bool(rows) and rows[0][0] >= version
+
+@contextmanager
+def connection():
+    # The checkout for a budgeted route's queries: a read-only transaction on
+    # a replica (or the primary) with the route's statement_timeout. Outside
+    # a budgeted route this is a plain primary connection.
+    budget = g.get('query_budget') if has_request_context() else None
+    if budget is None:
+        with db.connection() as conn:
+            yield conn
+        return
+    if budget.replica:
+        with db.read_connection(budget.max_lag) as conn:
+            _begin(conn, budget)
+            if _caught_up(conn, current_data_version()[0]):
+                yield BudgetedConnection(conn, budget)
+                conn.run("COMMIT")
+                return
+            conn.run("ROLLBACK")
+    with db.connection() as conn:
+        _begin(conn, budget)
+        yield BudgetedConnection(conn, budget)
+        conn.run("COMMIT")
+
+_shed_until = {}
+_shed_lock = threading.Lock()
+
+def _degrade(route):
+    entry = response_cache.peek(request_key())
+    if entry is not None:
+        degraded.inc(route=route, outcome='stale')
+        response = entry_response(entry)
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        return response
+    degraded.inc(route=route, outcome='shed')
+    response = jsonify({'error': 'This data is temporarily unavailable, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(SHED_SECONDS))
+    return response
+
+def budget(timeout_ms=None, max_rows=None, replica=True, max_lag=None):
+    # Goes above @cached so a shed route still serves what the cache holds.
+    # replica=False keeps a route on the primary, e.g. when it must see
+    # writes straight away; max_lag overrides DB_REPLICA_MAX_LAG_SECONDS.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            route = request.url_rule.rule
+            if time.monotonic() < _shed_until.get(route, 0):
+                return _degrade(route)
+            g.query_budget = Budget(timeout_ms or STATEMENT_TIMEOUT_MS, max_rows or MAX_ROWS, replica, max_lag)
+            try:
+                return view(*args, **kwargs)
+            except (BudgetExceeded, db.PoolTimeout) as e:
+                budget_exceeded.inc(route=route, reason=getattr(e, 'reason', 'pool'))
+                print(f"⚠️ {request.path} over its query budget ({e}), shedding {route} for {SHED_SECONDS:.0f}s")
+                with _shed_lock:
+                    _shed_until[route] = time.monotonic() + SHED_SECONDS
+                return _degrade(route)
+            finally:
+                g.pop('query_budget', None)
+        return wrapper
+    return decorator
@@ -0,0 +1,203 @@
+from flask import request, make_response, Response
+from collections import OrderedDict
+from functools import wraps
+from dotenv import load_dotenv
+from datetime import datetime
+import threading
+import hashlib
+import time
+import os
+import db
+import serialize
+
+load_dotenv()
+
+MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 512))
+# How often a web worker re-reads data_version to notice a finished scrape
+VERSION_CHECK_SECONDS = float(os.getenv('CACHE_VERSION_CHECK_SECONDS', 5))
+# Response headers that are part of the payload and must be replayed on hits
+CACHED_HEADERS = ('Link', 'X-Next-Cursor')
+
+class CacheEntry:
+    __slots__ = ('body', 'status', 'mimetype', 'headers', 'etag', 'last_modified', 'expires_at', 'version',
+                 'variants')
+
+    def __init__(self, body, status, mimetype, expires_at, version, last_modified, headers=()):
+        self.body = body
+        self.headers = list(headers)
+        self.status = status
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.version = version
+        self.variants = {}
+
+    def encoded(self, encoding):
+        # Compressed once per entry and encoding instead of on every hit
+        body = self.variants.get(encoding)
+        if body is None:
+            body = serialize.compress(self.body, encoding)
+            self.variants[encoding] = body
+        return body
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry = None
+        self.error = None
+
+class ResponseCache:
+    """Bounded LRU of rendered responses with single-flight misses.
+
+    Entries expire after their route's TTL or as soon as the scraper bumps
+    data_version, whichever comes first.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    def _fresh(self, entry, version):
+        return entry.expires_at > time.monotonic() and entry.version == version
+
+    def get_or_compute(self, key, version, compute, wait_timeout=30):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry, version):
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            # Another request is already querying the database for this key
+            if flight.event.wait(wait_timeout) and flight.entry is not None:
+                return flight.entry
+            if flight.error is not None:
+                raise flight.error
+            return compute()
+
+        try:
+            entry = compute()
+            flight.entry = entry
+            if entry.status == 200:
+                with self._lock:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self._evictions += 1
+            return entry
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def peek(self, key):
+        # The stored entry even if it has expired, for serving stale when
+        # the database can't answer (see budgets.py)
+        with self._lock:
+            return self._entries.get(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'evictions': self._evictions
+            }
+
+response_cache = ResponseCache()
+
+# data_version is a single row the scraper bumps after every write, so web
+# workers can drop cached responses before their TTL runs out
+_version = (None, None)
+_version_checked_at = 0.0
+_version_lock = threading.Lock()
+
+def bump_data_version(conn):
+    conn.run("UPDATE data_version SET version = version + 1, updated_at = NOW() WHERE id = 1")
+
+def current_data_version():
+    global _version, _version_checked_at
+    with _version_lock:
+        if time.monotonic() - _version_checked_at < VERSION_CHECK_SECONDS:
+            return _version
+        try:
+            with db.connection() as conn:
+                rows = conn.run("SELECT version, updated_at FROM data_version WHERE id = 1")
+            if rows:
+                _version = (rows[0][0], rows[0][1])
+        except Exception as e:
+            # Fall back to TTL-only expiry rather than failing the request
+            print(f"Failed to read data version: {e}")
+        _version_checked_at = time.monotonic()
+        return _version
+
+def expire_version_check():
+    # Called when a live event arrives so the next request re-reads
+    # data_version instead of waiting out VERSION_CHECK_SECONDS
+    global _version_checked_at
+    with _version_lock:
+        _version_checked_at = 0.0
+
+def request_key():
+    return (request.path, request.query_string)
+
+def entry_response(entry):
+    encoding = None
+    if entry.mimetype == serialize.JSON_MIMETYPE and len(entry.body) >= serialize.COMPRESS_MIN_BYTES:
+        encoding = serialize.negotiate_encoding()
+    if encoding:
+        response = Response(entry.encoded(encoding), status=entry.status, mimetype=entry.mimetype, headers=entry.headers)
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f"{entry.etag}-{encoding}")
+    else:
+        response = Response(entry.body, status=entry.status, mimetype=entry.mimetype, headers=entry.headers)
+        response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.cache_control.max_age = max(0, int(entry.expires_at - time.monotonic()))
+    return response.make_conditional(request)
+
+def cached(ttl):
+    # Caches a read-only route's rendered response per path and query string
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version, updated_at = current_data_version()
+
+            def compute():
+                response = make_response(view(*args, **kwargs))
+                return CacheEntry(
+                    response.get_data(), response.status_code, response.mimetype,
+                    time.monotonic() + ttl, version, updated_at or datetime.utcnow(),
+                    [(h, response.headers[h]) for h in CACHED_HEADERS if h in response.headers]
+                )
+
+            return entry_response(response_cache.get_or_compute(request_key(), version, compute))
+        return wrapper
+    return decorator
@@ -0,0 +1,48 @@
+import pytest
+
+class RecordingConn:
+    """Stands in for a pg8000.native connection.
+
+    Every run(sql, **params) is recorded in `statements`. A statement gets
+    the reply registered with on() for the first fragment it contains, or
+    `rows`; a reply is the rows themselves, a callable taking (sql, params)
+    or an exception to raise. Setting `error` fails every statement, as if
+    the connection were gone.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.replies = []
+        self.statements = []
+        self.error = None
+        self.closed = False
+
+    def on(self, fragment, reply):
+        self.replies.append((fragment, reply))
+        return self
+
+    def run(self, sql, **params):
+        self.statements.append((sql, params))
+        if self.error is not None:
+            raise self.error
+        for fragment, reply in self.replies:
+            if fragment in sql:
+                if isinstance(reply, BaseException):
+                    raise reply
+                return reply(sql, params) if callable(reply) else reply
+        return self.rows
+
+    def sql(self):
+        # The statements run so far with their whitespace collapsed
+        return [' '.join(sql.split()) for sql, _ in self.statements]
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def make_conn():
+    return RecordingConn
+
+@pytest.fixture
+def conn():
+    return RecordingConn()
@@ -0,0 +1,431 @@
+import pg8000.native
+from pg8000.exceptions import InterfaceError
+from dotenv import load_dotenv
+from contextlib import contextmanager
+import threading
+import time
+import os
+import metrics
+
+load_dotenv()
+
+class Connection(pg8000.native.Connection):
+    # Every statement's latency goes into subway_db_query_seconds, labelled
+    # by verb and table
+    def run(self, sql, stream=None, types=None, **params):
+        start = time.monotonic()
+        try:
+            result = super().run(sql, stream=stream, types=types, **params)
+        except Exception:
+            metrics.observe_query(sql, time.monotonic() - start, failed=True)
+            raise
+        metrics.observe_query(sql, time.monotonic() - start)
+        return result
+
+def connect(host=None, port=None):
+    return Connection(
+        host=host or os.getenv('DB_HOST'),
+        port=int(port or os.getenv('DB_PORT', 5432)),
+        database=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        ssl_context=True
+    )
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pg8000 connections.
+
+    Connections are opened lazily up to max_size. Idle connections are
+    pinged on checkout once they have sat unused for health_check_after
+    seconds and are closed once they have been idle for max_idle seconds.
+    """
+
+    def __init__(self, max_size=5, max_idle=300, health_check_after=30,
+                 checkout_timeout=10, connect=connect):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._pid = os.getpid()
+        self._in_use = 0
+        self._waiters = 0
+        self._checkouts = 0
+        self._reconnects = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _reset_after_fork(self):
+        # Sockets inherited from a parent process (gunicorn --preload) must
+        # never be shared, so a forked child starts with an empty pool.
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiters = 0
+        self._pid = os.getpid()
+
+    def _evict_idle(self, now):
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.max_idle:
+                self._size -= 1
+                _close_quietly(conn)
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def _is_healthy(self, conn):
+        try:
+            conn.run("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        conn = None
+        last_used = None
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset_after_fork()
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            waited = time.monotonic() - start
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+            self._checkouts += 1
+            self._in_use += 1
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif time.monotonic() - last_used > self.health_check_after and not self._is_healthy(conn):
+                _close_quietly(conn)
+                conn = self._connect()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+            if broken:
+                self._size -= 1
+                _close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        with self.checked_out(self.acquire()) as conn:
+            yield conn
+
+    @contextmanager
+    def checked_out(self, conn):
+        # Releases a connection from acquire() when the block ends, dropping
+        # it if the block broke it
+        try:
+            yield conn
+        except InterfaceError:
+            # Socket-level failure: drop the connection so the next checkout
+            # reconnects instead of reusing a dead socket.
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            broken = False
+            try:
+                conn.run("ROLLBACK")
+            except Exception:
+                broken = True
+            self.release(conn, broken=broken)
+            raise
+        except BaseException:
+            # GreenletExit from a killed gevent worker, KeyboardInterrupt or
+            # GeneratorExit: the connection may be stopped mid-statement, so
+            # it is dropped rather than rolled back
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.run("START TRANSACTION")
+            yield conn
+            conn.run("COMMIT")
+
+    def warm(self, count=None):
+        # Opens connections up front so the first requests after a worker
+        # boots don't each pay for a connect and login
+        count = self.max_size if count is None else min(count, self.max_size)
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return len(conns)
+
+    def close(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                _close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'open': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'reconnects': self._reconnects,
+                'timeouts': self._timeouts,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 1),
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 1)
+            }
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_tracked = False
+_router = None
+
+def init_pool(max_size=None, **kwargs):
+    global _pool, _pool_tracked, _router
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        if _router is not None:
+            _router.close()
+            _router = None
+        if max_size is None:
+            max_size = int(os.getenv('DB_POOL_SIZE', 5))
+        _pool = ConnectionPool(
+            max_size=max_size,
+            max_idle=int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            checkout_timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            **kwargs
+        )
+        if not _pool_tracked:
+            metrics.track_pool(pool_metrics)
+            _pool_tracked = True
+        return _pool
+
+def get_pool():
+    if _pool is None:
+        init_pool()
+    return _pool
+
+def connection():
+    return get_pool().connection()
+
+def transaction():
+    return get_pool().transaction()
+
+def pool_metrics():
+    return get_pool().metrics()
+
+# Read replicas for the API's read-only routes, as host[:port] with the
+# primary's database name and credentials
+REPLICA_HOSTS = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+# Reads fall back to the primary when no replica has replayed up to this
+# many seconds ago; routes can ask for less (or accept more)
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 30))
+# How often a worker re-measures each replica's lag, and how long it skips
+# one that could not be reached
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', 5))
+REPLICA_RETRY_SECONDS = float(os.getenv('DB_REPLICA_RETRY_SECONDS', 30))
+
+# A replica that has replayed everything it received is not behind, however
+# long ago the primary last wrote
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+reads = metrics.registry.counter(
+    'subway_db_reads_total', 'Read-only checkouts by the server that took them', ['target'])
+replica_lag = metrics.registry.gauge(
+    'subway_db_replica_lag_seconds', 'Replay lag of each read replica when last measured', ['replica'])
+
+class Replica:
+    def __init__(self, host, pool):
+        self.host = host
+        self.pool = pool
+        self.lag = None
+        self.checked_at = None
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def current_lag(self):
+        # Seconds behind the primary, re-measured once the last reading is
+        # REPLICA_LAG_CHECK_SECONDS old; None while the replica is down
+        now = time.monotonic()
+        if now < self.down_until:
+            return None
+        if self.checked_at is not None and now - self.checked_at < REPLICA_LAG_CHECK_SECONDS:
+            return self.lag
+        with self._lock:
+            if self.checked_at is None or time.monotonic() - self.checked_at >= REPLICA_LAG_CHECK_SECONDS:
+                try:
+                    with self.pool.connection() as conn:
+                        self.lag = float(conn.run(REPLICA_LAG_SQL)[0][0])
+                    replica_lag.set(self.lag, replica=self.host)
+                except Exception as e:
+                    self.mark_down(e)
+                self.checked_at = time.monotonic()
+            return self.lag
+
+    def mark_down(self, error):
+        print(f"❌ Replica {self.host} unavailable, reading from the primary for {REPLICA_RETRY_SECONDS:.0f}s: {error}")
+        self.lag = None
+        self.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+class ReplicaRouter:
+    """Sends read-only checkouts to a caught-up replica, round robin, and to
+    the primary when none is within the caller's lag limit."""
+
+    def __init__(self, replicas, primary):
+        self.replicas = replicas
+        self.primary = primary
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def choose(self, max_lag=None):
+        max_lag = REPLICA_MAX_LAG if max_lag is None else max_lag
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.replicas), 1)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            lag = replica.current_lag()
+            if lag is not None and lag <= max_lag:
+                return replica
+        return None
+
+    def close(self):
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def metrics(self):
+        return {replica.host: dict(replica.pool.metrics(), lag_seconds=replica.lag,
+                                   available=time.monotonic() >= replica.down_until)
+                for replica in self.replicas}
+
+def _replica(host, max_size):
+    name, _, port = host.partition(':')
+    return Replica(host, ConnectionPool(
+        max_size=max_size,
+        max_idle=int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+        checkout_timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        connect=lambda: connect(name, port or None)
+    ))
+
+def get_router():
+    global _router
+    primary = get_pool()
+    with _pool_lock:
+        if _router is None:
+            # Each replica gets a pool the size of the primary's
+            _router = ReplicaRouter([_replica(host, primary.max_size) for host in REPLICA_HOSTS], primary)
+        return _router
+
+@contextmanager
+def read_connection(max_lag=None):
+    # For work that only reads: a replica no more than max_lag seconds
+    # behind when there is one, else the primary. A replica that can't hand
+    # out a connection sends this read to the primary too.
+    router = get_router()
+    replica = router.choose(max_lag)
+    conn = None
+    if replica is not None:
+        try:
+            conn = replica.pool.acquire()
+        except PoolTimeout:
+            replica = None
+        except Exception as e:
+            replica.mark_down(e)
+            replica = None
+    pool = replica.pool if replica is not None else router.primary
+    if conn is None:
+        conn = pool.acquire()
+    reads.inc(target=replica.host if replica is not None else 'primary')
+    with pool.checked_out(conn) as conn:
+        yield conn
+
+def replica_metrics():
+    return get_router().metrics()
+
+BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))
+
+def insert_many(conn, table, columns, rows, batch_size=None, suffix=''):
+    # Multi-row INSERT ... VALUES, one statement per batch. pg8000 caps a
+    # statement at 32767 parameters, so the batch shrinks for wide rows.
+    # `suffix` is appended to every statement, e.g. an ON CONFLICT clause.
+    batch_size = batch_size or BATCH_SIZE
+    batch_size = max(1, min(batch_size, 32767 // len(columns)))
+    column_list = ', '.join(columns)
+    written = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        placeholders = []
+        params = {}
+        for i, row in enumerate(batch):
+            names = []
+            for j, value in enumerate(row):
+                name = f"p{i}_{j}"
+                params[name] = value
+                names.append(':' + name)
+            placeholders.append('(' + ', '.join(names) + ')')
+        conn.run(
+            f"INSERT INTO {table} ({column_list}) VALUES " + ', '.join(placeholders) + suffix,
+            **params
+        )
+        written += len(batch)
+    return written
@@ -0,0 +1,166 @@
+from dotenv import load_dotenv
+import threading
+import os
+import db
+
+load_dotenv()
+
+# A delay only produces a write when it first crosses the threshold, when it
+# grows by at least CHANGE_SECONDS, or when it is closed out
+CHANGE_SECONDS = int(os.getenv('DELAY_CHANGE_SECONDS', 60))
+# Open events not seen for this long are closed even if their feed is down
+STALE_SECONDS = int(os.getenv('DELAY_STALE_SECONDS', 600))
+# Open events older than this are treated as orphans of a crashed process
+MAX_EVENT_HOURS = int(os.getenv('DELAY_MAX_EVENT_HOURS', 6))
+
+EVENT_COLUMNS = ['line', 'trip_id', 'stop_id', 'delay_seconds', 'delay_minutes', 'timestamp', 'last_seen_at']
+
+class DelayEvent:
+    __slots__ = ('line', 'trip_id', 'stop_id', 'started_at', 'delay_seconds', 'last_seen_at', 'previous_delay')
+
+    def __init__(self, line, trip_id, stop_id, started_at, delay_seconds, last_seen_at):
+        self.line = line
+        self.trip_id = trip_id
+        self.stop_id = stop_id
+        self.started_at = started_at
+        self.delay_seconds = delay_seconds
+        self.last_seen_at = last_seen_at
+        # Peak delay already written for this event, None for a new event
+        self.previous_delay = None
+
+    @property
+    def key(self):
+        return (self.trip_id, self.stop_id)
+
+    @property
+    def delay_minutes(self):
+        return round(self.delay_seconds / 60, 1)
+
+    def as_row(self):
+        return (self.line, self.trip_id, self.stop_id, self.delay_seconds,
+                self.delay_minutes, self.started_at, self.last_seen_at)
+
+class DelayTracker:
+    """In-memory table of open delay events keyed by (trip_id, stop_id).
+
+    apply() turns one cycle of raw observations into the events that need
+    writing: new delays, delays that grew materially, and delays that have
+    ended because the train left the stop or is no longer late.
+    """
+
+    def __init__(self, change_seconds=CHANGE_SECONDS, stale_seconds=STALE_SECONDS):
+        self.change_seconds = change_seconds
+        self.stale_seconds = stale_seconds
+        self._open = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._open)
+
+    def open_events(self):
+        with self._lock:
+            return list(self._open.values())
+
+    def open_counts(self):
+        counts = {}
+        with self._lock:
+            for event in self._open.values():
+                counts[event.line] = counts.get(event.line, 0) + 1
+        return counts
+
+    def load_open(self, conn, lines=None):
+        # Rebuild state after a restart so still-delayed trains are not
+        # recorded as brand new events. With `lines`, only those lines'
+        # events are kept (a sharded worker owns just some feeds).
+        conn.run("""
+            UPDATE delays SET closed_at = last_seen_at
+            WHERE closed_at IS NULL
+            AND trip_id IS NOT NULL
+            AND timestamp <= NOW() - :hours * INTERVAL '1 hour'
+            AND timestamp > NOW() - INTERVAL '7 days'
+        """, hours=MAX_EVENT_HOURS)
+        rows = conn.run("""
+            SELECT line, trip_id, stop_id, timestamp, delay_seconds, last_seen_at
+            FROM delays
+            WHERE closed_at IS NULL
+            AND trip_id IS NOT NULL
+            AND timestamp > NOW() - :hours * INTERVAL '1 hour'
+            AND (CAST(:lines AS text[]) IS NULL OR line = ANY(CAST(:lines AS text[])))
+        """, hours=MAX_EVENT_HOURS, lines=list(lines) if lines else None)
+        with self._lock:
+            self._open = {}
+            for line, trip_id, stop_id, started_at, delay_seconds, last_seen_at in rows:
+                event = DelayEvent(line, trip_id, stop_id, started_at, delay_seconds, last_seen_at)
+                event.previous_delay = delay_seconds
+                self._open[event.key] = event
+            self.loaded = True
+        return len(rows)
+
+    def apply(self, observations, seen_lines, now):
+        # observations: dicts with line, trip_id, stop_id, delay_seconds for
+        # every stop over the delay threshold in the feeds that were parsed
+        # this cycle. seen_lines: the lines those feeds cover.
+        changed = []
+        closed = []
+        current = set()
+        with self._lock:
+            for obs in observations:
+                key = (obs['trip_id'], obs['stop_id'])
+                current.add(key)
+                event = self._open.get(key)
+                if event is None:
+                    event = DelayEvent(obs['line'], obs['trip_id'], obs['stop_id'],
+                                       now, obs['delay_seconds'], now)
+                    self._open[key] = event
+                    changed.append(event)
+                    continue
+                event.last_seen_at = now
+                if obs['delay_seconds'] - event.delay_seconds >= self.change_seconds:
+                    event.previous_delay = event.delay_seconds
+                    event.delay_seconds = obs['delay_seconds']
+                    changed.append(event)
+
+            for key, event in list(self._open.items()):
+                if key in current:
+                    continue
+                gone = event.line in seen_lines
+                stale = (now - event.last_seen_at).total_seconds() > self.stale_seconds
+                if gone or stale:
+                    del self._open[key]
+                    closed.append(event)
+        return changed, closed
+
+def write_events(conn, changed, closed, now):
+    if changed:
+        db.insert_many(
+            conn, 'delays', EVENT_COLUMNS, [e.as_row() for e in changed],
+            suffix="""
+                ON CONFLICT (trip_id, stop_id, timestamp) DO UPDATE SET
+                    delay_seconds = GREATEST(delays.delay_seconds, EXCLUDED.delay_seconds),
+                    delay_minutes = GREATEST(delays.delay_minutes, EXCLUDED.delay_minutes),
+                    last_seen_at = EXCLUDED.last_seen_at
+            """
+        )
+    if closed:
+        # The explicit lower bound lets the planner prune delays partitions
+        conn.run("""
+            UPDATE delays d
+            SET closed_at = :now, last_seen_at = c.last_seen_at
+            FROM unnest(CAST(:trip_ids AS text[]), CAST(:stop_ids AS text[]),
+                        CAST(:started AS timestamp[]), CAST(:last_seen AS timestamp[]))
+                AS c(trip_id, stop_id, started_at, last_seen_at)
+            WHERE d.trip_id = c.trip_id
+            AND d.stop_id = c.stop_id
+            AND d.timestamp = c.started_at
+            AND d.timestamp >= :oldest
+        """,
+            now=now,
+            oldest=min(e.started_at for e in closed),
+            trip_ids=[e.trip_id for e in closed],
+            stop_ids=[e.stop_id for e in closed],
+            started=[e.started_at for e in closed],
+            last_seen=[e.last_seen_at for e in closed]
+        )
+
+tracker = DelayTracker()
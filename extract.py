@@ -0,0 +1,87 @@
+from nyct_gtfs.compiled_gtfs import gtfs_realtime_pb2, nyct_subway_pb2  # noqa: F401 (registers NYCT extensions)
+from datetime import datetime
+from feeds import route_to_line
+import numpy as np
+
+DELAY_THRESHOLD_SECONDS = 120
+
+class FeedSnapshot:
+    """One parsed feed flattened into columnar arrays, one entry per
+    stop_time_update.
+
+    line_codes index into `lines`; delay_seconds and arrival (epoch seconds,
+    0 when absent) come from the update's arrival event, or its departure
+    event when there is no arrival. captured_at is the feed header time.
+    """
+
+    __slots__ = ('lines', 'line_codes', 'trip_id', 'stop_id', 'delay_seconds', 'arrival',
+                 'trips_by_line', 'captured_at')
+
+    def __len__(self):
+        return len(self.line_codes)
+
+def flatten(feed_bytes, lines, captured_at=None):
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(feed_bytes)
+
+    code_for = {line: i for i, line in enumerate(lines)}
+    trips_by_line = np.zeros(len(lines), dtype=np.int32)
+    line_codes = []
+    trip_ids = []
+    stop_ids = []
+    delays = []
+    arrivals = []
+
+    # The protobuf walk is the only per-stop Python work; everything after it
+    # runs on whole arrays
+    for entity in message.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trip_update = entity.trip_update
+        code = code_for.get(route_to_line(trip_update.trip.route_id))
+        if code is None:
+            continue
+        trips_by_line[code] += 1
+        trip_id = trip_update.trip.trip_id
+        for update in trip_update.stop_time_update:
+            event = update.arrival if update.HasField('arrival') else update.departure
+            line_codes.append(code)
+            trip_ids.append(trip_id)
+            stop_ids.append(update.stop_id)
+            delays.append(event.delay)
+            arrivals.append(event.time)
+
+    snapshot = FeedSnapshot()
+    snapshot.lines = list(lines)
+    snapshot.line_codes = np.array(line_codes, dtype=np.int16)
+    snapshot.trip_id = np.array(trip_ids, dtype=object)
+    snapshot.stop_id = np.array(stop_ids, dtype=object)
+    snapshot.delay_seconds = np.array(delays, dtype=np.int32)
+    snapshot.arrival = np.array(arrivals, dtype=np.int64)
+    snapshot.trips_by_line = trips_by_line
+    if captured_at is None:
+        header_time = message.header.timestamp
+        captured_at = datetime.fromtimestamp(header_time) if header_time else datetime.now()
+    snapshot.captured_at = captured_at
+    return snapshot
+
+def delayed(snapshot, threshold=DELAY_THRESHOLD_SECONDS):
+    # Returns (observations, delays_by_line) for stops over the threshold.
+    # observations are the dicts DelayTracker.apply expects, plus
+    # delay_minutes.
+    mask = snapshot.delay_seconds > threshold
+    codes = snapshot.line_codes[mask]
+    delay_seconds = snapshot.delay_seconds[mask]
+    delay_minutes = np.round(delay_seconds / 60, 1)
+    delays_by_line = np.bincount(codes, minlength=len(snapshot.lines))
+
+    line_names = np.array(snapshot.lines, dtype=object)[codes]
+    observations = [
+        {'line': line, 'trip_id': trip_id, 'stop_id': stop_id,
+         'delay_seconds': seconds, 'delay_minutes': minutes}
+        for line, trip_id, stop_id, seconds, minutes in zip(
+            line_names.tolist(), snapshot.trip_id[mask].tolist(), snapshot.stop_id[mask].tolist(),
+            delay_seconds.tolist(), delay_minutes.tolist()
+        )
+    ]
+    return observations, delays_by_line
@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+import requests
+import threading
+import hashlib
+import random
+import time
+import os
+
+load_dotenv()
+
+FETCH_WORKERS = int(os.getenv('FEED_FETCH_WORKERS', 8))
+FETCH_TIMEOUT = float(os.getenv('FEED_FETCH_TIMEOUT', 10))
+FETCH_RETRIES = int(os.getenv('FEED_FETCH_RETRIES', 2))
+RETRY_BACKOFF = float(os.getenv('FEED_RETRY_BACKOFF', 0.5))
+# Points every feed at another host (e.g. the replay harness's local stand-in)
+MTA_HOST = 'https://api-endpoint.mta.info'
+BASE_URL = os.getenv('MTA_FEED_BASE_URL')
+
+# Route ids in the realtime feeds that we report under a different line
+ROUTE_ALIASES = {
+    'GS': 'S', 'FS': 'S', 'H': 'S', 'SF': 'S', 'SR': 'S',
+    '5X': '5', '6X': '6', '7X': '7', 'FX': 'F'
+}
+
+# Realtime feed per line, as published by the MTA
+FEED_PATH = MTA_HOST + '/Dataservice/mtagtfsfeeds/nyct%2F'
+LINE_FEEDS = {
+    '1': 'gtfs', '2': 'gtfs', '3': 'gtfs', '4': 'gtfs', '5': 'gtfs', '6': 'gtfs', '7': 'gtfs', 'S': 'gtfs',
+    'GS': 'gtfs',
+    'A': 'gtfs-ace', 'C': 'gtfs-ace', 'E': 'gtfs-ace', 'H': 'gtfs-ace', 'SR': 'gtfs-ace',
+    'B': 'gtfs-bdfm', 'D': 'gtfs-bdfm', 'F': 'gtfs-bdfm', 'M': 'gtfs-bdfm', 'FS': 'gtfs-bdfm', 'SF': 'gtfs-bdfm',
+    'G': 'gtfs-g',
+    'J': 'gtfs-jz', 'Z': 'gtfs-jz',
+    'L': 'gtfs-l',
+    'N': 'gtfs-nqrw', 'Q': 'gtfs-nqrw', 'R': 'gtfs-nqrw', 'W': 'gtfs-nqrw',
+    'SI': 'gtfs-si', 'SIR': 'gtfs-si'
+}
+
+# ETag, Last-Modified and body digest per feed URL from the last download
+# the scraper finished processing (see remember_validators)
+_validators = {}
+_validators_lock = threading.Lock()
+
+class FeedResult:
+    def __init__(self, url, lines):
+        self.url = url
+        self.lines = lines
+        self.status = None
+        self.content = None
+        self.error = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        # Set on an 'ok' download; only remembered once the body is applied
+        self.validators = None
+
+    @property
+    def name(self):
+        return self.url.rsplit('%2F', 1)[-1]
+
+def feed_url(line):
+    return rebase_url(FEED_PATH + LINE_FEEDS[line])
+
+def rebase_url(url):
+    if BASE_URL and url.startswith(MTA_HOST):
+        return BASE_URL.rstrip('/') + url[len(MTA_HOST):]
+    return url
+
+def group_by_feed(lines):
+    groups = {}
+    for line in lines:
+        groups.setdefault(feed_url(line), []).append(line)
+    return groups
+
+def route_to_line(route_id):
+    route_id = (route_id or '').strip().upper()
+    return ROUTE_ALIASES.get(route_id, route_id)
+
+def _fetch_one(result, timeout, retries):
+    start = time.monotonic()
+    headers = {}
+    with _validators_lock:
+        etag, last_modified, digest = _validators.get(result.url, (None, None, None))
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    for attempt in range(retries + 1):
+        result.attempts = attempt + 1
+        try:
+            response = requests.get(result.url, headers=headers, timeout=timeout)
+            if response.status_code == 304:
+                result.status = 'not_modified'
+                break
+            if response.status_code >= 500 or response.status_code == 429:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            new_digest = hashlib.sha1(response.content).hexdigest()
+            # Some endpoints ignore the validators, so also compare bodies
+            if new_digest == digest:
+                result.status = 'not_modified'
+            else:
+                result.content = response.content
+                result.validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'), new_digest)
+                result.status = 'ok'
+            break
+        except Exception as e:
+            result.error = e
+            result.status = 'error'
+            if attempt < retries:
+                # Exponential backoff with jitter so retries across feeds don't line up
+                time.sleep(RETRY_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+
+    if result.status != 'error':
+        result.error = None
+    result.elapsed = time.monotonic() - start
+    return result
+
+def fetch_feeds(lines, max_workers=None, timeout=None, retries=None, deadline=None):
+    # Downloads every distinct feed behind `lines` exactly once, in parallel.
+    # The request timeout bounds each socket read, not a whole download, so
+    # with `deadline` (seconds) feeds still downloading after it come back
+    # as errors and their threads are left to finish on their own.
+    max_workers = max_workers or FETCH_WORKERS
+    timeout = FETCH_TIMEOUT if timeout is None else timeout
+    retries = FETCH_RETRIES if retries is None else retries
+
+    results = [FeedResult(url, feed_lines) for url, feed_lines in group_by_feed(lines).items()]
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(results)))
+    futures = [pool.submit(_fetch_one, result, timeout, retries) for result in results]
+    _, late = wait(futures, timeout=None if deadline is None else max(deadline, 0))
+    pool.shutdown(wait=False, cancel_futures=True)
+    for i, future in enumerate(futures):
+        if future in late:
+            # A fresh result, since the late thread still writes to its own
+            result = FeedResult(results[i].url, results[i].lines)
+            result.status = 'error'
+            result.error = TimeoutError(f"still downloading after {deadline:.1f}s")
+            result.elapsed = deadline
+            results[i] = result
+    return results
+
+def remember_validators(results):
+    # Called with the downloads whose bodies were parsed and saved. Until
+    # then the same body counts as new, so a cycle that fails after the
+    # download retries it instead of skipping it as not modified.
+    with _validators_lock:
+        for result in results:
+            if result.validators is not None:
+                _validators[result.url] = result.validators
+
+def forget_validators():
+    with _validators_lock:
+        _validators.clear()
@@ -0,0 +1,259 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote, unquote
+from dotenv import load_dotenv
+from datetime import datetime
+from array import array
+import threading
+import time
+import os
+import stations
+import serialize
+import shards
+
+load_dotenv()
+
+HOURS = int(os.getenv('HOT_WINDOW_HOURS', 24))
+# Per-line cap on open-delay samples kept for short windows (5 minutes etc.)
+SAMPLE_CAPACITY = int(os.getenv('HOT_WINDOW_SAMPLES', 20000))
+PORT = int(os.getenv('HOT_WINDOW_PORT', 0))
+# A sharded worker's window only covers the lines it scrapes, so the API
+# never reads one and uses the rollups instead
+URL = None if shards.SHARDING else os.getenv('HOT_WINDOW_URL')
+
+class LineWindow:
+    """Fixed-size columnar state for one line.
+
+    - A ring buffer of (timestamp, delay_minutes) samples of the line's open
+      delays, one per open delay per scrape, for short look-backs.
+    - One slot per hour for the last HOURS hours holding the same event-based
+      count / sum / max / latest as the rollup tables.
+
+    Both are preallocated arrays, so memory does not grow with traffic and
+    every update is O(1).
+    """
+
+    def __init__(self, capacity=SAMPLE_CAPACITY, hours=HOURS):
+        self.capacity = capacity
+        self.hours = hours
+        self.sample_ts = array('d', bytes(8 * capacity))
+        self.sample_delay = array('f', bytes(4 * capacity))
+        self.head = 0
+        self.size = 0
+        self.bucket_hour = array('q', [-1] * hours)
+        self.bucket_count = array('q', [0] * hours)
+        self.bucket_sum = array('d', [0.0] * hours)
+        self.bucket_max = array('f', [0.0] * hours)
+        self.bucket_last = array('d', [0.0] * hours)
+
+    def add_sample(self, ts, minutes):
+        self.sample_ts[self.head] = ts
+        self.sample_delay[self.head] = minutes
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def add_event(self, ts, count, added_minutes, minutes):
+        hour = int(ts // 3600)
+        slot = hour % self.hours
+        if self.bucket_hour[slot] != hour:
+            if self.bucket_hour[slot] > hour:
+                # Older than the window
+                return
+            self.bucket_hour[slot] = hour
+            self.bucket_count[slot] = 0
+            self.bucket_sum[slot] = 0.0
+            self.bucket_max[slot] = 0.0
+            self.bucket_last[slot] = 0.0
+        self.bucket_count[slot] += count
+        self.bucket_sum[slot] += added_minutes
+        self.bucket_max[slot] = max(self.bucket_max[slot], minutes)
+        self.bucket_last[slot] = max(self.bucket_last[slot], ts)
+
+    def recent(self, since_ts):
+        # (sample count, average delay) for samples at or after since_ts,
+        # walking back from the newest
+        count = 0
+        total = 0.0
+        i = self.head
+        for _ in range(self.size):
+            i = (i - 1) % self.capacity
+            if self.sample_ts[i] < since_ts:
+                break
+            count += 1
+            total += self.sample_delay[i]
+        return count, (round(total / count, 1) if count else None)
+
+    def summary(self, now_ts):
+        oldest_hour = int(now_ts // 3600) - self.hours + 1
+        count = 0
+        total = 0.0
+        worst = 0.0
+        last = 0.0
+        hourly = []
+        for slot in range(self.hours):
+            hour = self.bucket_hour[slot]
+            if hour < oldest_hour or self.bucket_count[slot] == 0:
+                continue
+            count += self.bucket_count[slot]
+            total += self.bucket_sum[slot]
+            worst = max(worst, self.bucket_max[slot])
+            last = max(last, self.bucket_last[slot])
+            hourly.append((hour, self.bucket_count[slot], round(self.bucket_sum[slot] / self.bucket_count[slot], 1)))
+        hourly.sort()
+        return {
+            'total_delays': count,
+            'avg_delay': round(total / count, 1) if count else None,
+            'max_delay': round(worst, 1),
+            'last_updated': datetime.fromtimestamp(last) if last else None,
+            'hourly': [
+                {'hour': datetime.fromtimestamp(h * 3600), 'delay_count': c, 'avg_delay': a}
+                for h, c, a in hourly
+            ]
+        }
+
+    def memory_bytes(self):
+        arrays = (self.sample_ts, self.sample_delay, self.bucket_hour, self.bucket_count,
+                  self.bucket_sum, self.bucket_max, self.bucket_last)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+class HotWindow:
+    def __init__(self, capacity=SAMPLE_CAPACITY, hours=HOURS):
+        self.capacity = capacity
+        self.hours = hours
+        self._lines = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        # When a scrape last recorded the open delays; None until one has
+        # since the window was loaded, e.g. on a standby scheduler
+        self.updated_at = None
+
+    def _line(self, line):
+        window = self._lines.get(line)
+        if window is None:
+            window = LineWindow(self.capacity, self.hours)
+            self._lines[line] = window
+        return window
+
+    def record_events(self, events):
+        # Same accounting as rollups.apply_events: new events count once,
+        # events that grew only move the sum and the max
+        with self._lock:
+            for event in events:
+                minutes = event.delay_minutes
+                if event.previous_delay is None:
+                    count, added = 1, minutes
+                else:
+                    count, added = 0, minutes - round(event.previous_delay / 60, 1)
+                self._line(event.line).add_event(event.started_at.timestamp(), count, added, minutes)
+
+    def record_open(self, events, now):
+        ts = now.timestamp()
+        with self._lock:
+            for event in events:
+                self._line(event.line).add_sample(ts, event.delay_minutes)
+            self.updated_at = now
+
+    def load(self, conn):
+        # Rebuilds the hourly slots from the database after a restart
+        rows = conn.run("""
+            SELECT line, timestamp, delay_minutes
+            FROM delays
+            WHERE timestamp > DATE_TRUNC('hour', NOW()) - :hours * INTERVAL '1 hour'
+            ORDER BY timestamp
+        """, hours=self.hours - 1)
+        with self._lock:
+            self._lines = {}
+            self.updated_at = None
+            for line, ts, minutes in rows:
+                minutes = float(minutes)
+                self._line(line).add_event(ts.timestamp(), 1, minutes, minutes)
+            self.loaded = True
+        return len(rows)
+
+    def recent(self, seconds):
+        since = time.time() - seconds
+        with self._lock:
+            return {line: w.recent(since) for line, w in self._lines.items()}
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {line: w.summary(now) for line, w in self._lines.items()}
+
+    def memory_bytes(self):
+        with self._lock:
+            return sum(w.memory_bytes() for w in self._lines.values())
+
+window = HotWindow()
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/lines':
+            body = {'lines': window.snapshot(), 'loaded': window.loaded, 'updated_at': window.updated_at,
+                    'memory_bytes': window.memory_bytes()}
+        elif url.path == '/recent':
+            seconds = int(parse_qs(url.query).get('seconds', ['300'])[0])
+            body = {line: {'samples': c, 'avg_delay': a} for line, (c, a) in window.recent(seconds).items()}
+        elif url.path == '/stations/worst':
+            limit = int(parse_qs(url.query).get('limit', [str(stations.WORST_SIZE)])[0])
+            body = {'stations': stations.board.worst(limit), 'updated_at': stations.board.updated_at}
+        elif url.path.startswith('/stations/'):
+            station_id = unquote(url.path[len('/stations/'):])
+            body = {'station': stations.board.station(station_id), 'updated_at': stations.board.updated_at}
+        else:
+            self.send_error(404)
+            return
+        # Encoded like the API's own responses, so timestamps have the same
+        # format whether a route reads this window or the database
+        data = serialize.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=PORT):
+    # Local-only endpoint so the API process can read the scheduler's window
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    threading.Thread(target=server.serve_forever, name='hot-window', daemon=True).start()
+    print(f"🔥 Hot window served on 127.0.0.1:{port}")
+    return server
+
+def fetch(path, timeout=0.5, **params):
+    # Used by the API; returns None when no hot window is configured or the
+    # scheduler is unreachable so callers can fall back to the database
+    if not URL:
+        return None
+    import requests
+    try:
+        response = requests.get(URL.rstrip('/') + path, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return None
+
+def fetch_lines(timeout=0.5):
+    # Only trusted once the scheduler has loaded its window and a scrape
+    # has updated it; a standby scheduler's window is never filled
+    body = fetch('/lines', timeout)
+    if body is None or not body.get('loaded') or body.get('updated_at') is None:
+        return None
+    return body['lines']
+
+def fetch_worst_stations(limit, timeout=0.5):
+    # Only trusted once the scheduler has built its station board
+    body = fetch('/stations/worst', timeout, limit=limit)
+    if body is None or body['updated_at'] is None:
+        return None
+    return body['stations']
+
+def fetch_station(station_id, timeout=0.5):
+    # {'station': summary or None for an unknown id}, or None like above
+    body = fetch('/stations/' + quote(station_id, safe=''), timeout)
+    if body is None or body['updated_at'] is None:
+        return None
+    return body
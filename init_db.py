@@ -1,52 +1,319 @@
-import psycopg2
 from dotenv import load_dotenv
-import os
+from datetime import datetime, timedelta
+import partitions
+import db
 
 load_dotenv()
 
-def init_database():
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD')
-    )
-    
-    cur = conn.cursor()
-    
-    # Create delays table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS delays (
+DELAYS_COLUMNS = """
+    id INTEGER NOT NULL DEFAULT nextval('delays_id_seq'),
+    line VARCHAR(10) NOT NULL,
+    stop_id VARCHAR(50),
+    delay_seconds INTEGER,
+    delay_minutes DECIMAL(5,1),
+    timestamp TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    trip_id VARCHAR(64),
+    last_seen_at TIMESTAMP,
+    closed_at TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+"""
+
+def create_delays_table(conn):
+    # delays is range-partitioned by day on timestamp (see partitions.py).
+    # The partition key has to be part of every unique index.
+    conn.run("CREATE SEQUENCE IF NOT EXISTS delays_id_seq")
+    conn.run(f"""
+        CREATE TABLE IF NOT EXISTS delays ({DELAYS_COLUMNS})
+        PARTITION BY RANGE (timestamp)
+    """)
+    conn.run("ALTER SEQUENCE delays_id_seq OWNED BY delays.id")
+    
+    # Create indexes for faster queries. (line, timestamp) also serves
+    # timestamp-only scans once partition pruning has picked the days.
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_delays_line_timestamp 
+        ON delays(line, timestamp)
+    """)
+    
+    # Per-station lookups (stations.py falls back to these when the
+    # scheduler's station board is unreachable)
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_delays_stop_timestamp
+        ON delays(stop_id, timestamp)
+    """)
+
+    # Delay events: one row per (trip, stop) delay, updated in place while the
+    # train stays delayed and closed out once it leaves the stop
+    conn.run("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_delays_event 
+        ON delays(trip_id, stop_id, timestamp)
+    """)
+
+def migrate_to_partitioned(conn):
+    # One-off migration of the original unpartitioned delays table. Rows are
+    # copied into daily partitions, ids are kept, and the old table is dropped
+    # in the same transaction.
+    print("Migrating delays to a partitioned table...")
+    conn.run("""
+        ALTER TABLE delays
+            ADD COLUMN IF NOT EXISTS trip_id VARCHAR(64),
+            ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP
+    """)
+    conn.run("ALTER TABLE delays RENAME TO delays_unpartitioned")
+    conn.run("ALTER TABLE delays_unpartitioned RENAME CONSTRAINT delays_pkey TO delays_unpartitioned_pkey")
+    for index in ('idx_delays_line', 'idx_delays_timestamp', 'idx_delays_line_timestamp', 'idx_delays_event'):
+        conn.run(f"DROP INDEX IF EXISTS {index}")
+    # The SERIAL sequence would be dropped along with the old table
+    conn.run("ALTER SEQUENCE IF EXISTS delays_id_seq OWNED BY NONE")
+    create_delays_table(conn)
+    
+    bounds = conn.run("SELECT MIN(timestamp), MAX(timestamp) FROM delays_unpartitioned")[0]
+    if bounds[0] is not None:
+        partitions.ensure_partitions(conn, bounds[0].date(), bounds[1].date())
+    conn.run("""
+        INSERT INTO delays (id, line, stop_id, delay_seconds, delay_minutes, timestamp,
+                            created_at, trip_id, last_seen_at, closed_at)
+        SELECT id, line, stop_id, delay_seconds, delay_minutes, timestamp,
+               created_at, trip_id, last_seen_at, closed_at
+        FROM delays_unpartitioned
+    """)
+    conn.run("SELECT setval('delays_id_seq', GREATEST((SELECT MAX(id) FROM delays), 1))")
+    conn.run("DROP TABLE delays_unpartitioned")
+
+def init_other_tables(conn):
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS alerts (
             id SERIAL PRIMARY KEY,
             line VARCHAR(10) NOT NULL,
-            stop_id VARCHAR(50),
-            delay_seconds INTEGER,
-            delay_minutes DECIMAL(5,1),
-            timestamp TIMESTAMP NOT NULL,
+            alert_type VARCHAR(50),
+            header TEXT,
+            description TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
     
-    # Create indexes for faster queries
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_delays_line 
-        ON delays(line)
+    # Alerts keep their MTA entity id so each scrape can apply a diff instead
+    # of rewriting the table
+    conn.run("""
+        ALTER TABLE alerts
+            ADD COLUMN IF NOT EXISTS entity_id VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS content_hash VARCHAR(40),
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP
     """)
     
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_delays_timestamp 
-        ON delays(timestamp)
+    conn.run("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_entity_line 
+        ON alerts(entity_id, line)
     """)
     
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_delays_line_timestamp 
-        ON delays(line, timestamp)
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_alerts_line_created_id 
+        ON alerts(line, created_at, id)
+    """)
+    
+    # Rollups maintained by the scraper (see rollups.py)
+    for table in ('delay_rollups_hourly', 'delay_rollups_daily'):
+        conn.run(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                line VARCHAR(10) NOT NULL,
+                bucket TIMESTAMP NOT NULL,
+                delay_count INTEGER NOT NULL DEFAULT 0,
+                delay_sum NUMERIC NOT NULL DEFAULT 0,
+                delay_max DECIMAL(5,1),
+                last_delay_at TIMESTAMP,
+                PRIMARY KEY (line, bucket)
+            )
+        """)
+        
+        conn.run(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_bucket 
+            ON {table}(bucket)
+        """)
+    
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id SERIAL PRIMARY KEY,
+            line VARCHAR(10) NOT NULL,
+            issue_type VARCHAR(50) NOT NULL,
+            description TEXT,
+            upvotes INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Back the keyset-paginated report routes: ORDER BY created_at DESC,
+    # id DESC per line and across all lines
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_reports_line_created_id 
+        ON reports(line, created_at, id)
+    """)
+    
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_reports_created_id 
+        ON reports(created_at, id)
+    """)
+    
+    conn.run("DROP INDEX IF EXISTS idx_reports_line_created_at")
+    conn.run("DROP INDEX IF EXISTS idx_reports_created_at")
+    
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS email_subscriptions (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            line VARCHAR(10) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (email, line)
+        )
+    """)
+    
+    # The unique (email, line) index can't serve lookups by line alone
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_email_subscriptions_line 
+        ON email_subscriptions(line)
+    """)
+    
+    # One row per recipient per delay alert; status moves from 'queued' to
+    # 'sent' or 'failed' as the notification workers deliver it
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS email_alert_log (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            line VARCHAR(10) NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    conn.run("""
+        ALTER TABLE email_alert_log
+            ADD COLUMN IF NOT EXISTS batch_id VARCHAR(32),
+            ADD COLUMN IF NOT EXISTS status VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS attempts INTEGER,
+            ADD COLUMN IF NOT EXISTS error TEXT
+    """)
+    
+    # Backs the per-line cooldown check in send_delay_alerts
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_email_alert_log_line_sent_at 
+        ON email_alert_log(line, sent_at)
+    """)
+    
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_email_alert_log_batch 
+        ON email_alert_log(batch_id)
+    """)
+    
+    # Delay anomalies and the per-line, per-hour-of-week baselines they are
+    # scored against (see anomalies.py). Baselines are checkpointed by the
+    # scraper so a restart doesn't lose weeks of history.
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS delay_baselines (
+            line VARCHAR(10) NOT NULL,
+            hour_of_week SMALLINT NOT NULL,
+            mean DOUBLE PRECISION NOT NULL,
+            variance DOUBLE PRECISION NOT NULL,
+            samples BIGINT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (line, hour_of_week)
+        )
+    """)
+    
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS delay_anomalies (
+            id SERIAL PRIMARY KEY,
+            line VARCHAR(10) NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL,
+            ended_at TIMESTAMP,
+            peak_delays INTEGER NOT NULL,
+            expected_delays DECIMAL(8,2),
+            baseline_std DECIMAL(8,2),
+            score DECIMAL(8,2)
+        )
     """)
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Keyset-paginated like reports, per line and across all lines
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_delay_anomalies_line_created_id 
+        ON delay_anomalies(line, created_at, id)
+    """)
+    
+    conn.run("""
+        CREATE INDEX IF NOT EXISTS idx_delay_anomalies_created_id 
+        ON delay_anomalies(created_at, id)
+    """)
+    
+    # Sharded scraping (see shards.py): live scheduler workers, one lease per
+    # feed group, and per-cycle completion merged by the coordinator
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS scrape_workers (
+            worker_id VARCHAR(255) PRIMARY KEY,
+            started_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            heartbeat_at TIMESTAMPTZ NOT NULL
+        )
+    """)
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS scrape_leases (
+            feed VARCHAR(50) PRIMARY KEY,
+            owner VARCHAR(255),
+            expires_at TIMESTAMPTZ,
+            acquired_at TIMESTAMPTZ
+        )
+    """)
+    # One row per feed group per cycle from the worker that scraped it;
+    # merged into scrape_cycles by the coordinator
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS scrape_cycle_feeds (
+            cycle BIGINT NOT NULL,
+            feed VARCHAR(50) NOT NULL,
+            worker_id VARCHAR(255) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            delayed_stops INTEGER,
+            finished_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (cycle, feed)
+        )
+    """)
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS scrape_cycles (
+            cycle BIGINT PRIMARY KEY,
+            cycle_at TIMESTAMPTZ NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            feeds_ok INTEGER NOT NULL,
+            feeds_failed INTEGER NOT NULL,
+            feeds_missing INTEGER NOT NULL,
+            workers INTEGER NOT NULL,
+            missing TEXT,
+            finished_at TIMESTAMPTZ
+        )
+    """)
+    
+    # Bumped by the scraper after each write so API caches can invalidate early
+    conn.run("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    conn.run("""
+        INSERT INTO data_version (id, version) VALUES (1, 0)
+        ON CONFLICT (id) DO NOTHING
+    """)
+
+def init_database():
+    with db.transaction() as conn:
+        exists = conn.run("SELECT to_regclass('delays') IS NOT NULL")[0][0]
+        if exists and not partitions.is_partitioned(conn):
+            migrate_to_partitioned(conn)
+        else:
+            create_delays_table(conn)
+        
+        today = datetime.now().date()
+        partitions.ensure_partitions(conn, today - timedelta(days=1), today + timedelta(days=partitions.PREMAKE_DAYS))
+        
+        init_other_tables(conn)
     
     print("✅ Database tables created successfully!")
 
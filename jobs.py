@@ -0,0 +1,238 @@
+from dotenv import load_dotenv
+import threading
+import time
+import os
+import db
+import metrics
+
+load_dotenv()
+
+# Any constant works as long as every scheduler process uses the same one
+LOCK_KEY = int(os.getenv('SCHEDULER_LOCK_KEY', 7305820316))
+LOCK_CHECK_SECONDS = float(os.getenv('SCHEDULER_LOCK_CHECK_SECONDS', 5))
+LOCK_RETRY_SECONDS = float(os.getenv('SCHEDULER_LOCK_RETRY_SECONDS', 15))
+
+job_runs = metrics.registry.counter(
+    'subway_job_runs_total', 'Scheduler job runs by outcome', ['job', 'status'])
+job_skipped = metrics.registry.counter(
+    'subway_job_skipped_total', 'Scheduler ticks skipped because the previous run was still going', ['job'])
+job_overruns = metrics.registry.counter(
+    'subway_job_deadline_overruns_total', 'Scheduler job runs that passed their deadline', ['job'])
+job_running = metrics.registry.gauge(
+    'subway_job_running', 'Whether a scheduler job is currently running', ['job'])
+leader = metrics.registry.gauge(
+    'subway_scheduler_leader', 'Whether this process holds the scheduler leader lock')
+
+_current = threading.local()
+
+def time_left():
+    # Seconds until the deadline of the job running on this thread, or None
+    # outside the scheduler. Work that can block (feed downloads) stops
+    # waiting once it runs out.
+    deadline = getattr(_current, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+class LeaderLock:
+    """Session-level Postgres advisory lock held on a dedicated connection.
+
+    Only the process holding it runs jobs, so a second scheduler.py (start.sh
+    and the Procfile worker on the same app) waits as a standby. The lock
+    goes away with the connection, so a dead leader is replaced as soon as
+    Postgres notices.
+    """
+
+    def __init__(self, key=LOCK_KEY, connect=db.connect):
+        self.key = key
+        self._connect = connect
+        self._conn = None
+        self._checked_at = 0.0
+
+    @property
+    def held(self):
+        return self._conn is not None
+
+    def ensure(self):
+        now = time.monotonic()
+        if self._conn is not None:
+            if now - self._checked_at < LOCK_CHECK_SECONDS:
+                return True
+            self._checked_at = now
+            try:
+                self._conn.run("SELECT 1")
+                return True
+            except Exception as e:
+                print(f"❌ Lost scheduler leader lock: {e}")
+                self._drop()
+                return False
+
+        if self._checked_at and now - self._checked_at < LOCK_RETRY_SECONDS:
+            return False
+        self._checked_at = now
+        conn = None
+        try:
+            conn = self._connect()
+            if conn.run("SELECT pg_try_advisory_lock(:key)", key=self.key)[0][0]:
+                self._conn = conn
+                leader.set(1)
+                print("👑 Acquired scheduler leader lock")
+                return True
+            conn.close()
+        except Exception as e:
+            print(f"Failed to check scheduler leader lock: {e}")
+            if conn is not None:
+                db._close_quietly(conn)
+        return False
+
+    def _drop(self):
+        db._close_quietly(self._conn)
+        self._conn = None
+        leader.set(0)
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.run("SELECT pg_advisory_unlock(:key)", key=self.key)
+            except Exception:
+                pass
+            self._drop()
+
+class Job:
+    def __init__(self, name, func, interval, deadline=None, delay=0, leader_only=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.deadline = deadline or interval
+        # Seconds from when the job's grid starts to its first tick, or a
+        # callable returning them, asked each time the grid (re)starts: a
+        # leader-only job's grid starts whenever this process becomes leader
+        self.delay = delay
+        # Jobs that every process runs on its own share of the work (see
+        # shards.py) don't wait for the leader lock
+        self.leader_only = leader_only
+        self.next_run = None
+        self.thread = None
+        self.started_at = None
+        self.overran = False
+        self.last_duration = None
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+class Scheduler:
+    """Runs each job on its own thread and its own fixed grid of ticks.
+
+    Ticks are start + n * interval on the monotonic clock, so a slow run
+    never shifts later ones. A tick that comes up while the job's previous
+    run is still going is skipped (runs never overlap or queue up). Python
+    threads can't be killed, so deadlines are enforced cooperatively: jobs
+    check time_left() around anything that can block, and a run past its
+    deadline anyway is reported and keeps the job blocked until it returns.
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock
+        self.jobs = []
+        self._stop = threading.Event()
+
+    def add(self, name, func, interval, deadline=None, delay=0, leader_only=True):
+        job = Job(name, func, interval, deadline, delay, leader_only)
+        self.jobs.append(job)
+        return job
+
+    def _schedule_from(self, now, leader_only=True):
+        for job in self.jobs:
+            if job.leader_only == leader_only:
+                job.next_run = now + (job.delay() if callable(job.delay) else job.delay)
+
+    def _advance(self, job, now):
+        # Moves to the first tick after now on the job's grid; every tick
+        # passed over is counted as skipped
+        missed = int((now - job.next_run) // job.interval)
+        if missed:
+            job_skipped.inc(missed, job=job.name)
+        job.next_run += (missed + 1) * job.interval
+
+    def _start(self, job, now):
+        if job.running:
+            job_skipped.inc(job=job.name)
+            metrics.log('job_skipped', job=job.name, running_for=round(now - job.started_at, 3))
+            self._advance(job, now)
+            return
+        self._advance(job, now)
+        job.started_at = now
+        job.overran = False
+        job.thread = threading.Thread(target=self._run, args=(job,), name=f"job-{job.name}", daemon=True)
+        job.thread.start()
+
+    def _run(self, job):
+        job_running.set(1, job=job.name)
+        _current.deadline = job.started_at + job.deadline
+        status = 'ok'
+        try:
+            with metrics.cycle(job.name, budget=job.deadline):
+                job.func()
+            job.last_error = None
+        except Exception as e:
+            status = 'error'
+            job.last_error = str(e)
+            print(f"❌ Job {job.name} failed: {e}")
+        finally:
+            _current.deadline = None
+            job.last_duration = time.monotonic() - job.started_at
+            job_runs.inc(job=job.name, status=status)
+            job_running.set(0, job=job.name)
+
+    def _check_deadlines(self, now):
+        for job in self.jobs:
+            if job.running and not job.overran and now - job.started_at > job.deadline:
+                job.overran = True
+                job_overruns.inc(job=job.name)
+                print(f"🚨 Job {job.name} is still running after {now - job.started_at:.0f}s "
+                      f"(deadline {job.deadline:.0f}s); its next ticks will be skipped")
+
+    def run_forever(self):
+        leading = False
+        self._schedule_from(time.monotonic(), leader_only=False)
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if self.lock is not None and not self.lock.ensure():
+                if leading:
+                    print("⏸️ Pausing leader jobs until the leader lock is back")
+                leading = False
+            elif not leading:
+                leading = True
+                self._schedule_from(now)
+
+            runnable = [job for job in self.jobs if leading or not job.leader_only]
+            for job in runnable:
+                if now >= job.next_run:
+                    self._start(job, now)
+            self._check_deadlines(now)
+
+            if not runnable:
+                self._stop.wait(1)
+                continue
+            wake = min(job.next_run for job in runnable)
+            self._stop.wait(max(0.0, min(wake - time.monotonic(), 1.0)))
+
+    def stop(self, timeout=None):
+        # Waits for running jobs, each up to its own deadline by default
+        self._stop.set()
+        for job in self.jobs:
+            if job.running:
+                job.thread.join(job.deadline if timeout is None else timeout)
+        if self.lock is not None:
+            self.lock.release()
+
+    def status(self):
+        now = time.monotonic()
+        return {job.name: {
+            'interval': job.interval,
+            'deadline': job.deadline,
+            'running': job.running,
+            'next_run_in': round(job.next_run - now, 1) if job.next_run is not None else None,
+            'last_duration': round(job.last_duration, 3) if job.last_duration is not None else None,
+            'last_error': job.last_error
+        } for job in self.jobs}
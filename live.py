@@ -0,0 +1,148 @@
+from dotenv import load_dotenv
+import threading
+import queue
+import json
+import time
+import os
+import db
+
+load_dotenv()
+
+# Compact change events published by the scraper (and by report submissions)
+# through Postgres NOTIFY and fanned out to SSE clients by each web worker
+CHANNEL = 'subway_live'
+# NOTIFY payloads are capped at 8000 bytes
+MAX_TEXT = 500
+POLL_SECONDS = float(os.getenv('LIVE_POLL_SECONDS', 1))
+CLIENT_QUEUE_SIZE = int(os.getenv('LIVE_CLIENT_QUEUE_SIZE', 100))
+HEARTBEAT_SECONDS = 15
+
+def publish(conn, event_type, line, data):
+    # Delivered when the surrounding transaction commits
+    payload = json.dumps({'type': event_type, 'line': line, 'data': data}, default=str)
+    conn.run("SELECT pg_notify(:channel, :payload)", channel=CHANNEL, payload=payload)
+
+def publish_delay_changes(conn, changed, closed, open_by_line):
+    lines = {}
+    for event in changed:
+        stats = lines.setdefault(event.line, {'new_delays': 0, 'updated_delays': 0, 'cleared_delays': 0, 'max_delay': 0})
+        if event.previous_delay is None:
+            stats['new_delays'] += 1
+        else:
+            stats['updated_delays'] += 1
+        stats['max_delay'] = max(stats['max_delay'], event.delay_minutes)
+    for event in closed:
+        stats = lines.setdefault(event.line, {'new_delays': 0, 'updated_delays': 0, 'cleared_delays': 0, 'max_delay': 0})
+        stats['cleared_delays'] += 1
+    for line, stats in lines.items():
+        stats['open_delays'] = open_by_line.get(line, 0)
+        publish(conn, 'line_stats', line, stats)
+
+def publish_alert_changes(conn, new, updated, removed):
+    for action, changed in (('new', new), ('updated', updated)):
+        for alert in changed:
+            publish(conn, 'alert', alert['line'], {
+                'action': action,
+                'entity_id': alert['entity_id'],
+                'alert_type': alert['alert_type'],
+                'header': alert['header'][:MAX_TEXT]
+            })
+    for entity_id, line in removed:
+        publish(conn, 'alert', line, {'action': 'cleared', 'entity_id': entity_id})
+
+class Broker:
+    """Per-process fan-out of live events to subscribed SSE clients.
+
+    Each client gets a bounded queue; a client that falls that far behind is
+    dropped rather than letting its backlog grow.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self.on_event = None
+
+    def subscribe(self, lines):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[client] = set(lines) if lines else None
+        self._ensure_listener()
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.pop(client, None)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def dispatch(self, event):
+        if self.on_event is not None:
+            self.on_event(event)
+        with self._lock:
+            targets = [c for c, lines in self._subscribers.items()
+                       if lines is None or event.get('line') in lines]
+        for client in targets:
+            try:
+                client.put_nowait(event)
+            except queue.Full:
+                self.unsubscribe(client)
+                try:
+                    client.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='live-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        # A dedicated connection outside the pool: it sits in LISTEN for the
+        # life of the worker. pg8000 only reads notifications while running a
+        # statement, so it polls with a trivial query.
+        while True:
+            conn = None
+            try:
+                conn = db.connect()
+                conn.run(f"LISTEN {CHANNEL}")
+                while True:
+                    conn.run("SELECT 1")
+                    while conn.notifications:
+                        _, _, payload = conn.notifications.popleft()
+                        try:
+                            self.dispatch(json.loads(payload))
+                        except ValueError:
+                            continue
+                    time.sleep(POLL_SECONDS)
+            except Exception as e:
+                print(f"Live listener error, reconnecting: {e}")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+broker = Broker()
+
+def sse_stream(lines):
+    client = broker.subscribe(lines)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = client.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if event is None:
+                return
+            yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+    finally:
+        broker.unsubscribe(client)
@@ -0,0 +1,318 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from datetime import datetime
+import threading
+import json
+import time
+import re
+import os
+
+load_dotenv()
+
+# Budget for cycles that aren't given one; scheduler jobs use their deadline,
+# which for the feeds job is 90% of FEEDS_INTERVAL_SECONDS
+CYCLE_BUDGET_SECONDS = float(os.getenv('CYCLE_BUDGET_SECONDS', float(os.getenv('FEEDS_INTERVAL_SECONDS', 30)) * 0.9))
+CYCLE_WARN_RATIO = float(os.getenv('CYCLE_WARN_RATIO', 0.8))
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', 0.5))
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 1))
+LOG_REQUESTS = os.getenv('LOG_REQUESTS', '0') == '1'
+LOG_JSON = os.getenv('LOG_JSON', '1') == '1'
+PORT = int(os.getenv('METRICS_PORT', 0))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, [], value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = [0] * len(self.buckets) + [0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    out.append((self.name + '_bucket', key, [('le', _format_value(bound))], cumulative))
+                out.append((self.name + '_sum', key, [], state[-2]))
+                out.append((self.name + '_count', key, [], state[-1]))
+        return out
+
+class Registry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    Collectors are callables run at scrape time for values that already
+    live elsewhere, such as connection pool counts.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labelnames, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+phase_seconds = registry.histogram(
+    'subway_phase_seconds', 'Time spent in each scrape, alert and email phase', ['phase'])
+feed_fetch_seconds = registry.histogram(
+    'subway_feed_fetch_seconds', 'Download time per MTA feed, including retries', ['feed', 'status'])
+cycle_seconds = registry.histogram(
+    'subway_cycle_seconds', 'Duration of each scheduler cycle', ['cycle'])
+last_cycle_seconds = registry.gauge(
+    'subway_last_cycle_seconds', 'Duration of the most recent run of each cycle', ['cycle'])
+cycle_budget = registry.gauge(
+    'subway_cycle_budget_seconds', 'Time budget for one run of each cycle', ['cycle'])
+cycle_overruns = registry.counter(
+    'subway_cycle_overruns_total', 'Cycles that ran past their budget', ['cycle'])
+query_seconds = registry.histogram(
+    'subway_db_query_seconds', 'Database statement latency by query label', ['query'])
+query_errors = registry.counter(
+    'subway_db_query_errors_total', 'Database statements that raised', ['query'])
+request_seconds = registry.histogram(
+    'subway_http_request_seconds', 'API request latency by route', ['method', 'route', 'status'])
+db_connections = registry.gauge(
+    'subway_db_connections', 'Connections in this process\'s pool by state', ['state'])
+db_pool_events = registry.gauge(
+    'subway_db_pool_events', 'Cumulative pool checkouts, reconnects and timeouts', ['event'])
+
+def log(event, **fields):
+    # One JSON object per line so log drains can parse it
+    if not LOG_JSON:
+        return
+    record = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'event': event}
+    record.update(fields)
+    print(json.dumps(record, default=str), flush=True)
+
+class CycleTrace:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+
+_current = threading.local()
+
+@contextmanager
+def phase(name):
+    # Times one phase; phases on the cycle's own thread also add up into the
+    # cycle's JSON log line. Repeated phases (one parse per feed) accumulate.
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        phase_seconds.observe(elapsed, phase=name)
+        trace = getattr(_current, 'trace', None)
+        if trace is not None:
+            trace.phases[name] = trace.phases.get(name, 0.0) + elapsed
+
+@contextmanager
+def cycle(name='scrape', budget=None):
+    budget = CYCLE_BUDGET_SECONDS if budget is None else budget
+    cycle_budget.set(budget, cycle=name)
+    trace = CycleTrace()
+    _current.trace = trace
+    try:
+        yield trace
+    finally:
+        _current.trace = None
+        elapsed = time.monotonic() - trace.started
+        cycle_seconds.observe(elapsed, cycle=name)
+        last_cycle_seconds.set(elapsed, cycle=name)
+        overrun = elapsed > budget
+        log('cycle', cycle=name, duration=round(elapsed, 3), budget=budget, overrun=overrun,
+            phases={k: round(v, 3) for k, v in trace.phases.items()})
+        if overrun:
+            cycle_overruns.inc(cycle=name)
+            detail = ''
+            if trace.phases:
+                slowest = max(trace.phases.items(), key=lambda p: p[1])
+                detail = f" (slowest phase: {slowest[0]} {slowest[1]:.1f}s)"
+            print(f"🚨 {name} cycle took {elapsed:.1f}s, over its {budget:.0f}s budget{detail}")
+        elif elapsed > budget * CYCLE_WARN_RATIO:
+            print(f"⚠️ {name} cycle took {elapsed:.1f}s of its {budget:.0f}s budget")
+
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|JOIN)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([A-Za-z_][\w.]*)', re.IGNORECASE)
+_labels = {}
+
+def query_label(sql):
+    # "SELECT delay_rollups_hourly", "INSERT delays", ... derived once per
+    # distinct statement text so call sites don't need to name their queries
+    label = _labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        verb = words[0].upper() if words else ''
+        if verb == 'WITH':
+            verb = 'CTE'
+        match = _TABLE.search(sql)
+        label = f"{verb} {match.group(1)}" if match else verb
+        if len(_labels) < 1000:
+            _labels[sql] = label
+    return label
+
+def observe_query(sql, elapsed, failed=False):
+    label = query_label(sql)
+    query_seconds.observe(elapsed, query=label)
+    if failed:
+        query_errors.inc(query=label)
+    if elapsed > SLOW_QUERY_SECONDS:
+        log('slow_query', query=label, duration=round(elapsed, 3))
+
+def track_pool(get_metrics):
+    def collect():
+        m = get_metrics()
+        db_connections.set(m['in_use'], state='in_use')
+        db_connections.set(m['idle'], state='idle')
+        db_connections.set(m['open'], state='open')
+        db_connections.set(m['max_size'], state='max')
+        db_connections.set(m['waiters'], state='waiting')
+        for event in ('checkouts', 'reconnects', 'timeouts'):
+            db_pool_events.set(m[event], event=event)
+    registry.add_collector(collect)
+
+def init_app(app):
+    # Per-route latency for every Flask request, plus GET /metrics
+    from flask import request, g, Response
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.monotonic()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.monotonic() - start
+        # The URL rule keeps label cardinality bounded (/api/reports/<line>)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        if LOG_REQUESTS or elapsed > SLOW_REQUEST_SECONDS:
+            log('request', method=request.method, route=route, path=request.path,
+                status=response.status_code, duration=round(elapsed, 3))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=PORT):
+    # /metrics for processes without a web server (the scheduler)
+    server = ThreadingHTTPServer(('0.0.0.0', port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"📈 Metrics served on :{port}/metrics")
+    return server
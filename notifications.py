@@ -0,0 +1,229 @@
+from dotenv import load_dotenv
+import threading
+import random
+import queue
+import uuid
+import time
+import os
+import db
+import metrics
+
+load_dotenv()
+
+EMAIL_FROM = os.getenv('EMAIL_FROM', 'onboarding@resend.dev')
+DASHBOARD_URL = 'https://nyc-subway-tracker-frontend.vercel.app'
+
+WORKERS = int(os.getenv('EMAIL_WORKERS', 2))
+# Resend accepts up to 100 messages per batch call and, by default, 2 API
+# requests per second per account
+BATCH_SIZE = min(int(os.getenv('EMAIL_BATCH_SIZE', 100)), 100)
+RATE_PER_SECOND = float(os.getenv('EMAIL_RATE_PER_SECOND', 2))
+RATE_BURST = int(os.getenv('EMAIL_RATE_BURST', 2))
+MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 4))
+RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', 1))
+QUEUE_SIZE = int(os.getenv('EMAIL_QUEUE_SIZE', 1000))
+
+def render_delay_alert(line, avg_delay):
+    return {
+        "subject": f"🚇 Line {line} Delay Alert - {avg_delay} min avg delay",
+        "html": f"""
+        <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+            <h2 style="color: #333;">🚇 NYC Subway Delay Alert</h2>
+            <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
+                <h3 style="margin: 0 0 10px 0;">Line {line} is experiencing delays</h3>
+                <p style="margin: 0; font-size: 18px; color: #e53e3e;">
+                    Average delay: <strong>{avg_delay} minutes</strong>
+                </p>
+            </div>
+            <p>Check the live dashboard for real-time updates:</p>
+            <a href="{DASHBOARD_URL}"
+               style="background: #3b82f6; color: white; padding: 12px 24px; border-radius: 6px; text-decoration: none; display: inline-block;">
+                View Dashboard
+            </a>
+            <p style="margin-top: 20px; font-size: 12px; color: #999;">
+                You're receiving this because you subscribed to Line {line} alerts.<br>
+                <a href="{DASHBOARD_URL}" style="color: #999;">Unsubscribe</a>
+            </p>
+        </div>
+        """
+    }
+
+class ResendSender:
+    def __init__(self):
+        import resend
+        resend.api_key = os.getenv('RESEND_API_KEY')
+        self._resend = resend
+
+    def send_batch(self, messages):
+        if len(messages) == 1:
+            self._resend.Emails.send(messages[0])
+        else:
+            self._resend.Batch.send(messages)
+
+class FakeSender:
+    # Stand-in for load tests: records messages and simulates provider
+    # latency and failures
+    def __init__(self, latency=0.05, failure_rate=0.0):
+        self.latency = float(os.getenv('FAKE_EMAIL_LATENCY', latency))
+        self.failure_rate = float(os.getenv('FAKE_EMAIL_FAILURE_RATE', failure_rate))
+        self.sent = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if random.random() < self.failure_rate:
+                raise RuntimeError("Simulated provider failure")
+            self.sent.extend(messages)
+
+SENDERS = {
+    'resend': ResendSender,
+    'fake': FakeSender
+}
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AlertJob:
+    def __init__(self, line, avg_delay, emails):
+        self.batch_id = uuid.uuid4().hex
+        self.line = line
+        self.avg_delay = avg_delay
+        self.emails = emails
+
+class NotificationPipeline:
+    """Queue of delay alerts fanned out by a small pool of worker threads.
+
+    Recipients are logged as 'queued' in email_alert_log when the job is
+    enqueued, so the per-line cooldown holds even before the worker gets to
+    them, and are updated to 'sent' or 'failed' once delivery finishes.
+    """
+
+    def __init__(self, sender=None, workers=WORKERS, rate=RATE_PER_SECOND, burst=RATE_BURST,
+                 batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+        self.sender = sender or SENDERS[os.getenv('EMAIL_SENDER', 'resend')]()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate, burst)
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retries': 0}
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=30):
+        # Lets queued batches drain before the process exits
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def log(self, conn, line, avg_delay, emails):
+        # Records the recipients as queued; submit() then hands the job to
+        # the workers once the caller has given the connection back
+        job = AlertJob(line, avg_delay, emails)
+        db.insert_many(
+            conn, 'email_alert_log', ['email', 'line', 'batch_id', 'status'],
+            [(email, line, job.batch_id, 'queued') for email in emails]
+        )
+        return job
+
+    def submit(self, job):
+        # Blocks while the queue is full
+        for start in range(0, len(job.emails), self.batch_size):
+            self._queue.put((job, job.emails[start:start + self.batch_size]))
+        with self._lock:
+            self.stats['queued'] += len(job.emails)
+        return job
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            try:
+                job, recipients = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            try:
+                with metrics.phase('email_send'):
+                    self._deliver(job, recipients)
+            except Exception as e:
+                print(f"Email worker error for Line {job.line}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, job, recipients):
+        content = render_delay_alert(job.line, job.avg_delay)
+        messages = [{"from": EMAIL_FROM, "to": email, **content} for email in recipients]
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            self.bucket.acquire()
+            try:
+                self.sender.send_batch(messages)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                if attempt < self.max_attempts:
+                    with self._lock:
+                        self.stats['retries'] += 1
+                    # Exponential backoff with full jitter
+                    time.sleep(random.uniform(0, RETRY_BASE_SECONDS * (2 ** (attempt - 1))))
+
+        status = 'failed' if error else 'sent'
+        with self._lock:
+            self.stats[status] += len(recipients)
+        with db.connection() as conn:
+            conn.run("""
+                UPDATE email_alert_log
+                SET status = :status, attempts = :attempts, error = :error, sent_at = NOW()
+                WHERE batch_id = :batch_id AND email = ANY(CAST(:emails AS text[]))
+            """, status=status, attempts=attempt, error=str(error) if error else None,
+                batch_id=job.batch_id, emails=recipients)
+        if error:
+            print(f"Failed to send Line {job.line} alert to {len(recipients)} subscribers: {error}")
+        else:
+            print(f"📧 Sent Line {job.line} delay alert to {len(recipients)} subscribers")
+
+_pipeline = None
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = NotificationPipeline()
+        _pipeline.start()
+    return _pipeline
+
+def stop_pipeline():
+    # Only drains a pipeline that was started; never builds a sender just
+    # to shut it down
+    if _pipeline is not None:
+        _pipeline.stop()
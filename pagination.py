@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from urllib.parse import urlencode
+from flask import request
+import base64
+import math
+import os
+
+load_dotenv()
+
+DEFAULT_LIMIT = int(os.getenv('API_DEFAULT_LIMIT', 50))
+MAX_LIMIT = int(os.getenv('API_MAX_LIMIT', 200))
+
+# History bucket -> (SQL source, longest range allowed). Ranges are capped so
+# one request returns at most a few thousand points.
+BUCKETS = {
+    '5m': ('delays', timedelta(days=2)),
+    '1h': ('delay_rollups_hourly', timedelta(days=90)),
+    '1d': ('delay_rollups_daily', timedelta(days=730))
+}
+
+class BadRequest(ValueError):
+    pass
+
+def parse_limit(default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    limit = request.args.get('limit', default, type=int)
+    if limit is None or limit < 1:
+        raise BadRequest('limit must be a positive integer')
+    return min(limit, maximum)
+
+def local_time(value):
+    # Timestamps are stored as naive local time; an ISO value with an offset
+    # or Z is converted to that instead of being compared with naive ones
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return local_time(datetime.fromisoformat(created_at)), int(row_id)
+    except ValueError:
+        raise BadRequest('invalid cursor')
+
+def page_params(default_limit=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    # Keyset pagination on (created_at, id), newest first. Returns the SQL
+    # condition for rows after the cursor and its parameters; the caller
+    # fetches limit + 1 rows to find out whether there is another page.
+    limit = parse_limit(default_limit, maximum)
+    cursor = request.args.get('cursor')
+    if not cursor:
+        return limit, 'TRUE', {}
+    created_at, row_id = decode_cursor(cursor)
+    return limit, '(created_at, id) < (:cursor_at, :cursor_id)', {'cursor_at': created_at, 'cursor_id': row_id}
+
+def finish_page(rows, limit, created_at_index, id_index=0):
+    # Trims the extra row and returns (rows, next_cursor or None)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last[created_at_index], last[id_index])
+
+def page_headers(response, next_cursor):
+    # The body stays a plain list for existing clients; the next page is
+    # advertised in headers
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return response
+
+def _parse_time(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return local_time(datetime.fromisoformat(value))
+    except ValueError:
+        raise BadRequest(f"{name} must be an ISO 8601 date or datetime")
+
+def _parse_span(name, unit, maximum):
+    # ?hours= / ?days= as a timedelta no longer than `maximum`; clamped
+    # before the timedelta is built so huge values can't overflow it
+    value = request.args.get(name, type=float)
+    if value is None:
+        return None
+    if not math.isfinite(value) or value <= 0:
+        raise BadRequest(f"{name} must be a positive number")
+    return timedelta(**{unit: min(value, maximum / timedelta(**{unit: 1}))})
+
+def time_range(default, maximum):
+    # ?since=&until= (ISO 8601), or ?hours= / ?days= back from now. The span
+    # is capped at `maximum` by moving `since` forward.
+    until = _parse_time('until') or datetime.now()
+    since = _parse_time('since')
+    try:
+        if since is None:
+            span = _parse_span('hours', 'hours', maximum) or _parse_span('days', 'days', maximum) or default
+            since = until - span
+        earliest = until - maximum
+    except OverflowError:
+        raise BadRequest('until is out of range')
+    if since >= until:
+        raise BadRequest('since must be before until')
+    return max(since, earliest), until
@@ -0,0 +1,85 @@
+from dotenv import load_dotenv
+from datetime import datetime, timedelta
+import os
+import db
+
+load_dotenv()
+
+# delays is range-partitioned by day on `timestamp`; each partition is named
+# delays_pYYYYMMDD and covers [day, day + 1)
+RETENTION_DAYS = int(os.getenv('DELAY_RETENTION_DAYS', 90))
+PREMAKE_DAYS = int(os.getenv('DELAY_PARTITION_PREMAKE_DAYS', 7))
+# Detach expired partitions into the archive schema instead of dropping them
+ARCHIVE_EXPIRED = os.getenv('DELAY_ARCHIVE_EXPIRED', '').lower() in ('1', 'true', 'yes')
+ARCHIVE_SCHEMA = 'archive'
+
+def partition_name(day):
+    return f"delays_p{day.strftime('%Y%m%d')}"
+
+def is_partitioned(conn):
+    rows = conn.run("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'delays' AND n.nspname = current_schema()
+    """)
+    return bool(rows) and rows[0][0] == 'p'
+
+def list_partitions(conn):
+    rows = conn.run("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'delays'
+        ORDER BY child.relname
+    """)
+    partitions = []
+    for (name,) in rows:
+        try:
+            partitions.append((name, datetime.strptime(name, 'delays_p%Y%m%d').date()))
+        except ValueError:
+            continue
+    return partitions
+
+def ensure_partitions(conn, start, end):
+    # Creates any missing daily partitions for [start, end]
+    existing = {name for name, _ in list_partitions(conn)}
+    day = start
+    created = []
+    while day <= end:
+        name = partition_name(day)
+        if name not in existing:
+            conn.run(f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF delays
+                FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')
+            """)
+            created.append(name)
+        day += timedelta(days=1)
+    return created
+
+def expire_partitions(conn, retention_days=RETENTION_DAYS, archive=ARCHIVE_EXPIRED):
+    cutoff = datetime.now().date() - timedelta(days=retention_days)
+    expired = []
+    if archive:
+        conn.run(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+    for name, day in list_partitions(conn):
+        if day >= cutoff:
+            continue
+        conn.run(f"ALTER TABLE delays DETACH PARTITION {name}")
+        if archive:
+            conn.run(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}")
+        else:
+            conn.run(f"DROP TABLE {name}")
+        expired.append(name)
+    return expired
+
+def run_maintenance():
+    today = datetime.now().date()
+    with db.transaction() as conn:
+        created = ensure_partitions(conn, today - timedelta(days=1), today + timedelta(days=PREMAKE_DAYS))
+        expired = expire_partitions(conn)
+    action = 'archived' if ARCHIVE_EXPIRED else 'dropped'
+    print(f"🗂️ Partition maintenance: {len(created)} created, {len(expired)} {action}")
+    return created, expired
+
+if __name__ == "__main__":
+    run_maintenance()
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+from partitions import RETENTION_DAYS
+import sys
+import db
+
+# Per-line delay aggregates, kept in step with `delays` by the scraper so the
+# dashboard endpoints never have to scan raw rows. Events are bucketed by the
+# time they started (delays.timestamp).
+ROLLUP_TABLES = {
+    'hour': 'delay_rollups_hourly',
+    'day': 'delay_rollups_daily'
+}
+
+ROLLUP_COLUMNS = ['line', 'bucket', 'delay_count', 'delay_sum', 'delay_max', 'last_delay_at']
+
+def _truncate(ts, unit):
+    if unit == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _deltas(events, unit):
+    # (line, bucket) -> [count, sum, max, last_delay_at]. New events add to
+    # the count; events that grew only move the sum and the max.
+    deltas = {}
+    for event in events:
+        key = (event.line, _truncate(event.started_at, unit))
+        minutes = event.delay_minutes
+        if event.previous_delay is None:
+            count, added = 1, minutes
+        else:
+            count, added = 0, minutes - round(event.previous_delay / 60, 1)
+        current = deltas.get(key)
+        if current is None:
+            deltas[key] = [count, added, minutes, event.started_at]
+        else:
+            current[0] += count
+            current[1] += added
+            current[2] = max(current[2], minutes)
+            current[3] = max(current[3], event.started_at)
+    return deltas
+
+def apply_events(conn, events):
+    # Must run in the same transaction as delay_events.write_events
+    for unit, table in ROLLUP_TABLES.items():
+        deltas = _deltas(events, unit)
+        if not deltas:
+            continue
+        rows = [(line, bucket, d[0], round(d[1], 1), d[2], d[3]) for (line, bucket), d in deltas.items()]
+        db.insert_many(conn, table, ROLLUP_COLUMNS, rows, suffix=f"""
+            ON CONFLICT (line, bucket) DO UPDATE SET
+                delay_count = {table}.delay_count + EXCLUDED.delay_count,
+                delay_sum = {table}.delay_sum + EXCLUDED.delay_sum,
+                delay_max = GREATEST({table}.delay_max, EXCLUDED.delay_max),
+                last_delay_at = GREATEST({table}.last_delay_at, EXCLUDED.last_delay_at)
+        """)
+
+def backfill(conn, since=None):
+    # Rebuilds the rollups from raw delays, optionally only from `since` on
+    # (rounded down to the day so both granularities stay whole)
+    if since is not None:
+        since = _truncate(since, 'day')
+    for unit, table in ROLLUP_TABLES.items():
+        if since is None:
+            conn.run(f"DELETE FROM {table}")
+        else:
+            conn.run(f"DELETE FROM {table} WHERE bucket >= :since", since=since)
+        conn.run(f"""
+            INSERT INTO {table} (line, bucket, delay_count, delay_sum, delay_max, last_delay_at)
+            SELECT
+                line,
+                DATE_TRUNC('{unit}', timestamp),
+                COUNT(*),
+                COALESCE(SUM(delay_minutes), 0),
+                MAX(delay_minutes),
+                MAX(timestamp)
+            FROM delays
+            WHERE CAST(:since AS timestamp) IS NULL OR timestamp >= :since
+            GROUP BY line, DATE_TRUNC('{unit}', timestamp)
+        """, since=since)
+
+def check_consistency(conn, since=None):
+    # Returns (table, line, bucket, rollup, raw) for every bucket whose
+    # rollup disagrees with a fresh aggregate over delays
+    mismatches = []
+    for unit, table in ROLLUP_TABLES.items():
+        rows = conn.run(f"""
+            WITH raw AS (
+                SELECT
+                    line,
+                    DATE_TRUNC('{unit}', timestamp) as bucket,
+                    COUNT(*) as delay_count,
+                    COALESCE(SUM(delay_minutes), 0) as delay_sum,
+                    MAX(delay_minutes) as delay_max
+                FROM delays
+                WHERE CAST(:since AS timestamp) IS NULL OR timestamp >= :since
+                GROUP BY line, DATE_TRUNC('{unit}', timestamp)
+            ),
+            rollup AS (
+                SELECT line, bucket, delay_count, delay_sum, delay_max
+                FROM {table}
+                WHERE CAST(:since AS timestamp) IS NULL OR bucket >= :since
+            )
+            SELECT
+                COALESCE(raw.line, rollup.line),
+                COALESCE(raw.bucket, rollup.bucket),
+                rollup.delay_count, rollup.delay_sum, rollup.delay_max,
+                raw.delay_count, raw.delay_sum, raw.delay_max
+            FROM raw
+            FULL OUTER JOIN rollup ON raw.line = rollup.line AND raw.bucket = rollup.bucket
+            WHERE rollup.delay_count IS DISTINCT FROM raw.delay_count
+            OR rollup.delay_sum IS DISTINCT FROM raw.delay_sum
+            OR rollup.delay_max IS DISTINCT FROM raw.delay_max
+            ORDER BY 2, 1
+        """, since=_truncate(since, unit) if since else None)
+        for row in rows:
+            mismatches.append((table, row[0], row[1], tuple(row[2:5]), tuple(row[5:8])))
+    return mismatches
+
+def main(argv):
+    usage = "Usage: python rollups.py backfill|check [YYYY-MM-DD]"
+    if len(argv) < 2 or argv[1] not in ('backfill', 'check'):
+        print(usage)
+        return 2
+    if len(argv) > 2:
+        since = datetime.strptime(argv[2], '%Y-%m-%d')
+    else:
+        # Raw delays older than the retention window are gone, but their
+        # rollups are kept, so only the retained days can be rebuilt or checked
+        since = datetime.now() - timedelta(days=RETENTION_DAYS - 1)
+
+    if argv[1] == 'backfill':
+        with db.transaction() as conn:
+            backfill(conn, since)
+        print("✅ Rollups rebuilt from delays")
+        return 0
+
+    with db.connection() as conn:
+        mismatches = check_consistency(conn, since)
+    for table, line, bucket, rollup, raw in mismatches[:50]:
+        print(f"  {table} Line {line} {bucket}: rollup {rollup} != raw {raw}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} rollup buckets disagree with delays")
+        return 1
+    print("✅ Rollups match delays")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,113 +1,181 @@
-import schedule
-import time
-import os
-import resend
-import pg8000.native
-from scraper import scrape_all_feeds, scrape_alerts
 from datetime import datetime
+import signal
+import os
+import db
+import hot_window
+import anomalies
+import shards
+import metrics
+from jobs import Scheduler, LeaderLock
 
-resend.api_key = os.getenv('RESEND_API_KEY')
+FEEDS_INTERVAL = float(os.getenv('FEEDS_INTERVAL_SECONDS', 30))
+ALERTS_INTERVAL = float(os.getenv('ALERTS_INTERVAL_SECONDS', 120))
+EMAIL_INTERVAL = float(os.getenv('EMAIL_INTERVAL_SECONDS', 60))
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL_SECONDS', 3600))
+# Only email about lines with an abnormal burst of delays (anomalies.py),
+# falling back to any delay while a line's baseline is still being learned
+ALERT_ON_ANOMALIES = os.getenv('ALERT_ON_ANOMALIES', 'true').lower() in ('1', 'true', 'yes')
 
-def get_db_connection():
-    return pg8000.native.Connection(
-        host=os.getenv('DB_HOST'),
-        port=int(os.getenv('DB_PORT', 5432)),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        ssl_context=True
-    )
+def delayed_lines():
+    # (line, average delay) of lines with open delays in the last 5 minutes
+    # that an alert may go out for. Unsharded, the in-memory hot window and
+    # anomaly detector cover every line.
+    recent = [(line, avg) for line, (samples, avg) in hot_window.window.recent(300).items() if samples]
+    if ALERT_ON_ANOMALIES:
+        active = anomalies.detector.active()
+        now = datetime.now()
+        recent = [(line, avg) for line, avg in recent
+                  if line in active or not anomalies.detector.is_trained(line, now)]
+    return recent
+
+def delayed_lines_from_db(conn):
+    # Sharded, each worker's memory only covers its own lines, so the leader
+    # reads the delays, open anomalies and checkpointed baselines every
+    # worker writes
+    from delay_events import MAX_EVENT_HOURS
+    recent = conn.run("""
+        SELECT line, ROUND(AVG(delay_minutes)::numeric, 1)
+        FROM delays
+        WHERE (closed_at IS NULL OR closed_at > NOW() - INTERVAL '5 minutes')
+        AND trip_id IS NOT NULL
+        AND timestamp > NOW() - :hours * INTERVAL '1 hour'
+        GROUP BY line
+    """, hours=MAX_EVENT_HOURS)
+    if ALERT_ON_ANOMALIES:
+        active = {r[0] for r in conn.run("SELECT DISTINCT line FROM delay_anomalies WHERE ended_at IS NULL")}
+        trained = {r[0] for r in conn.run("""
+            SELECT line FROM delay_baselines WHERE hour_of_week = :slot AND samples >= :min
+        """, slot=anomalies.hour_of_week(datetime.now()), min=anomalies.MIN_SAMPLES)}
+        recent = [(line, avg) for line, avg in recent if line in active or line not in trained]
+    return recent
 
 def send_delay_alerts():
+    # Leader-only, so each line's alert is logged and sent by one process
     try:
-        conn = get_db_connection()
+        if shards.SHARDING:
+            with db.connection() as conn:
+                recent = delayed_lines_from_db(conn)
+        else:
+            recent = delayed_lines()
+        if not recent:
+            return
         
-        delayed_lines = conn.run("""
-            SELECT DISTINCT line, ROUND(AVG(delay_minutes)::numeric, 1) as avg_delay
-            FROM delays
-            WHERE timestamp > NOW() - INTERVAL '5 minutes'
-            GROUP BY line
-        """)
+        # One query finds the lines with subscribers that have not been
+        # alerted within the last hour, with their recipients
+        jobs = []
+        with metrics.phase('email_enqueue'), db.connection() as conn:
+            eligible = conn.run("""
+                SELECT d.line, d.avg_delay, ARRAY_AGG(s.email ORDER BY s.email)
+                FROM unnest(CAST(:lines AS text[]), CAST(:avgs AS numeric[])) AS d(line, avg_delay)
+                JOIN email_subscriptions s ON s.line = d.line
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM email_alert_log l
+                    WHERE l.line = d.line AND l.sent_at > NOW() - INTERVAL '1 hour'
+                )
+                GROUP BY d.line, d.avg_delay
+            """, lines=[r[0] for r in recent], avgs=[str(r[1]) for r in recent])
         
-        if not delayed_lines:
-            conn.close()
-            return
+            if not eligible:
+                return
         
-        for row in delayed_lines:
-            line = row[0]
-            avg_delay = row[1]
-            
-            already_sent = conn.run("""
-                SELECT COUNT(*) FROM email_alert_log
-                WHERE line = :line AND sent_at > NOW() - INTERVAL '1 hour'
-            """, line=line)
-            
-            if already_sent[0][0] > 0:
-                continue
-            
-            subscribers = conn.run(
-                "SELECT email FROM email_subscriptions WHERE line = :line",
-                line=line
-            )
-            
-            if not subscribers:
-                continue
-            
-            for sub in subscribers:
-                email = sub[0]
-                try:
-                    resend.Emails.send({
-                        "from": "onboarding@resend.dev",
-                        "to": email,
-                        "subject": f"🚇 Line {line} Delay Alert - {avg_delay} min avg delay",
-                        "html": f"""
-                        <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                            <h2 style="color: #333;">🚇 NYC Subway Delay Alert</h2>
-                            <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                                <h3 style="margin: 0 0 10px 0;">Line {line} is experiencing delays</h3>
-                                <p style="margin: 0; font-size: 18px; color: #e53e3e;">
-                                    Average delay: <strong>{avg_delay} minutes</strong>
-                                </p>
-                            </div>
-                            <p>Check the live dashboard for real-time updates:</p>
-                            <a href="https://nyc-subway-tracker-frontend.vercel.app" 
-                               style="background: #3b82f6; color: white; padding: 12px 24px; border-radius: 6px; text-decoration: none; display: inline-block;">
-                                View Dashboard
-                            </a>
-                            <p style="margin-top: 20px; font-size: 12px; color: #999;">
-                                You're receiving this because you subscribed to Line {line} alerts.<br>
-                                <a href="https://nyc-subway-tracker-frontend.vercel.app" style="color: #999;">Unsubscribe</a>
-                            </p>
-                        </div>
-                        """
-                    })
-                    print(f"📧 Sent delay alert to {email} for Line {line}")
-                except Exception as e:
-                    print(f"Failed to send email to {email}: {e}")
-            
-            conn.run(
-                "INSERT INTO email_alert_log (email, line) VALUES ('batch', :line)",
-                line=line
-            )
+            from notifications import get_pipeline
+            pipeline = get_pipeline()
+            for line, avg_delay, emails in eligible:
+                jobs.append(pipeline.log(conn, line, avg_delay, emails))
         
-        conn.close()
+        # Handed to the notification workers after the connection is back in
+        # the pool, since a full queue blocks here
+        for job in jobs:
+            pipeline.submit(job)
+            print(f"📨 Queued Line {job.line} delay alert for {len(job.emails)} subscribers")
         
     except Exception as e:
         print(f"Error sending alerts: {e}")
 
-def run_scraper_and_alerts():
-    scrape_all_feeds()
-    scrape_alerts()
-    send_delay_alerts()
+def run_partition_maintenance():
+    from partitions import run_maintenance
+    try:
+        run_maintenance()
+    except Exception as e:
+        print(f"Error maintaining partitions: {e}")
+
+def coordinate_cycles(feeds):
+    with db.transaction() as conn:
+        shards.coordinate(conn, feeds, FEEDS_INTERVAL)
 
-print("🚇 NYC Subway Tracker - Auto Scheduler Started")
-print("Running scraper every 60 seconds...")
-print("Press CTRL+C to stop\n")
+def build_scheduler(shard_worker=None):
+    # The scraper pulls in nyct_gtfs, protobuf and numpy, so it is only
+    # imported once a scheduler is actually being built
+    from scraper import scrape_all_feeds, scrape_alerts
+    import snapshot_archive
+    snapshot_archive.init_writer()
 
-run_scraper_and_alerts()
+    # Every stage is its own job so a slow or failing one doesn't hold up the
+    # rest. Deadlines default to a bit under each interval; the email job
+    # starts after the first trip scrape has filled the hot window.
+    feeds_deadline = float(os.getenv('FEEDS_DEADLINE_SECONDS', FEEDS_INTERVAL * 0.9))
+    scheduler = Scheduler(lock=LeaderLock())
+    scheduler.add('maintenance', run_partition_maintenance, MAINTENANCE_INTERVAL, deadline=600)
+    if shard_worker is None:
+        scheduler.add('feeds', scrape_all_feeds, FEEDS_INTERVAL, deadline=feeds_deadline)
+    else:
+        # Every worker scrapes its own feeds on a wall-clock aligned grid so
+        # cycle numbers match across workers. The leader merges each finished
+        # cycle half an interval later; its grid is aligned whenever this
+        # worker becomes leader, not when the scheduler was built.
+        scheduler.add('feeds', shard_worker.run, FEEDS_INTERVAL, deadline=feeds_deadline,
+                      delay=lambda: shards.aligned_delay(FEEDS_INTERVAL), leader_only=False)
+        scheduler.add('coordinator', lambda: coordinate_cycles(list(shard_worker.groups)), FEEDS_INTERVAL,
+                      deadline=FEEDS_INTERVAL / 2,
+                      delay=lambda: shards.aligned_delay(FEEDS_INTERVAL, offset=FEEDS_INTERVAL / 2))
+    scheduler.add('alerts', scrape_alerts, ALERTS_INTERVAL,
+                  deadline=float(os.getenv('ALERTS_DEADLINE_SECONDS', 60)))
+    scheduler.add('emails', send_delay_alerts, EMAIL_INTERVAL,
+                  deadline=float(os.getenv('EMAIL_DEADLINE_SECONDS', 30)), delay=FEEDS_INTERVAL / 2)
+    return scheduler
 
-schedule.every(60).seconds.do(run_scraper_and_alerts)
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    # Each stage runs at most once at a time, so the scheduler needs a much
+    # smaller pool than the web workers: one connection per stage plus the
+    # email workers
+    db.init_pool(max_size=int(os.getenv('SCHEDULER_DB_POOL_SIZE', 6)))
+
+    print("🚇 NYC Subway Tracker - Auto Scheduler Started")
+    print(f"Trip feeds every {FEEDS_INTERVAL:.0f}s, alerts every {ALERTS_INTERVAL:.0f}s, emails every {EMAIL_INTERVAL:.0f}s")
+    print("Press CTRL+C to stop\n")
+
+    shard_worker = None
+    if shards.SHARDING:
+        from scraper import LINES
+        shard_worker = shards.ShardWorker(LINES, FEEDS_INTERVAL)
+        print(f"Sharded scraping as worker {shard_worker.worker_id}")
+        if hot_window.PORT:
+            # Each worker's window only covers the lines it scrapes, so the
+            # API ignores HOT_WINDOW_URL in sharded mode (hot_window.URL)
+            print("⚠️ The hot window only covers this worker's lines in sharded mode")
+
+    if hot_window.PORT:
+        hot_window.serve()
+    if metrics.PORT:
+        metrics.serve()
+
+    scheduler = build_scheduler(shard_worker)
+
+    # Heroku and most process managers stop workers with SIGTERM
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        from notifications import stop_pipeline
+        print("Stopping, waiting for running jobs and queued emails...")
+        scheduler.stop()
+        if shard_worker is not None:
+            shard_worker.stop()
+        stop_pipeline()
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
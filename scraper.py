@@ -1,10 +1,20 @@
-import pg8000.native
-from nyct_gtfs import NYCTFeed
 from dotenv import load_dotenv
-import os
 import requests
 from datetime import datetime
-import struct
+import db
+from feeds import fetch_feeds, rebase_url, remember_validators
+import extract
+from delay_events import tracker, write_events
+import rollups
+from cache import bump_data_version
+import alerts
+import live
+import hot_window
+import stations
+import snapshot_archive
+import anomalies
+import metrics
+import jobs
 
 load_dotenv()
 
@@ -12,149 +22,180 @@ LINES = ['1', '2', '3', '4', '5', '6', '7',
          'A', 'C', 'E', 'B', 'D', 'F', 'M', 
          'G', 'J', 'Z', 'L', 'N', 'Q', 'R', 'W', 'S']
 
-ALERT_FEED_URL = 'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/camsys%2Fsubway-alerts.json'
+ALERT_FEED_URL = rebase_url('https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/camsys%2Fsubway-alerts.json')
 
-def get_db_connection():
-    return pg8000.native.Connection(
-        host=os.getenv('DB_HOST'),
-        port=int(os.getenv('DB_PORT', 5432)),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        ssl_context=True
-    )
-
-def scrape_all_feeds():
+def scrape_all_feeds(lines=None):
+    # lines: the lines this process owns when scrape work is sharded
+    # (shards.py); in-memory state is then restored for those lines only
     print(f"\n🚇 Scraping MTA feeds at {datetime.now().strftime('%H:%M:%S')}...")
     
     all_delays = []
+    seen_lines = set()
+    parsed = []
+    now = datetime.now()
     
-    for line in LINES:
+    # Each distinct feed URL is downloaded once, concurrently, then split back
+    # out per line by the trip's route id
+    # Downloads get half of what is left of the job's deadline; the rest is
+    # for parsing and writing
+    left = jobs.time_left()
+    with metrics.phase('fetch'):
+        results = fetch_feeds(lines or LINES, deadline=None if left is None else left / 2)
+    feed_status = {}
+    for result in results:
+        timing = f"{result.elapsed * 1000:.0f}ms, {result.attempts} attempt(s)"
+        metrics.feed_fetch_seconds.observe(result.elapsed, feed=result.name, status=result.status)
+        feed_status[result.name] = {'status': result.status, 'delayed_stops': 0}
+        if result.status == 'not_modified':
+            print(f"  Feed {result.name}: unchanged ({timing})")
+            continue
+        if result.status == 'error':
+            print(f"  Feed {result.name}: Error - {result.error} ({timing})")
+            continue
+
+        # Flattened into arrays once per feed; thresholding and per-line
+        # counts run over the whole feed at once
         try:
-            feed = NYCTFeed(line)
-            trains = feed.trips
-            delayed = 0
-            
-            for train in trains:
-                for stop in train.stop_time_updates:
-                    delay_seconds = getattr(stop, 'delay', 0) or 0
-                    if delay_seconds > 120:
-                        all_delays.append({
-                            'line': line,
-                            'stop_id': stop.stop_id,
-                            'delay_seconds': delay_seconds,
-                            'delay_minutes': round(delay_seconds / 60, 1),
-                            'timestamp': datetime.now()
-                        })
-                        delayed += 1
-            
-            print(f"  Line {line}: {len(trains)} trains, {delayed} delays")
-        
+            with metrics.phase('parse'):
+                snapshot = extract.flatten(result.content, result.lines)
         except Exception as e:
-            print(f"  Line {line}: Error - {e}")
+            feed_status[result.name]['status'] = 'error'
+            print(f"  Feed {result.name}: Error - {e} ({timing})")
+            continue
+
+        seen_lines.update(result.lines)
+        parsed.append(result)
+        if snapshot_archive.writer is not None:
+            with metrics.phase('archive'):
+                snapshot_archive.writer.add(result.name, snapshot, now)
+        with metrics.phase('extract'):
+            delayed, delays_by_line = extract.delayed(snapshot)
+        all_delays.extend(delayed)
+        feed_status[result.name]['delayed_stops'] = len(delayed)
+
+        print(f"  Feed {result.name}: {int(snapshot.trips_by_line.sum())} trains ({timing})")
+        for i, line in enumerate(snapshot.lines):
+            print(f"    Line {line}: {snapshot.trips_by_line[i]} trains, {delays_by_line[i]} delays")
     
-    if all_delays:
-        conn = get_db_connection()
-        for delay in all_delays:
-            conn.run(
-                "INSERT INTO delays (line, stop_id, delay_seconds, delay_minutes, timestamp) VALUES (:line, :stop_id, :delay_seconds, :delay_minutes, :timestamp)",
-                line=delay['line'],
-                stop_id=delay['stop_id'],
-                delay_seconds=delay['delay_seconds'],
-                delay_minutes=delay['delay_minutes'],
-                timestamp=delay['timestamp']
-            )
-        conn.close()
-        print(f"✅ Saved {len(all_delays)} delays to database")
-    else:
-        print("ℹ️ No delays recorded this run")
+    # Only new delays, delays that grew materially and delays that just ended
+    # are written; a train that stays late is one event, not one row a minute
+    try:
+        if not tracker.loaded:
+            with db.connection() as conn:
+                restored = tracker.load_open(conn, lines)
+            print(f"  Restored {restored} open delay events")
+        if not hot_window.window.loaded:
+            with db.connection() as conn:
+                hot_window.window.load(conn)
+        if not stations.board.loaded:
+            with db.connection() as conn:
+                stations.board.load(conn)
+        with metrics.phase('apply'):
+            changed, closed = tracker.apply(all_delays, seen_lines, now)
+        if changed or closed:
+            with metrics.phase('db_write'), db.transaction() as conn:
+                write_events(conn, changed, closed, now)
+                rollups.apply_events(conn, changed)
+                bump_data_version(conn)
+                live.publish_delay_changes(conn, changed, closed, tracker.open_counts())
+            new_events = sum(1 for e in changed if e.previous_delay is None)
+            print(f"✅ {new_events} new, {len(changed) - new_events} updated, {len(closed)} closed delay events ({len(all_delays)} delayed stops seen)")
+        else:
+            print("ℹ️ No delay changes recorded this run")
+        hot_window.window.record_events(changed)
+        open_events = tracker.open_events()
+        hot_window.window.record_open(open_events, now)
+        stations.board.record_events(changed)
+        stations.board.record_open(open_events, now)
+        summary = {'delayed_stops': len(all_delays), 'changed': len(changed), 'closed': len(closed),
+                   'feeds': feed_status}
+        remember_validators(parsed)
+    except Exception as e:
+        # In-memory state may now be ahead of the database; rebuild it next cycle
+        tracker.loaded = False
+        summary = None
+        print(f"❌ Failed to save delays: {e}")
+
+    if summary is not None:
+        detect_anomalies(seen_lines, now, lines)
     
     print(f"✅ Done!\n")
+    return summary
+
+def detect_anomalies(seen_lines, now, lines=None):
+    # Scores this cycle's open delays per line against the line's baseline
+    # for this hour of the week
+    detector = anomalies.detector
+    try:
+        if not detector.loaded:
+            with db.connection() as conn:
+                restored = detector.load(conn, lines)
+            print(f"  Restored {restored} anomaly baseline slots")
+        with metrics.phase('anomalies'):
+            found = detector.observe(tracker.open_counts(), seen_lines, now)
+            with db.transaction() as conn:
+                detector.write(conn, found)
+                detector.checkpoint(conn)
+        for anomaly in found:
+            if anomaly.ended_at is not None:
+                print(f"✅ Line {anomaly.line} delays back to normal")
+            elif anomaly.started_at == now:
+                print(f"🚨 Line {anomaly.line}: {anomaly.peak_delays} open delays, "
+                      f"{anomaly.expected_delays:.1f} normal for this hour (z={anomaly.score:.1f})")
+    except Exception as e:
+        # Reloaded from the last checkpoint next cycle
+        detector.loaded = False
+        print(f"❌ Failed to update delay anomalies: {e}")
 
 def scrape_alerts():
     print(f"\n🚨 Scraping MTA service alerts at {datetime.now().strftime('%H:%M:%S')}...")
 
     try:
-        response = requests.get(ALERT_FEED_URL)
-        response.raise_for_status()
-        
-        data = response.json()
+        now = datetime.now()
+        current = {}
+        found = set()
         
-        conn = get_db_connection()
-        conn.run("DELETE FROM alerts")
+        # Entities are parsed as they stream in rather than after loading the
+        # whole document
+        with metrics.phase('alert_fetch'), requests.get(ALERT_FEED_URL, stream=True, timeout=alerts.FETCH_TIMEOUT) as response:
+            response.raise_for_status()
+            for entity in alerts.iter_entities(response.iter_content(alerts.CHUNK_SIZE), found):
+                current.update(alerts.parse_entity(entity, LINES))
+                # A feed trickling in slower than the job's deadline is given up on
+                left = jobs.time_left()
+                if left is not None and left < 0:
+                    raise TimeoutError("alert feed still downloading at the job's deadline")
 
-        alerts_saved = 0
+        # An empty document or one without a header or entity list is a bad
+        # fetch, not a feed with no alerts; keep what is stored
+        if 'header' not in found or 'entity' not in found:
+            print("  No entities in feed\n")
+            return None
         
-        if 'entity' not in data:
-            print("  No entities in feed")
-            conn.close()
-            return
-
-        for entity in data.get('entity', []):
-            if 'alert' not in entity:
-                continue
-                
-            alert = entity['alert']
-            
-            # Get affected lines
-            affected_lines = set()
-            for informed in alert.get('informed_entity', []):
-                route_id = informed.get('route_id', '').strip().upper()
-                if route_id in LINES:
-                    affected_lines.add(route_id)
-            
-            if not affected_lines:
-                continue
-            
-            # Get header and description
-            header = ''
-            description = ''
-            
-            if 'header_text' in alert and 'translation' in alert['header_text']:
-                translations = alert['header_text']['translation']
-                if translations:
-                    header = translations[0].get('text', '')
-            
-            if 'description_text' in alert and 'translation' in alert['description_text']:
-                translations = alert['description_text']['translation']
-                if translations:
-                    description = translations[0].get('text', '')
-            
-            # Determine alert type
-            header_lower = header.lower()
-            if 'delay' in header_lower:
-                alert_type = 'delay'
-            elif 'suspended' in header_lower:
-                alert_type = 'suspended'
-            elif 'skipped' in header_lower:
-                alert_type = 'stops_skipped'
-            elif 'express' in header_lower or 'local' in header_lower:
-                alert_type = 'express_to_local'
-            elif 'reduced' in header_lower:
-                alert_type = 'reduced_service'
-            elif 'planned' in header_lower:
-                alert_type = 'planned_work'
-            else:
-                alert_type = 'service_change'
-            
-            for line in affected_lines:
-                conn.run(
-                    """INSERT INTO alerts (line, alert_type, header, description, created_at)
-                       VALUES (:line, :alert_type, :header, :description, :created_at)""",
-                    line=line,
-                    alert_type=alert_type,
-                    header=header,
-                    description=description,
-                    created_at=datetime.now()
-                )
-                alerts_saved += 1
-                print(f"  Alert for Line {line}: [{alert_type}] {header[:60]}...")
-
-        conn.close()
-        print(f"✅ Saved {alerts_saved} alerts to database\n")
+        if not alerts.store.loaded:
+            with db.connection() as conn:
+                alerts.store.load(conn)
+        
+        # Only alerts that are new, changed or gone since the last scrape are
+        # written; unchanged alerts keep their ids and created_at
+        new, updated, removed = alerts.store.diff(current)
+        if new or updated or removed:
+            with metrics.phase('alert_write'), db.transaction() as conn:
+                alerts.write_diff(conn, new, updated, removed, now)
+                bump_data_version(conn)
+                live.publish_alert_changes(conn, new, updated, removed)
+            alerts.store.commit(current)
+        
+        for alert in new:
+            print(f"  New alert for Line {alert['line']}: [{alert['alert_type']}] {alert['header'][:60]}...")
+        print(f"✅ {len(current)} active alerts: {len(new)} new, {len(updated)} updated, {len(removed)} cleared\n")
+        return {'new': new, 'updated': updated, 'removed': removed}
 
     except Exception as e:
+        # The stored hashes may no longer match the table; reload next time
+        alerts.store.loaded = False
         print(f"❌ Failed to scrape alerts: {e}\n")
+        return None
 
 if __name__ == "__main__":
     scrape_all_feeds()
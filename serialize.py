@@ -0,0 +1,184 @@
+from json.encoder import encode_basestring_ascii
+from datetime import date, datetime
+from dotenv import load_dotenv
+from decimal import Decimal
+from flask import Response, request
+import json
+import gzip
+import math
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+# Bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5))
+# Arrays longer than this are encoded and sent in chunks of this many rows
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', 1000))
+JSON_MIMETYPE = 'application/json'
+
+# Decimals and timestamps go out as strings, as the API has always sent
+# them: "4.2" so no precision is lost, and str(datetime)
+# ("2026-01-01 05:00:00") rather than orjson's native "2026-01-01T05:00:00".
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+def _quoted_str(value):
+    return '"' + str(value) + '"'
+
+def _float(value):
+    # NaN and infinities aren't valid JSON; null, as orjson sends them
+    return float.__repr__(value) if math.isfinite(value) else 'null'
+
+_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _float,
+    bool: lambda v: 'true' if v else 'false',
+    type(None): lambda v: 'null',
+    Decimal: _quoted_str,
+    datetime: _quoted_str,
+    date: _quoted_str
+}
+
+def _encode_value(value):
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        return json.dumps(value, default=_default, separators=(',', ':'))
+    return encoder(value)
+
+class RowEncoder:
+    """Encodes DB row tuples straight to JSON objects.
+
+    Keys are encoded once per response rather than once per row, and no
+    intermediate dicts are built on the stdlib path. With orjson, handing it
+    one list of dicts is faster than encoding value by value, so that path
+    zips instead.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self._prefixes = [encode_basestring_ascii(f) + ':' for f in self.fields]
+
+    def encode_rows(self, rows):
+        if orjson is not None:
+            fields = self.fields
+            return dumps([dict(zip(fields, row)) for row in rows])
+        prefixes = self._prefixes
+        parts = [
+            '{' + ','.join([p + _encode_value(v) for p, v in zip(prefixes, row)]) + '}'
+            for row in rows
+        ]
+        return ('[' + ','.join(parts) + ']').encode('utf-8')
+
+    def iter_rows(self, rows, chunk_rows=STREAM_CHUNK_ROWS):
+        # Yields the array in pieces so only one chunk is encoded at a time
+        yield b'['
+        for start in range(0, len(rows), chunk_rows):
+            chunk = self.encode_rows(rows[start:start + chunk_rows])
+            # Drop the chunk's own brackets and join chunks with a comma
+            yield (b',' if start else b'') + chunk[1:-1]
+        yield b']'
+
+def json_response(obj, status=200):
+    return Response(dumps(obj), status=status, mimetype=JSON_MIMETYPE)
+
+def rows_response(rows, fields, stream=None):
+    # One JSON object per row, keyed by `fields` in row order. Large results
+    # are streamed unless the caller says otherwise (cached routes buffer the
+    # body anyway).
+    encoder = RowEncoder(fields)
+    if stream is None:
+        stream = len(rows) > STREAM_CHUNK_ROWS
+    if stream:
+        return Response(encoder.iter_rows(rows), mimetype=JSON_MIMETYPE)
+    return Response(encoder.encode_rows(rows), mimetype=JSON_MIMETYPE)
+
+def negotiate_encoding(accept_encoding=None):
+    accept = (request.headers.get('Accept-Encoding', '') if accept_encoding is None else accept_encoding).lower()
+    offered = {}
+    for part in accept.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip()] = q
+    if brotli is not None and offered.get('br', 0) > 0:
+        return 'br'
+    if offered.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def _compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+        return
+    import zlib
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def compress_response(response):
+    # after_request hook: compresses JSON bodies for clients that accept it.
+    # Responses that are already encoded (cached variants) are left alone.
+    response.vary.add('Accept-Encoding')
+    if (response.mimetype != JSON_MIMETYPE or response.status_code < 200 or response.status_code == 204
+            or 'Content-Encoding' in response.headers):
+        return response
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
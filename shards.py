@@ -0,0 +1,235 @@
+from dotenv import load_dotenv
+import socket
+import math
+import time
+import sys
+import os
+import db
+import metrics
+
+load_dotenv()
+
+# With sharding on, every scheduler process scrapes the feed groups it holds
+# a lease on instead of all of them; leader-only jobs (alerts, emails,
+# maintenance, the coordinator) still run on one process
+SHARDING = os.getenv('SCRAPE_SHARDING', '').lower() in ('1', 'true', 'yes')
+WORKER_ID = os.getenv('SCHEDULER_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+# A lease (and a worker's heartbeat) not renewed for this long is up for
+# grabs; a few scrape intervals
+LEASE_SECONDS = float(os.getenv('SCRAPE_LEASE_SECONDS', 90))
+# Per-feed completion rows kept for the coordinator and the status CLI
+HISTORY_HOURS = int(os.getenv('SCRAPE_CYCLE_HISTORY_HOURS', 24))
+
+feeds_owned = metrics.registry.gauge(
+    'subway_shard_feeds_owned', 'Feed groups this scheduler process holds a lease on')
+cycle_feeds = metrics.registry.gauge(
+    'subway_cycle_feeds', 'Feed groups in the last coordinated scrape cycle by outcome', ['status'])
+
+def feed_groups(lines):
+    # Feed name -> the lines it carries, the unit work is sharded by
+    from feeds import FeedResult, group_by_feed
+    return {FeedResult(url, feed_lines).name: feed_lines for url, feed_lines in group_by_feed(lines).items()}
+
+def rebalance(conn, feeds, worker_id=WORKER_ID, lease_seconds=LEASE_SECONDS):
+    # Heartbeats, renews this worker's leases and claims or gives up leases
+    # so every live worker holds about len(feeds) / workers of them. Rows
+    # are locked in feed order, so concurrent rebalances queue up instead
+    # of racing. Returns the feeds this worker now holds.
+    conn.run("""
+        INSERT INTO scrape_workers (worker_id, heartbeat_at) VALUES (:worker, NOW())
+        ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = NOW()
+    """, worker=worker_id)
+    conn.run("""
+        INSERT INTO scrape_leases (feed)
+        SELECT unnest(CAST(:feeds AS text[]))
+        ON CONFLICT (feed) DO NOTHING
+    """, feeds=sorted(feeds))
+    workers = conn.run("""
+        SELECT COUNT(*) FROM scrape_workers
+        WHERE heartbeat_at > NOW() - :lease * INTERVAL '1 second'
+    """, lease=lease_seconds)[0][0]
+    leases = conn.run("""
+        SELECT feed, owner, expires_at > NOW() as live
+        FROM scrape_leases
+        WHERE feed = ANY(CAST(:feeds AS text[]))
+        ORDER BY feed
+        FOR UPDATE
+    """, feeds=sorted(feeds))
+
+    target = math.ceil(len(feeds) / max(workers, 1))
+    mine = [feed for feed, owner, live in leases if owner == worker_id and live]
+    free = [feed for feed, owner, live in leases if owner is None or not live]
+    release = []
+    if len(mine) > target:
+        # Hand the surplus back for newer workers to pick up
+        release = mine[target:]
+        mine = mine[:target]
+    else:
+        mine += free[:target - len(mine)]
+
+    if release:
+        conn.run("""
+            UPDATE scrape_leases SET owner = NULL, expires_at = NULL
+            WHERE owner = :worker AND feed = ANY(CAST(:feeds AS text[]))
+        """, worker=worker_id, feeds=release)
+    if mine:
+        conn.run("""
+            UPDATE scrape_leases
+            SET acquired_at = CASE WHEN owner = :worker AND expires_at > NOW() THEN acquired_at ELSE NOW() END,
+                owner = :worker,
+                expires_at = NOW() + :lease * INTERVAL '1 second'
+            WHERE feed = ANY(CAST(:feeds AS text[]))
+        """, worker=worker_id, feeds=mine, lease=lease_seconds)
+    return sorted(mine)
+
+def release_all(conn, worker_id=WORKER_ID):
+    # On a clean shutdown, so the feeds move without waiting for the leases
+    # to expire
+    conn.run("UPDATE scrape_leases SET owner = NULL, expires_at = NULL WHERE owner = :worker", worker=worker_id)
+    conn.run("DELETE FROM scrape_workers WHERE worker_id = :worker", worker=worker_id)
+
+def cycle_number(interval, ts=None):
+    # Workers align their feed jobs to wall-clock multiples of the interval,
+    # so the same cycle has the same number everywhere: the interval the job
+    # started in, however late in it
+    return int((time.time() if ts is None else ts) // interval)
+
+def aligned_delay(interval, offset=0):
+    # Seconds until the wall clock is next `offset` seconds into an interval
+    return interval - (time.time() - offset) % interval
+
+class ShardWorker:
+    """The feeds job of one scheduler process in sharded mode.
+
+    Each run rebalances leases, then scrapes only the owned feed groups and
+    records how each one went for the coordinator. When the owned set
+    changes, in-memory delay and anomaly state is rebuilt for the new lines
+    from the database, where the previous owner left it.
+    """
+
+    def __init__(self, lines, interval, worker_id=WORKER_ID):
+        self.groups = feed_groups(lines)
+        self.interval = interval
+        self.worker_id = worker_id
+        self.owned = []
+
+    def run(self):
+        from scraper import scrape_all_feeds
+        from delay_events import tracker
+        import anomalies
+
+        cycle = cycle_number(self.interval)
+        with db.transaction() as conn:
+            owned = rebalance(conn, list(self.groups), self.worker_id)
+        if owned != self.owned:
+            print(f"🔀 Worker {self.worker_id} now scrapes {', '.join(owned) or 'nothing'} "
+                  f"(was {', '.join(self.owned) or 'nothing'})")
+            try:
+                with db.connection() as conn:
+                    anomalies.detector.checkpoint(conn, force=True)
+            except Exception as e:
+                print(f"❌ Failed to checkpoint anomaly baselines: {e}")
+            tracker.loaded = False
+            anomalies.detector.loaded = False
+            self.owned = owned
+        feeds_owned.set(len(owned))
+        if not owned:
+            return
+
+        lines = [line for feed in owned for line in self.groups[feed]]
+        summary = scrape_all_feeds(lines)
+        # A failed delay write fails every feed of the cycle
+        results = summary['feeds'] if summary is not None else {}
+        rows = [(cycle, feed, self.worker_id,
+                 results[feed]['status'] if feed in results else 'error',
+                 results[feed]['delayed_stops'] if feed in results else None)
+                for feed in owned]
+        with db.connection() as conn:
+            db.insert_many(conn, 'scrape_cycle_feeds',
+                           ['cycle', 'feed', 'worker_id', 'status', 'delayed_stops'], rows,
+                           suffix="""
+                ON CONFLICT (cycle, feed) DO UPDATE SET
+                    worker_id = EXCLUDED.worker_id,
+                    status = EXCLUDED.status,
+                    delayed_stops = EXCLUDED.delayed_stops,
+                    finished_at = EXCLUDED.finished_at
+            """)
+
+    def stop(self):
+        try:
+            with db.connection() as conn:
+                release_all(conn, self.worker_id)
+        except Exception as e:
+            print(f"❌ Failed to release scrape leases: {e}")
+
+def coordinate(conn, feeds, interval, cycle=None):
+    # Merges the per-feed rows of one cycle (by default the one before the
+    # current interval, which has passed its deadline) into a single
+    # scrape_cycles row
+    if cycle is None:
+        cycle = cycle_number(interval) - 1
+    rows = conn.run("SELECT feed, status, worker_id FROM scrape_cycle_feeds WHERE cycle = :cycle", cycle=cycle)
+    statuses = {feed: status for feed, status, _ in rows}
+    ok = sum(1 for s in statuses.values() if s in ('ok', 'not_modified'))
+    failed = sum(1 for s in statuses.values() if s not in ('ok', 'not_modified'))
+    missing = sorted(set(feeds) - set(statuses))
+    state = 'complete' if ok == len(feeds) else 'partial' if ok else 'failed'
+    conn.run("""
+        INSERT INTO scrape_cycles
+            (cycle, cycle_at, status, feeds_ok, feeds_failed, feeds_missing, workers, missing, finished_at)
+        VALUES (:cycle, TO_TIMESTAMP(:cycle_ts), :status, :ok, :failed, :n_missing, :workers, :missing,
+                (SELECT MAX(finished_at) FROM scrape_cycle_feeds WHERE cycle = :cycle))
+        ON CONFLICT (cycle) DO UPDATE SET
+            status = EXCLUDED.status,
+            feeds_ok = EXCLUDED.feeds_ok,
+            feeds_failed = EXCLUDED.feeds_failed,
+            feeds_missing = EXCLUDED.feeds_missing,
+            workers = EXCLUDED.workers,
+            missing = EXCLUDED.missing,
+            finished_at = EXCLUDED.finished_at
+    """, cycle=cycle, cycle_ts=cycle * interval, status=state, ok=ok, failed=failed,
+        n_missing=len(missing), workers=len({w for _, _, w in rows}), missing=','.join(missing) or None)
+    oldest = cycle - int(HISTORY_HOURS * 3600 / interval)
+    conn.run("DELETE FROM scrape_cycle_feeds WHERE cycle < :oldest", oldest=oldest)
+    conn.run("DELETE FROM scrape_cycles WHERE cycle < :oldest", oldest=oldest)
+    cycle_feeds.set(ok, status='ok')
+    cycle_feeds.set(failed, status='failed')
+    cycle_feeds.set(len(missing), status='missing')
+    if state != 'complete':
+        print(f"⚠️ Scrape cycle {cycle} {state}: {ok}/{len(feeds)} feeds ok"
+              + (f", missing {', '.join(missing)}" if missing else ""))
+    return state
+
+def status(conn, cycles=10):
+    workers = conn.run("""
+        SELECT worker_id, started_at, heartbeat_at, heartbeat_at > NOW() - :lease * INTERVAL '1 second'
+        FROM scrape_workers ORDER BY worker_id
+    """, lease=LEASE_SECONDS)
+    leases = conn.run("SELECT feed, owner, expires_at, expires_at > NOW() FROM scrape_leases ORDER BY feed")
+    recent = conn.run("""
+        SELECT cycle, cycle_at, status, feeds_ok, feeds_failed, feeds_missing, workers, missing
+        FROM scrape_cycles ORDER BY cycle DESC LIMIT :n
+    """, n=cycles)
+    return workers, leases, recent
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'status':
+        print("Usage: python shards.py status")
+        return 2
+    with db.connection() as conn:
+        workers, leases, recent = status(conn)
+    print("Workers:")
+    for worker_id, started_at, heartbeat_at, live in workers:
+        print(f"  {worker_id:<32} {'live' if live else 'gone':<5} last heartbeat {heartbeat_at:%H:%M:%S}")
+    print("Leases:")
+    for feed, owner, expires_at, live in leases:
+        print(f"  {feed:<12} {owner if owner and live else '-':<32}"
+              + (f" until {expires_at:%H:%M:%S}" if owner and live else ""))
+    print("Cycles:")
+    for cycle, cycle_at, state, ok, failed, n_missing, n_workers, missing in recent:
+        print(f"  {cycle} {cycle_at:%H:%M:%S} {state:<9} {ok} ok, {failed} failed, {n_missing} missing"
+              f" from {n_workers} worker(s)" + (f" ({missing})" if missing else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,357 @@
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import numpy as np
+import itertools
+import threading
+import argparse
+import atexit
+import heapq
+import sys
+import os
+from delay_events import DelayTracker, write_events
+import partitions
+import rollups
+import extract
+import db
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+load_dotenv()
+
+# Every stop_time_update of every parsed feed, one file per feed per batch of
+# cycles under ROOT/date=YYYY-MM-DD/feed=<name>/. Archiving is off unless the
+# directory is set; setting it without pyarrow installed is a startup error.
+ROOT = os.getenv('SNAPSHOT_ARCHIVE_DIR')
+# 'arrow' (Arrow IPC, memory-mapped on read) or 'parquet' (smaller, slower)
+FORMAT = os.getenv('SNAPSHOT_ARCHIVE_FORMAT', 'arrow')
+COMPRESSION = os.getenv('SNAPSHOT_ARCHIVE_COMPRESSION', 'zstd')
+# Cycles buffered per feed before a file is written; at most this many
+# cycles are lost if the scheduler dies
+BATCH_CYCLES = int(os.getenv('SNAPSHOT_ARCHIVE_BATCH_CYCLES', 20))
+
+EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+def _schema():
+    return pa.schema([
+        ('cycle_at', pa.timestamp('us')),
+        ('captured_at', pa.timestamp('us')),
+        ('line', pa.dictionary(pa.int16(), pa.string())),
+        ('trip_id', pa.string()),
+        ('stop_id', pa.string()),
+        ('delay_seconds', pa.int32()),
+        ('arrival', pa.int64())
+    ])
+
+def snapshot_table(snapshot, cycle_at):
+    # One row per stop_time_update. cycle_at is the scrape's start time,
+    # shared by every feed in the cycle, so a replay can regroup them.
+    n = len(snapshot)
+    lines = pa.DictionaryArray.from_arrays(
+        pa.array(snapshot.line_codes, pa.int16()), pa.array(snapshot.lines, pa.string()))
+    return pa.Table.from_arrays([
+        pa.array(np.full(n, np.datetime64(cycle_at, 'us'))),
+        pa.array(np.full(n, np.datetime64(snapshot.captured_at, 'us'))),
+        lines,
+        pa.array(snapshot.trip_id, pa.string()),
+        pa.array(snapshot.stop_id, pa.string()),
+        pa.array(snapshot.delay_seconds, pa.int32()),
+        pa.array(snapshot.arrival, pa.int64())
+    ], schema=_schema())
+
+class ArchiveWriter:
+    """Buffers flattened feed snapshots and writes them as immutable,
+    compressed columnar files.
+
+    Files are written under a temporary name and renamed into place, so
+    readers never see a partial file and nothing is ever rewritten.
+    """
+
+    def __init__(self, root=ROOT, fmt=FORMAT, compression=COMPRESSION, batch_cycles=BATCH_CYCLES):
+        self.root = root
+        self.format = fmt
+        self.compression = compression
+        self.batch_cycles = batch_cycles
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.stats = {'files': 0, 'rows': 0, 'bytes': 0, 'failures': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.root) and pa is not None
+
+    def add(self, feed, snapshot, cycle_at):
+        # Never raises: a full disk must not stop delays being recorded
+        if not self.enabled:
+            return
+        try:
+            table = snapshot_table(snapshot, cycle_at)
+            with self._lock:
+                # A new day starts a new partition
+                for key in [k for k in self._pending if k[1] == feed and k[0] != cycle_at.date()]:
+                    self._write(key, self._pending.pop(key))
+                key = (cycle_at.date(), feed)
+                self._pending.setdefault(key, []).append((table, snapshot.lines))
+                if len(self._pending[key]) >= self.batch_cycles:
+                    self._write(key, self._pending.pop(key))
+        except Exception as e:
+            self.stats['failures'] += 1
+            print(f"❌ Failed to archive feed {feed}: {e}")
+
+    def _write(self, key, batch):
+        day, feed = key
+        table = pa.concat_tables([t for t, _ in batch])
+        lines = batch[-1][1]
+        table = table.replace_schema_metadata({'feed': feed, 'lines': ','.join(lines)})
+        cycles = table.column('cycle_at')
+        first = pc.min(cycles).as_py()
+        last = pc.max(cycles).as_py()
+        directory = partition_dir(self.root, day, feed)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{first:%H%M%S}-{last:%H%M%S}-{os.getpid()}{EXTENSIONS[self.format]}"
+        path = os.path.join(directory, name)
+        tmp = os.path.join(directory, '.' + name + '.tmp')
+        if self.format == 'parquet':
+            pq.write_table(table, tmp, compression=self.compression)
+        else:
+            options = ipc.IpcWriteOptions(compression=self.compression)
+            with pa.OSFile(tmp, 'wb') as sink, ipc.new_file(sink, table.schema, options=options) as out:
+                out.write_table(table)
+        os.replace(tmp, path)
+        self.stats['files'] += 1
+        self.stats['rows'] += table.num_rows
+        self.stats['bytes'] += os.path.getsize(path)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for key, batch in pending.items():
+                try:
+                    self._write(key, batch)
+                except Exception as e:
+                    self.stats['failures'] += 1
+                    print(f"❌ Failed to archive feed {key[1]}: {e}")
+
+    def close(self):
+        if self.enabled:
+            self.flush()
+
+writer = None
+
+def init_writer(root=ROOT):
+    # Called by the scheduler at startup. Returns None when archiving is
+    # off; the scraper only archives once a writer exists.
+    global writer
+    if not root:
+        return None
+    if pa is None:
+        raise RuntimeError("SNAPSHOT_ARCHIVE_DIR is set but pyarrow is not installed; "
+                           "install it or unset SNAPSHOT_ARCHIVE_DIR")
+    if writer is not None:
+        writer.close()
+    writer = ArchiveWriter(root)
+    atexit.register(writer.close)
+    print(f"🗄️ Archiving feed snapshots to {root} as {FORMAT}")
+    return writer
+
+def partition_dir(root, day, feed):
+    return os.path.join(root, f"date={day.isoformat()}", f"feed={feed}")
+
+def files(root=None, since=None, until=None, feeds=None):
+    # (day, feed, path) in time order for days in [since, until); partitions
+    # outside the range are skipped without opening anything
+    root = root or ROOT
+    if not root or not os.path.isdir(root):
+        return []
+    found = []
+    for day_dir in sorted(os.listdir(root)):
+        if not day_dir.startswith('date='):
+            continue
+        day = datetime.strptime(day_dir[5:], '%Y-%m-%d').date()
+        if (since and day < since) or (until and day >= until):
+            continue
+        for feed_dir in sorted(os.listdir(os.path.join(root, day_dir))):
+            feed = feed_dir[5:]
+            if not feed_dir.startswith('feed=') or (feeds and feed not in feeds):
+                continue
+            directory = os.path.join(root, day_dir, feed_dir)
+            for name in sorted(os.listdir(directory)):
+                if not name.startswith('.') and name.endswith(tuple(EXTENSIONS.values())):
+                    found.append((day, feed, os.path.join(directory, name)))
+    return found
+
+def read_file(path, columns=None):
+    # Files are memory-mapped, so only the columns asked for are paged in
+    # (and decompressed)
+    if path.endswith('.parquet'):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    source = pa.memory_map(path, 'r')
+    options = ipc.IpcReadOptions()
+    if columns:
+        names = _schema().names
+        options = ipc.IpcReadOptions(included_fields=sorted(names.index(c) for c in columns))
+    return ipc.open_file(source, options=options).read_all()
+
+def scan(root=None, since=None, until=None, feeds=None, columns=None):
+    # Yields one table per file
+    for _, _, path in files(root, since, until, feeds):
+        yield read_file(path, columns)
+
+def read(root=None, since=None, until=None, feeds=None, columns=None):
+    tables = list(scan(root, since, until, feeds, columns))
+    if not tables:
+        return None
+    return pa.concat_tables(tables)
+
+def _feed_cycles(paths, threshold):
+    # Per-cycle (cycle_at, feed lines, observations) for one feed's files.
+    # Rows under the threshold are dropped in Arrow before anything becomes
+    # a Python object.
+    for path in paths:
+        table = read_file(path, ['cycle_at', 'line', 'trip_id', 'stop_id', 'delay_seconds'])
+        lines = (table.schema.metadata or {}).get(b'lines', b'').decode('utf-8').split(',')
+        cycles = np.unique(table.column('cycle_at').to_numpy())
+        table = table.filter(pc.greater(table.column('delay_seconds'), threshold))
+        table = table.sort_by('cycle_at')
+        cycle_at = table.column('cycle_at').to_numpy()
+        codes = table.column('line').combine_chunks()
+        dictionary = codes.dictionary.to_pylist() if len(codes) else []
+        # Map the file's dictionary onto the feed's line order
+        remap = np.array([lines.index(line) for line in dictionary], dtype=np.int16)
+        line_codes = remap[codes.indices.to_numpy()] if len(codes) else np.zeros(0, dtype=np.int16)
+        trip_ids = table.column('trip_id').to_numpy(zero_copy_only=False)
+        stop_ids = table.column('stop_id').to_numpy(zero_copy_only=False)
+        delays = table.column('delay_seconds').to_numpy()
+        bounds = np.searchsorted(cycle_at, cycles, side='left').tolist() + [len(cycle_at)]
+        for i, cycle in enumerate(cycles):
+            start, end = bounds[i], bounds[i + 1]
+            snapshot = extract.FeedSnapshot()
+            snapshot.lines = lines
+            snapshot.line_codes = line_codes[start:end]
+            snapshot.trip_id = trip_ids[start:end]
+            snapshot.stop_id = stop_ids[start:end]
+            snapshot.delay_seconds = delays[start:end]
+            observations, _ = extract.delayed(snapshot, threshold)
+            yield cycle.astype('datetime64[us]').item(), lines, observations
+
+def cycles(root=None, since=None, until=None, threshold=None):
+    # Merges every feed back into scrape cycles, in time order:
+    # (cycle_at, seen_lines, observations) as scrape_all_feeds had them
+    threshold = extract.DELAY_THRESHOLD_SECONDS if threshold is None else threshold
+    by_feed = {}
+    for _, feed, path in files(root, since, until):
+        by_feed.setdefault(feed, []).append(path)
+    merged = heapq.merge(*[_feed_cycles(paths, threshold) for paths in by_feed.values()],
+                         key=lambda c: c[0])
+    current = None
+    for cycle_at, lines, observations in merged:
+        if current is not None and current[0] != cycle_at:
+            yield current
+            current = None
+        if current is None:
+            current = (cycle_at, set(), [])
+        current[1].update(lines)
+        current[2].extend(observations)
+    if current is not None:
+        yield current
+
+def replay(root=None, since=None, until=None, target='delays', dry_run=False):
+    # Rebuilds `delays` (and then the rollups from it) or only the rollups
+    # for days [since, until) from the archive, through the same DelayTracker
+    # the scraper uses. Delays already open at `since` start over as new
+    # events.
+    tracker = DelayTracker()
+    totals = {'cycles': 0, 'new': 0, 'updated': 0, 'closed': 0}
+    start = datetime.combine(since, datetime.min.time())
+    end = datetime.combine(until, datetime.min.time())
+    if not dry_run:
+        with db.transaction() as conn:
+            if target == 'delays':
+                partitions.ensure_partitions(conn, since, until - timedelta(days=1))
+                conn.run("DELETE FROM delays WHERE timestamp >= :start AND timestamp < :end", start=start, end=end)
+            else:
+                for table in rollups.ROLLUP_TABLES.values():
+                    conn.run(f"DELETE FROM {table} WHERE bucket >= :start AND bucket < :end", start=start, end=end)
+
+    def replay_day(conn, day_cycles):
+        for cycle_at, seen_lines, observations in day_cycles:
+            changed, closed = tracker.apply(observations, seen_lines, cycle_at)
+            new_events = sum(1 for e in changed if e.previous_delay is None)
+            totals['cycles'] += 1
+            totals['new'] += new_events
+            totals['updated'] += len(changed) - new_events
+            totals['closed'] += len(closed)
+            if conn is None or not (changed or closed):
+                continue
+            if target == 'delays':
+                write_events(conn, changed, closed, cycle_at)
+            else:
+                rollups.apply_events(conn, [e for e in changed if start <= e.started_at < end])
+
+    # One transaction per archived day
+    for day, day_cycles in itertools.groupby(cycles(root, since, until), key=lambda c: c[0].date()):
+        print(f"  Replaying {day}...")
+        if dry_run:
+            replay_day(None, day_cycles)
+            continue
+        with db.transaction() as conn:
+            replay_day(conn, day_cycles)
+
+    if not dry_run and target == 'delays':
+        with db.transaction() as conn:
+            rollups.backfill(conn, start)
+    return totals
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='snapshot_archive.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ls = commands.add_parser('ls', help='list archived files')
+    replay_cmd = commands.add_parser('replay', help='rebuild delays or rollups from the archive')
+    for command in (ls, replay_cmd):
+        command.add_argument('--root', default=ROOT)
+        command.add_argument('--since', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date())
+        command.add_argument('--until', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(),
+                             help='first day not included (default: tomorrow)')
+    replay_cmd.add_argument('--target', choices=['delays', 'rollups'], default='delays')
+    replay_cmd.add_argument('--dry-run', action='store_true', help='replay in memory and only print totals')
+    args = parser.parse_args(argv[1:])
+
+    if pa is None:
+        print("pyarrow is not installed")
+        return 2
+    if not args.root:
+        print("Set SNAPSHOT_ARCHIVE_DIR or pass --root")
+        return 2
+    until = args.until or datetime.now().date() + timedelta(days=1)
+
+    if args.command == 'ls':
+        total_rows = total_bytes = 0
+        for day, feed, path in files(args.root, args.since, until):
+            rows = read_file(path, ['cycle_at']).num_rows
+            size = os.path.getsize(path)
+            total_rows += rows
+            total_bytes += size
+            print(f"  {day} {feed:<6} {os.path.basename(path):<32} {rows:>9} rows {size / 1024:>9.0f} KiB")
+        print(f"{total_rows} rows, {total_bytes / 1024 / 1024:.1f} MiB")
+        return 0
+
+    since = args.since
+    if since is None:
+        found = files(args.root, None, until)
+        if not found:
+            print("Nothing archived")
+            return 1
+        since = found[0][0]
+    totals = replay(args.root, since, until, args.target, args.dry_run)
+    print(f"✅ Replayed {totals['cycles']} cycles from {since} to {until}: {totals['new']} new, "
+          f"{totals['updated']} updated, {totals['closed']} closed delay events"
+          + (" (dry run)" if args.dry_run else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,3 +1,12 @@
 #!/bin/bash
+# Scheduler and web share a host here, so the API can read the scheduler's
+# in-memory hot window over localhost. A sharded worker's window only covers
+# its own lines, so then the API reads the rollups instead.
+export HOT_WINDOW_PORT=${HOT_WINDOW_PORT:-8765}
+case "${SCRAPE_SHARDING,,}" in
+    1|true|yes) unset HOT_WINDOW_URL ;;
+    *) export HOT_WINDOW_URL=${HOT_WINDOW_URL:-http://127.0.0.1:$HOT_WINDOW_PORT} ;;
+esac
 python scheduler.py &
-gunicorn app:app --bind 0.0.0.0:$PORT
\ No newline at end of file
+# gevent workers keep thousands of idle /api/live streams open cheaply
+gunicorn 'app:create_app()' --bind 0.0.0.0:$PORT --worker-class gevent --worker-connections 1000
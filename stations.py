@@ -0,0 +1,403 @@
+from dotenv import load_dotenv
+from datetime import datetime
+from array import array
+import importlib.util
+import threading
+import time
+import csv
+import os
+
+load_dotenv()
+
+# stops.txt from the static GTFS; defaults to the copy bundled with nyct-gtfs
+STOPS_PATH = os.getenv('GTFS_STOPS_PATH')
+HOURS = int(os.getenv('STATION_WINDOW_HOURS', 24))
+WORST_SIZE = int(os.getenv('STATION_WORST_SIZE', 50))
+
+def _default_stops_path():
+    spec = importlib.util.find_spec('nyct_gtfs')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return os.path.join(spec.submodule_search_locations[0], 'gtfs_static', 'stops.txt')
+
+class StationDirectory:
+    """Static station metadata from GTFS stops.txt.
+
+    Platform stops (101N, 101S) and their parent station (101) all resolve
+    to the parent's index; names and coordinates are kept in parallel lists
+    indexed the same way.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.names = []
+        self.lat = array('d')
+        self.lon = array('d')
+        self._index = {}
+        self._stops = {}
+
+    def load(self, path):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+        # Parents first so children can point at them
+        rows.sort(key=lambda r: bool(r.get('parent_station')))
+        for row in rows:
+            stop_id = row['stop_id']
+            parent = row.get('parent_station')
+            if parent and parent in self._index:
+                self._stops[stop_id] = self._index[parent]
+                continue
+            i = len(self.ids)
+            self.ids.append(stop_id)
+            self.names.append(row['stop_name'])
+            self.lat.append(float(row['stop_lat'] or 0))
+            self.lon.append(float(row['stop_lon'] or 0))
+            self._index[stop_id] = i
+            self._stops[stop_id] = i
+        return self
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, stop_id):
+        # Realtime stop ids carry the direction (101N); strip it when the
+        # platform isn't listed
+        if stop_id is None:
+            return None
+        i = self._stops.get(stop_id)
+        if i is None and stop_id[-1:] in ('N', 'S'):
+            i = self._stops.get(stop_id[:-1])
+        return i
+
+    def station_id(self, stop_id):
+        i = self.index_of(stop_id)
+        return None if i is None else self.ids[i]
+
+    def stop_ids(self, station_id):
+        # Every id that resolves to the station, for the database fallback
+        i = self._index.get(station_id)
+        if i is None:
+            return []
+        return sorted(s for s, j in self._stops.items() if j == i)
+
+    def info(self, i):
+        return {'station_id': self.ids[i], 'name': self.names[i], 'lat': self.lat[i], 'lon': self.lon[i]}
+
+_directory = None
+_directory_lock = threading.Lock()
+
+def directory():
+    # Loaded once per process on first use
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                path = STOPS_PATH or _default_stops_path()
+                stations = StationDirectory()
+                if path and os.path.exists(path):
+                    stations.load(path)
+                else:
+                    print(f"❌ No GTFS stops.txt found ({path}); station lookups are disabled")
+                _directory = stations
+    return _directory
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+class StationBoard:
+    """Per-station delay aggregates for the scheduler process.
+
+    Hourly event counts / sums / maxes live in flat arrays of
+    len(directory) * hours, with one shared hour per slot, so memory is
+    fixed by the station count. Open delays are re-aggregated per station
+    and per platform after every scrape, and the worst-station ranking and
+    every station's summary are rebuilt at the same time, so reads are a
+    dict lookup or a list slice.
+    """
+
+    def __init__(self, stations=None, hours=HOURS, worst_size=WORST_SIZE):
+        self.hours = hours
+        self.worst_size = worst_size
+        self._stations = stations
+        self._lock = threading.Lock()
+        self.slot_hour = None
+        self.count = self.total = self.peak = self.last = None
+        self._open = {}
+        self._summaries = {}
+        self._worst = []
+        self.unmatched = 0
+        self.loaded = False
+        self.updated_at = None
+
+    @property
+    def stations(self):
+        if self._stations is None:
+            self._stations = directory()
+        return self._stations
+
+    def _ensure_arrays(self):
+        if self.slot_hour is not None:
+            return
+        n = len(self.stations) * self.hours
+        self.slot_hour = array('q', [-1] * self.hours)
+        self.count = array('q', bytes(8 * n))
+        self.total = array('d', bytes(8 * n))
+        self.peak = array('f', bytes(4 * n))
+        self.last = array('d', bytes(8 * n))
+
+    def _slot(self, ts):
+        hour = int(ts // 3600)
+        slot = hour % self.hours
+        if self.slot_hour[slot] != hour:
+            if self.slot_hour[slot] > hour:
+                # Older than the window
+                return None
+            # The hour rolled over: clear the slot for every station
+            self.slot_hour[slot] = hour
+            for i in range(slot, len(self.count), self.hours):
+                self.count[i] = 0
+                self.total[i] = 0.0
+                self.peak[i] = 0.0
+                self.last[i] = 0.0
+        return slot
+
+    def _add(self, station, ts, count, added, minutes):
+        slot = self._slot(ts)
+        if slot is None:
+            return
+        i = station * self.hours + slot
+        self.count[i] += count
+        self.total[i] += added
+        self.peak[i] = max(self.peak[i], minutes)
+        self.last[i] = max(self.last[i], ts)
+
+    def record_events(self, events):
+        # Same accounting as hot_window.record_events, keyed by station
+        with self._lock:
+            self._ensure_arrays()
+            for event in events:
+                station = self.stations.index_of(event.stop_id)
+                if station is None:
+                    self.unmatched += 1
+                    continue
+                minutes = event.delay_minutes
+                if event.previous_delay is None:
+                    count, added = 1, minutes
+                else:
+                    count, added = 0, minutes - round(event.previous_delay / 60, 1)
+                self._add(station, event.started_at.timestamp(), count, added, minutes)
+
+    def record_open(self, events, now):
+        # Replaces the open-delay aggregates with the tracker's current open
+        # events and rebuilds everything reads are served from
+        open_delays = {}
+        for event in events:
+            station = self.stations.index_of(event.stop_id)
+            if station is None:
+                continue
+            entry = open_delays.get(station)
+            if entry is None:
+                entry = open_delays[station] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'lines': set(), 'stops': {}}
+            minutes = event.delay_minutes
+            entry['count'] += 1
+            entry['sum'] += minutes
+            entry['max'] = max(entry['max'], minutes)
+            entry['lines'].add(event.line)
+            stop = entry['stops'].get(event.stop_id)
+            if stop is None:
+                stop = entry['stops'][event.stop_id] = [0, 0.0]
+            stop[0] += 1
+            stop[1] = max(stop[1], minutes)
+        with self._lock:
+            self._ensure_arrays()
+            self._open = open_delays
+            self._rebuild(now.timestamp())
+
+    def load(self, conn):
+        # Rebuilds the hourly slots from the database after a restart
+        rows = conn.run("""
+            SELECT stop_id, timestamp, delay_minutes
+            FROM delays
+            WHERE timestamp > DATE_TRUNC('hour', NOW()) - :hours * INTERVAL '1 hour'
+            ORDER BY timestamp
+        """, hours=self.hours - 1)
+        with self._lock:
+            self.slot_hour = None
+            self._ensure_arrays()
+            for stop_id, ts, minutes in rows:
+                station = self.stations.index_of(stop_id)
+                if station is None:
+                    continue
+                minutes = float(minutes)
+                self._add(station, ts.timestamp(), 1, minutes, minutes)
+            self._rebuild(time.time())
+            self.loaded = True
+        return len(rows)
+
+    def _window(self, station, oldest_hour):
+        count = 0
+        total = 0.0
+        worst = 0.0
+        last = 0.0
+        base = station * self.hours
+        for slot in range(self.hours):
+            if self.slot_hour[slot] < oldest_hour:
+                continue
+            i = base + slot
+            if not self.count[i]:
+                continue
+            count += self.count[i]
+            total += self.total[i]
+            worst = max(worst, self.peak[i])
+            last = max(last, self.last[i])
+        return count, total, worst, last
+
+    def _rebuild(self, now_ts):
+        oldest_hour = int(now_ts // 3600) - self.hours + 1
+        summaries = {}
+        for station in range(len(self.stations)):
+            count, total, worst, last = self._window(station, oldest_hour)
+            current = self._open.get(station)
+            if not count and current is None:
+                continue
+            summary = self.stations.info(station)
+            summary.update({
+                'open_delays': current['count'] if current else 0,
+                'avg_open_delay': _round(current['sum'] / current['count']) if current else None,
+                'max_open_delay': _round(current['max']) if current else None,
+                'lines': sorted(current['lines']) if current else [],
+                'stops': {
+                    stop_id: {'open_delays': n, 'max_open_delay': _round(peak)}
+                    for stop_id, (n, peak) in sorted(current['stops'].items())
+                } if current else {},
+                'total_delays': count,
+                'avg_delay': _round(total / count) if count else None,
+                'max_delay': _round(worst) if count else None,
+                'last_delay_at': datetime.fromtimestamp(last) if last else None
+            })
+            summaries[summary['station_id']] = summary
+        ranked = sorted(
+            (s for s in summaries.values() if s['open_delays']),
+            key=lambda s: (s['open_delays'], s['max_open_delay'], s['total_delays']),
+            reverse=True
+        )
+        self._summaries = summaries
+        self._worst = ranked[:self.worst_size]
+        self.updated_at = datetime.fromtimestamp(now_ts)
+
+    def worst(self, limit=None):
+        with self._lock:
+            return self._worst[:limit]
+
+    def station(self, station_id):
+        # Accepts a platform id (101N) as well as the station id
+        i = self.stations.index_of(station_id)
+        if i is None:
+            return None
+        with self._lock:
+            summary = self._summaries.get(self.stations.ids[i])
+        if summary is not None:
+            return summary
+        # Known but quiet stations still get their metadata
+        return dict(self.stations.info(i), open_delays=0, avg_open_delay=None, max_open_delay=None,
+                    lines=[], stops={}, total_delays=0, avg_delay=None, max_delay=None, last_delay_at=None)
+
+    def memory_bytes(self):
+        with self._lock:
+            if self.slot_hour is None:
+                return 0
+            arrays = (self.slot_hour, self.count, self.total, self.peak, self.last)
+            return sum(a.itemsize * len(a) for a in arrays)
+
+board = StationBoard()
+
+# Database fallback for the API when the scheduler's board is unreachable.
+# Both queries are bounded by time and go through idx_delays_stop_timestamp
+# or partition pruning; they run on a budgets.connection(), which supplies
+# :budget_limit.
+
+def _query(conn, stop_ids, hours, open_only=False):
+    # Per (stop, line): events in the window plus the ones still open.
+    # open_only leaves out pairs with nothing open right now.
+    params = {'hours': hours - 1}
+    stop_filter = ''
+    if stop_ids is not None:
+        stop_filter = 'AND stop_id = ANY(CAST(:stop_ids AS text[]))'
+        params['stop_ids'] = stop_ids
+    having = 'HAVING COUNT(*) FILTER (WHERE closed_at IS NULL) > 0' if open_only else ''
+    return conn.run(f"""
+        SELECT
+            stop_id,
+            line,
+            COUNT(*) as total_delays,
+            SUM(delay_minutes) as delay_sum,
+            MAX(delay_minutes) as max_delay,
+            MAX(timestamp) as last_delay_at,
+            COUNT(*) FILTER (WHERE closed_at IS NULL) as open_delays,
+            SUM(delay_minutes) FILTER (WHERE closed_at IS NULL) as open_sum,
+            MAX(delay_minutes) FILTER (WHERE closed_at IS NULL) as open_max
+        FROM delays
+        WHERE timestamp > DATE_TRUNC('hour', NOW()) - :hours * INTERVAL '1 hour'
+        {stop_filter}
+        GROUP BY stop_id, line
+        {having}
+        LIMIT :budget_limit
+    """, **params)
+
+def query_station(conn, station_id, hours=HOURS):
+    stations = directory()
+    i = stations.index_of(station_id)
+    if i is None:
+        return None
+    rows = _query(conn, stations.stop_ids(stations.ids[i]), hours)
+    return _summarize(stations, i, rows)
+
+def query_worst(conn, limit, hours=HOURS):
+    stations = directory()
+    by_station = {}
+    for row in _query(conn, None, hours, open_only=True):
+        i = stations.index_of(row[0])
+        if i is not None:
+            by_station.setdefault(i, []).append(row)
+    ranked = sorted(
+        (_summarize(stations, i, station_rows) for i, station_rows in by_station.items()),
+        key=lambda s: (s['open_delays'], s['max_open_delay'], s['total_delays']),
+        reverse=True
+    )
+    return ranked[:limit]
+
+def _summarize(stations, i, rows):
+    count = open_count = 0
+    total = open_total = 0.0
+    worst = open_worst = None
+    last = None
+    lines = set()
+    stops = {}
+    for stop_id, line, n, delay_sum, peak, latest, n_open, open_sum, open_peak in rows:
+        count += n
+        total += float(delay_sum or 0)
+        if peak is not None:
+            worst = max(worst or 0.0, float(peak))
+        if latest is not None:
+            last = max(last, latest) if last else latest
+        if n_open:
+            open_count += n_open
+            open_total += float(open_sum)
+            open_worst = max(open_worst or 0.0, float(open_peak))
+            lines.add(line)
+            stop = stops.setdefault(stop_id, {'open_delays': 0, 'max_open_delay': 0.0})
+            stop['open_delays'] += n_open
+            stop['max_open_delay'] = max(stop['max_open_delay'], _round(float(open_peak)))
+    summary = stations.info(i)
+    summary.update({
+        'open_delays': open_count,
+        'avg_open_delay': _round(open_total / open_count) if open_count else None,
+        'max_open_delay': _round(open_worst),
+        'lines': sorted(lines),
+        'stops': dict(sorted(stops.items())),
+        'total_delays': count,
+        'avg_delay': _round(total / count) if count else None,
+        'max_delay': _round(worst),
+        'last_delay_at': last
+    })
+    return summary
@@ -0,0 +1,47 @@
+import json
+import pytest
+from alerts import iter_entities
+
+FEED = {
+    'header': {'gtfs_realtime_version': '1.0', 'timestamp': 1767250800},
+    'entity': [
+        {'id': 'a1', 'alert': {'header_text': {'translation': [{'text': 'Delays on the A — northbound'}]},
+                               'informed_entity': [{'route_id': 'A'}]}},
+        {'id': 'a2', 'alert': {'header_text': {'translation': [{'text': 'Trains skip 14 St 🚇'}]},
+                               'informed_entity': [{'route_id': 'F'}, {'route_id': 'M'}]}},
+        {'id': 3, 'alert': {'active_period': [{'start': 1767250800, 'end': 1767254400}]}},
+    ],
+    'trailer': 12345,
+}
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1 << 20])
+def test_entities_across_any_chunking(size):
+    data = json.dumps(FEED, ensure_ascii=False).encode('utf-8')
+    found = set()
+    assert list(iter_entities(chunked(data, size), found)) == FEED['entity']
+    assert found == {'header', 'entity', 'trailer'}
+
+def test_entity_before_header():
+    data = json.dumps({'entity': FEED['entity'][:1], 'header': FEED['header']}).encode('utf-8')
+    found = set()
+    assert list(iter_entities(chunked(data, 5), found)) == FEED['entity'][:1]
+    assert found == {'entity', 'header'}
+
+def test_empty_document_and_array():
+    found = set()
+    assert list(iter_entities([b' { } '], found)) == []
+    assert found == set()
+    assert list(iter_entities([b'{"header": {}, "entity": []}'], found)) == []
+    assert found == {'header', 'entity'}
+
+def test_truncated_feed_raises():
+    data = json.dumps(FEED).encode('utf-8')[:-40]
+    with pytest.raises(ValueError):
+        list(iter_entities(chunked(data, 16)))
+
+def test_not_an_object():
+    with pytest.raises(ValueError):
+        list(iter_entities([b'[1, 2]']))
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+import math
+import random
+import pytest
+import anomalies
+from anomalies import LineBaseline, AnomalyDetector, hour_of_week
+
+# A Monday, 8am
+NOW = datetime(2026, 3, 2, 8, 0)
+SLOT = hour_of_week(NOW)
+
+def test_alpha_follows_the_feed_interval():
+    assert anomalies.ALPHA == pytest.approx(1 / (anomalies.SAMPLES_PER_WEEK * anomalies.BASELINE_WEEKS))
+    assert anomalies.MIN_SAMPLES >= anomalies.SAMPLES_PER_WEEK
+
+def test_running_mean_until_one_over_alpha():
+    baseline = LineBaseline()
+    values = [2, 4, 6, 8]
+    for v in values:
+        baseline.update(SLOT, v, alpha=0.01)
+    assert baseline.mean[SLOT] == pytest.approx(5.0)
+    assert baseline.var[SLOT] == pytest.approx(5.0)
+    assert baseline.samples[SLOT] == 4
+    assert baseline.mean[SLOT + 1] == 0.0
+
+def test_ewma_converges_to_a_new_level():
+    random.seed(7)
+    alpha = 0.01
+    baseline = LineBaseline()
+    for _ in range(2000):
+        baseline.update(SLOT, 10 + random.gauss(0, 2), alpha=alpha)
+    assert baseline.mean[SLOT] == pytest.approx(10, abs=0.5)
+    assert math.sqrt(baseline.var[SLOT]) == pytest.approx(2, abs=0.5)
+
+    # After 1/alpha samples at a new level the mean has moved about 63% of
+    # the way there, and after 5/alpha it has all but arrived
+    for _ in range(int(1 / alpha)):
+        baseline.update(SLOT, 20, alpha=alpha)
+    assert 15 < baseline.mean[SLOT] < 17.5
+    for _ in range(int(4 / alpha)):
+        baseline.update(SLOT, 20, alpha=alpha)
+    assert baseline.mean[SLOT] == pytest.approx(20, abs=0.2)
+
+def trained_detector(line='A', mean=2.0, var=1.0):
+    detector = AnomalyDetector()
+    baseline = detector._baseline(line)
+    baseline.mean[SLOT] = mean
+    baseline.var[SLOT] = var
+    baseline.samples[SLOT] = anomalies.MIN_SAMPLES
+    return detector
+
+def run(detector, counts, cycles, start=NOW):
+    changed = []
+    for i in range(cycles):
+        changed += detector.observe(counts, set(counts), start + timedelta(seconds=30 * i))
+    return changed
+
+def test_untrained_slot_never_flags():
+    detector = AnomalyDetector()
+    run(detector, {'A': 2}, 100)
+    assert not detector.is_trained('A', NOW)
+    assert run(detector, {'A': 50}, anomalies.START_CYCLES + 1) == []
+    assert detector.active() == {}
+
+def test_burst_starts_and_ends_an_anomaly():
+    detector = trained_detector()
+    assert detector.is_trained('A', NOW)
+    burst = {'A': 20}
+    assert run(detector, burst, anomalies.START_CYCLES - 1) == []
+    started = run(detector, burst, 1)
+    assert [a.line for a in started] == ['A']
+    assert 'A' in detector.active()
+    assert started[0].expected_delays == pytest.approx(2.0)
+
+    # The baseline isn't taught the disruption
+    run(detector, burst, 10)
+    assert detector._baselines['A'].mean[SLOT] == pytest.approx(2.0)
+
+    assert run(detector, {'A': 2}, anomalies.END_CYCLES - 1) == []
+    ended = run(detector, {'A': 2}, 1)
+    assert ended[0].ended_at is not None
+    assert detector.active() == {}
+
+def test_small_lines_need_min_delays():
+    detector = trained_detector(mean=0.0, var=0.0)
+    assert run(detector, {'A': anomalies.MIN_DELAYS - 1}, 10) == []
+    assert run(detector, {'A': anomalies.MIN_DELAYS + 5}, anomalies.START_CYCLES)
+
+def test_only_seen_lines_are_scored():
+    detector = trained_detector()
+    for i in range(5):
+        detector.observe({'A': 20}, set(), NOW + timedelta(seconds=30 * i))
+    assert detector.active() == {}
+    assert detector._baselines['A'].samples[SLOT] == anomalies.MIN_SAMPLES
+
+def load_conn(make_conn, open_rows):
+    # Answers load()'s queries from open anomaly rows and the baseline slots
+    # of trained_detector(); new anomalies get id 7
+    conn = make_conn()
+    conn.on('SELECT id, line, created_at', open_rows)
+    conn.on('FROM delay_baselines', [['A', SLOT, 2.0, 1.0, anomalies.MIN_SAMPLES]])
+    conn.on('RETURNING id', [[7]])
+    return conn
+
+def test_reload_resumes_open_anomalies(monkeypatch, make_conn):
+    published = []
+    monkeypatch.setattr(anomalies.live, 'publish', lambda conn, kind, line, payload: published.append(kind))
+    detector = trained_detector()
+    started = run(detector, {'A': 20}, anomalies.START_CYCLES)
+    detector.write(load_conn(make_conn, []), started)
+    assert published == ['anomaly']
+
+    # A failed cycle drops the in-memory state; the row is still open
+    detector.loaded = False
+    anomaly = started[0]
+    conn = load_conn(make_conn, [[7, 'A', anomaly.started_at, anomaly.updated_at, 20, 2.0, 1.0, anomaly.score]])
+    assert detector.load(conn, ['A']) == 1
+    close = conn.sql()[0]
+    assert 'updated_at <=' in close and 'ended_at = updated_at' in close
+    resumed = detector.active()['A']
+    assert (resumed.id, resumed.started_at, resumed.peak_delays) == (7, anomaly.started_at, 20)
+
+    # Growing and ending it updates row 7; nothing new is started or announced
+    grown = run(detector, {'A': 30}, 1, start=NOW + timedelta(minutes=5))
+    assert grown == [resumed]
+    detector.write(conn, grown)
+    assert published == ['anomaly']
+    ended = run(detector, {'A': 2}, anomalies.END_CYCLES, start=NOW + timedelta(minutes=6))
+    detector.write(conn, ended)
+    assert ended == [resumed] and resumed.ended_at is not None
+    assert not any(sql.startswith('INSERT') for sql in conn.sql())
+    assert published == ['anomaly', 'anomaly']
@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+from datetime import datetime
+from flask import Flask
+import pytest
+import app as api_app
+import budgets
+import cache
+import hot_window
+import write_behind
+
+@pytest.fixture(scope='module')
+def client():
+    # Just the routes; invalid reports are turned away before anything
+    # touches the database or the write-behind buffer
+    app = Flask(__name__)
+    app.register_blueprint(api_app.api)
+    return app.test_client()
+
+@pytest.mark.parametrize('body', [
+    [],
+    'A',
+    {},
+    {'issue_type': 'delay'},
+    {'line': '', 'issue_type': 'delay'},
+    {'line': '   ', 'issue_type': 'delay'},
+    {'line': 7, 'issue_type': 'delay'},
+    {'line': 'A' * (write_behind.LINE_MAX_LENGTH + 1), 'issue_type': 'delay'},
+    {'line': 'A'},
+    {'line': 'A', 'issue_type': ''},
+    {'line': 'A', 'issue_type': ['delay']},
+    {'line': 'A', 'issue_type': 'x' * (write_behind.ISSUE_TYPE_MAX_LENGTH + 1)},
+    {'line': 'A', 'issue_type': 'delay', 'description': {'text': 'late'}},
+])
+def test_invalid_report_is_rejected(client, body):
+    response = client.post('/api/reports', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+def test_non_json_report_is_rejected(client):
+    response = client.post('/api/reports', data='line=A', content_type='application/x-www-form-urlencoded')
+    assert response.status_code == 400
+
+class RecordingReports:
+    def __init__(self):
+        self.upvoted = []
+
+    def upvote(self, report_id):
+        self.upvoted.append(report_id)
+
+def test_upvote_id_beyond_int4_is_rejected(client, monkeypatch):
+    reports = RecordingReports()
+    monkeypatch.setattr(write_behind, 'reports', reports)
+    assert client.post(f"/api/reports/{write_behind.REPORT_ID_MAX + 1}/upvote").status_code == 400
+    assert client.post('/api/reports/99999999999/upvote').status_code == 400
+    assert client.post(f"/api/reports/{write_behind.REPORT_ID_MAX}/upvote").status_code == 200
+    assert reports.upvoted == [write_behind.REPORT_ID_MAX]
+
+@pytest.fixture
+def factory(monkeypatch):
+    # create_app without a database: records what it sets up
+    calls = {'pools': [], 'warm_ups': 0}
+    monkeypatch.setattr(api_app.db, 'init_pool', lambda max_size: calls['pools'].append(max_size))
+    monkeypatch.setattr(api_app.write_behind, 'init_reports', lambda: None)
+    monkeypatch.setattr(api_app, 'run_warm_up', lambda app: calls.__setitem__('warm_ups', calls['warm_ups'] + 1))
+    return calls
+
+def test_create_app_warms_up_only_when_asked(factory):
+    app = api_app.create_app(warm_up=False)
+    assert factory['warm_ups'] == 0
+    assert '/api/lines' in {rule.rule for rule in app.url_map.iter_rules()}
+    api_app.create_app(warm_up=True)
+    assert factory['warm_ups'] == 1
+    assert len(factory['pools']) == 2
+
+class FakePool:
+    def __init__(self, error=None):
+        self.error = error
+
+    def warm(self, count):
+        if self.error:
+            raise self.error
+        return count
+
+def warm_up_app():
+    app = Flask(__name__)
+    app.add_url_rule('/ok', 'ok', lambda: 'ok')
+    return app
+
+def test_warm_up_primes_routes(monkeypatch, capsys):
+    monkeypatch.setattr(api_app.db, 'get_pool', lambda: FakePool())
+    monkeypatch.setattr(api_app.stations, 'directory', lambda: None)
+    monkeypatch.setattr(api_app, 'WARM_UP_PATHS', ['/ok', '/missing'])
+    api_app.run_warm_up(warm_up_app())
+    out = capsys.readouterr().out
+    assert f"{api_app.WARM_UP_CONNECTIONS} connections, 1/2 routes cached" in out
+
+def test_warm_up_survives_a_database_outage(monkeypatch, capsys):
+    monkeypatch.setattr(api_app.db, 'get_pool', lambda: FakePool(ConnectionError('refused')))
+    api_app.run_warm_up(warm_up_app())
+    assert 'could not open database connections' in capsys.readouterr().out
+
+def test_lines_fall_back_to_the_rollups_without_a_live_window(client, conn, monkeypatch):
+    # The scheduler next to the API is a standby: its window answers but
+    # was never loaded or scraped
+    standby = {'lines': {}, 'loaded': False, 'updated_at': None, 'memory_bytes': 0}
+    monkeypatch.setattr(hot_window, 'fetch', lambda path, timeout: standby)
+    monkeypatch.setattr(cache, 'response_cache', cache.ResponseCache())
+    monkeypatch.setattr(cache, 'current_data_version', lambda: (None, None))
+    monkeypatch.setattr(budgets, '_shed_until', {})
+    conn.on('FROM delay_rollups_hourly', [['A', 3, '4.5', '9.0', datetime(2026, 3, 2, 8)]])
+    monkeypatch.setattr(budgets, 'connection', contextmanager(lambda: (yield conn)))
+    response = client.get('/api/lines')
+    assert response.status_code == 200
+    assert response.get_json() == [{'line': 'A', 'total_delays': 3, 'avg_delay': '4.5', 'max_delay': '9.0',
+                                    'last_updated': '2026-03-02 08:00:00'}]
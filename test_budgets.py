@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from flask import Flask, g
+from pg8000.exceptions import DatabaseError
+import pytest
+import budgets
+from budgets import Budget, BudgetedConnection, BudgetExceeded, budget
+from cache import ResponseCache, CacheEntry
+
+@pytest.fixture
+def budgeted(make_conn):
+    # A connection whose SELECTs return `rows`, cut to the :budget_limit
+    # they are given like a LIMIT would
+    def make(rows=(), version=None):
+        rows = list(rows)
+        conn = make_conn()
+        conn.on('FROM data_version', [[version]])
+        conn.on(':budget_limit', lambda sql, params: rows[:params['budget_limit']])
+        return conn
+    return make
+
+def make_budget(max_rows=10, replica=True):
+    return Budget(timeout_ms=1000, max_rows=max_rows, replica=replica, max_lag=None)
+
+def test_statements_get_the_rows_left_as_their_limit(budgeted):
+    conn = budgeted(rows=[[i] for i in range(4)])
+    limited = BudgetedConnection(conn, make_budget(max_rows=10))
+    sql = "SELECT n FROM t ORDER BY n LIMIT :budget_limit"
+    assert len(limited.run(sql, line='A')) == 4
+    assert len(limited.run(sql)) == 4
+    # The route's own SQL, ORDER BY and all, goes through untouched
+    assert conn.statements[0] == (sql, {'budget_limit': 11, 'line': 'A'})
+    assert conn.statements[1][1]['budget_limit'] == 7
+
+def test_an_exact_fit_is_within_budget(budgeted):
+    limited = BudgetedConnection(budgeted(rows=[[i] for i in range(5)]), make_budget(max_rows=5))
+    assert len(limited.run("SELECT n FROM t LIMIT :budget_limit")) == 5
+
+def test_one_row_over_exceeds_the_budget(budgeted):
+    limited = BudgetedConnection(budgeted(rows=[[i] for i in range(10)]), make_budget(max_rows=3))
+    with pytest.raises(BudgetExceeded) as e:
+        limited.run("SELECT n FROM t LIMIT :budget_limit")
+    assert e.value.reason == 'rows'
+
+def test_statement_timeout_becomes_budget_exceeded(conn):
+    conn.error = DatabaseError({'C': budgets.QUERY_CANCELED, 'M': 'canceling statement due to statement timeout'})
+    with pytest.raises(BudgetExceeded) as e:
+        BudgetedConnection(conn, make_budget()).run("SELECT 1")
+    assert e.value.reason == 'timeout'
+    conn.error = DatabaseError({'C': '42P01', 'M': 'relation does not exist'})
+    with pytest.raises(DatabaseError):
+        BudgetedConnection(conn, make_budget()).run("SELECT 1")
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(budgets, '_shed_until', {})
+    monkeypatch.setattr(budgets, 'response_cache', ResponseCache())
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/slow')
+    @budget(timeout_ms=100)
+    def slow():
+        calls.append(1)
+        raise BudgetExceeded('timeout', 'statement ran past 100ms')
+
+    app.calls = calls
+    return app
+
+def test_over_budget_route_is_shed(app):
+    client = app.test_client()
+    response = client.get('/slow')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(int(budgets.SHED_SECONDS))
+    # Shed routes don't query again until SHED_SECONDS have passed
+    assert client.get('/slow').status_code == 503
+    assert app.calls == [1]
+
+def test_shed_route_serves_its_stale_response(app):
+    stale = CacheEntry(b'[1]', 200, 'application/json', budgets.time.monotonic() - 60, 1, None)
+    budgets.response_cache._entries[('/slow', b'')] = stale
+    response = app.test_client().get('/slow')
+    assert response.status_code == 200
+    assert response.get_data() == b'[1]'
+    assert 'Stale' in response.headers['Warning']
+
+def test_a_lagging_replica_falls_back_to_the_primary(monkeypatch, budgeted):
+    replica, primary = budgeted(version=3), budgeted(version=5)
+    monkeypatch.setattr(budgets.db, 'read_connection', contextmanager(lambda max_lag: (yield replica)))
+    monkeypatch.setattr(budgets.db, 'connection', contextmanager(lambda: (yield primary)))
+    monkeypatch.setattr(budgets, 'current_data_version', lambda: (5, None))
+    with Flask(__name__).test_request_context('/api/lines'):
+        g.query_budget = make_budget()
+        with budgets.connection() as conn:
+            conn.run("SELECT line FROM delay_rollups_hourly LIMIT :budget_limit")
+    assert replica.sql()[-1] == 'ROLLBACK'
+    assert primary.sql()[-1] == 'COMMIT'
+    assert any('delay_rollups_hourly' in sql for sql in primary.sql())
@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+import threading
+import pytest
+import cache
+from cache import ResponseCache, CacheEntry
+
+def entry(body=b'[]', status=200, version=1, ttl=60):
+    return CacheEntry(body, status, 'application/json', cache.time.monotonic() + ttl, version, None)
+
+def test_hit_until_data_version_changes():
+    rc = ResponseCache()
+    computed = []
+    def compute():
+        computed.append(1)
+        return entry(version=len(computed))
+    first = rc.get_or_compute('k', 1, compute)
+    assert rc.get_or_compute('k', 1, compute) is first
+    assert rc.get_or_compute('k', 2, compute) is not first
+    assert len(computed) == 2
+    assert rc.metrics()['hits'] == 1
+
+def test_expired_entries_are_recomputed():
+    rc = ResponseCache()
+    rc.get_or_compute('k', 1, lambda: entry(ttl=-1))
+    fresh = rc.get_or_compute('k', 1, lambda: entry())
+    assert rc.get_or_compute('k', 1, lambda: entry()) is fresh
+
+def test_errors_are_not_cached():
+    rc = ResponseCache()
+    rc.get_or_compute('k', 1, lambda: entry(status=500))
+    assert rc.peek('k') is None
+
+def test_least_recently_used_is_evicted():
+    rc = ResponseCache(max_entries=2)
+    for key in 'abc':
+        rc.get_or_compute(key, 1, entry)
+    assert rc.peek('a') is None
+    assert rc.peek('c') is not None
+    assert rc.metrics()['evictions'] == 1
+
+def test_concurrent_misses_compute_once():
+    rc = ResponseCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return entry()
+    results = []
+    leader = threading.Thread(target=lambda: results.append(rc.get_or_compute('k', 1, compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(rc.get_or_compute('k', 1, compute)))
+                 for _ in range(3)]
+    for t in followers:
+        t.start()
+    while rc.metrics()['coalesced'] < 3:
+        pass
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+    assert len(calls) == 1
+    assert len(results) == 4 and all(r is results[0] for r in results)
+
+def test_followers_see_the_leaders_error():
+    rc = ResponseCache()
+    started, release = threading.Event(), threading.Event()
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('db down')
+    errors = []
+    def call():
+        try:
+            rc.get_or_compute('k', 1, failing)
+        except RuntimeError as e:
+            errors.append(e)
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while rc.metrics()['coalesced'] < 1:
+        pass
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+@pytest.fixture
+def version_db(monkeypatch, conn):
+    # data_version as the scraper leaves it; counts the reads
+    state = {'version': 1}
+    conn.on('FROM data_version', lambda sql, params: [[state['version'], None]])
+    @contextmanager
+    def connection():
+        yield conn
+    monkeypatch.setattr(cache.db, 'connection', connection)
+    monkeypatch.setattr(cache, 'VERSION_CHECK_SECONDS', 60)
+    cache.expire_version_check()
+    yield state, conn
+    cache.expire_version_check()
+
+def test_data_version_is_reread_only_when_due(version_db):
+    state, conn = version_db
+    assert cache.current_data_version() == (1, None)
+    state['version'] = 2
+    assert cache.current_data_version() == (1, None)
+    assert len(conn.statements) == 1
+    # A live event means a scrape just finished
+    cache.expire_version_check()
+    assert cache.current_data_version() == (2, None)
+    assert len(conn.statements) == 2
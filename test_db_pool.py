@@ -0,0 +1,113 @@
+from pg8000.exceptions import InterfaceError
+import pytest
+import db
+from db import ConnectionPool, PoolTimeout, Replica, ReplicaRouter
+
+@pytest.fixture
+def make_pool(make_conn):
+    def make(**kwargs):
+        opened = []
+        def connect():
+            opened.append(make_conn([[0]]))
+            return opened[-1]
+        kwargs.setdefault('checkout_timeout', 0.01)
+        return ConnectionPool(connect=connect, **kwargs), opened
+    return make
+
+def test_connections_are_reused(make_pool):
+    pool, opened = make_pool(max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(opened) == 1
+    assert pool.metrics()['checkouts'] == 2
+
+def test_checkout_times_out_when_exhausted(make_pool):
+    pool, _ = make_pool(max_size=1)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(held)
+    assert pool.acquire() is held
+    assert pool.metrics()['timeouts'] == 1
+
+def test_interface_error_drops_the_connection(make_pool):
+    pool, opened = make_pool(max_size=1)
+    with pytest.raises(InterfaceError):
+        with pool.connection():
+            raise InterfaceError('socket closed')
+    assert opened[0].closed
+    with pool.connection() as conn:
+        assert conn is not opened[0]
+    assert pool.metrics()['open'] == 1
+
+def test_other_errors_roll_back_and_keep_the_connection(make_pool):
+    pool, opened = make_pool(max_size=1)
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError('bad input')
+    assert opened[0].sql() == ['ROLLBACK']
+    with pool.connection() as conn:
+        assert conn is opened[0]
+
+class Killed(BaseException):
+    # Stands in for gevent's GreenletExit
+    pass
+
+@pytest.mark.parametrize('error', [Killed, KeyboardInterrupt, GeneratorExit])
+def test_base_exceptions_release_the_slot(error, make_pool):
+    pool, opened = make_pool(max_size=1)
+    with pytest.raises(error):
+        with pool.connection():
+            raise error()
+    assert pool.metrics()['in_use'] == 0
+    assert opened[0].closed
+    with pool.connection() as conn:
+        assert conn is opened[1]
+
+def test_stale_idle_connection_is_replaced_when_unhealthy(make_pool):
+    pool, opened = make_pool(max_size=1, health_check_after=0)
+    with pool.connection():
+        pass
+    opened[0].error = InterfaceError('connection lost')
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert opened[0].closed
+    assert pool.metrics()['reconnects'] == 1
+
+def test_idle_connections_expire(make_pool):
+    pool, opened = make_pool(max_size=1, max_idle=-1)
+    with pool.connection():
+        pass
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert opened[0].closed
+
+def test_warm_opens_up_to_max_size(make_pool):
+    pool, opened = make_pool(max_size=3)
+    assert pool.warm(5) == 3
+    assert len(opened) == 3
+    assert pool.metrics()['idle'] == 3
+
+@pytest.fixture
+def replica(make_pool):
+    def make(host, lag):
+        pool, _ = make_pool(max_size=1)
+        r = Replica(host, pool)
+        r.lag, r.checked_at = lag, float('inf')
+        return r
+    return make
+
+def test_router_round_robins_caught_up_replicas(replica):
+    router = ReplicaRouter([replica('r1', 1), replica('r2', 2)], primary=None)
+    assert [router.choose(max_lag=10).host for _ in range(4)] == ['r1', 'r2', 'r1', 'r2']
+
+def test_router_skips_lagging_and_down_replicas(monkeypatch, replica):
+    lagging, down = replica('r1', 100), replica('r2', 0)
+    monkeypatch.setattr(db, 'REPLICA_RETRY_SECONDS', 60)
+    down.mark_down(RuntimeError('refused'))
+    router = ReplicaRouter([lagging, down], primary=None)
+    assert router.choose(max_lag=10) is None
+    assert router.choose(max_lag=200) is lagging
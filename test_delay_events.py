@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+from delay_events import DelayTracker
+
+T0 = datetime(2026, 3, 2, 8, 0, 0)
+
+def obs(trip, stop, seconds, line='A'):
+    return {'line': line, 'trip_id': trip, 'stop_id': stop, 'delay_seconds': seconds}
+
+def test_new_delay_is_written_once():
+    tracker = DelayTracker(change_seconds=60, stale_seconds=600)
+    changed, closed = tracker.apply([obs('t1', 'A01N', 300)], {'A'}, T0)
+    assert [e.key for e in changed] == [('t1', 'A01N')]
+    assert closed == []
+    assert changed[0].previous_delay is None
+
+    changed, closed = tracker.apply([obs('t1', 'A01N', 320)], {'A'}, T0 + timedelta(seconds=30))
+    assert changed == [] and closed == []
+    assert len(tracker) == 1
+
+def test_growth_past_change_seconds_is_written():
+    tracker = DelayTracker(change_seconds=60, stale_seconds=600)
+    tracker.apply([obs('t1', 'A01N', 300)], {'A'}, T0)
+    changed, _ = tracker.apply([obs('t1', 'A01N', 360)], {'A'}, T0 + timedelta(seconds=30))
+    assert len(changed) == 1
+    assert changed[0].delay_seconds == 360
+    assert changed[0].previous_delay == 300
+    assert changed[0].started_at == T0
+
+def test_delay_closes_when_its_line_is_seen_without_it():
+    tracker = DelayTracker(change_seconds=60, stale_seconds=600)
+    tracker.apply([obs('t1', 'A01N', 300), obs('t2', 'F01N', 300, line='F')], {'A', 'F'}, T0)
+    later = T0 + timedelta(seconds=30)
+    changed, closed = tracker.apply([], {'A'}, later)
+    assert changed == []
+    assert [e.key for e in closed] == [('t1', 'A01N')]
+    assert [e.key for e in tracker.open_events()] == [('t2', 'F01N')]
+
+def test_unseen_line_closes_only_once_stale():
+    tracker = DelayTracker(change_seconds=60, stale_seconds=600)
+    tracker.apply([obs('t1', 'A01N', 300)], {'A'}, T0)
+    _, closed = tracker.apply([], set(), T0 + timedelta(seconds=599))
+    assert closed == []
+    _, closed = tracker.apply([], set(), T0 + timedelta(seconds=601))
+    assert [e.key for e in closed] == [('t1', 'A01N')]
+    assert len(tracker) == 0
+
+def test_open_counts_per_line():
+    tracker = DelayTracker()
+    tracker.apply([obs('t1', 'A01N', 300), obs('t2', 'A02N', 400), obs('t3', 'F01N', 300, line='F')],
+                  {'A', 'F'}, T0)
+    assert tracker.open_counts() == {'A': 2, 'F': 1}
@@ -0,0 +1,60 @@
+from datetime import datetime
+from nyct_gtfs.compiled_gtfs import gtfs_realtime_pb2
+import extract
+
+HEADER_TIME = 1_800_000_000
+
+def feed(trips):
+    # trips: (trip_id, route_id, [(stop_id, delay, 'arrival' | 'departure')])
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.header.gtfs_realtime_version = '1.0'
+    message.header.timestamp = HEADER_TIME
+    for i, (trip_id, route_id, stops) in enumerate(trips):
+        entity = message.entity.add()
+        entity.id = str(i)
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route_id
+        for stop_id, delay, kind in stops:
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop_id
+            getattr(update, kind).delay = delay
+            getattr(update, kind).time = HEADER_TIME + 60
+    # A vehicle position entity is skipped
+    message.entity.add(id='v').vehicle.trip.trip_id = 't1'
+    return message.SerializeToString()
+
+FEED = feed([
+    ('t1', 'A', [('A01N', 300, 'arrival'), ('A02N', 60, 'arrival'), ('A03N', 121, 'departure')]),
+    ('t2', 'C', [('A01S', 120, 'arrival')]),
+    ('t3', 'H', [('H01N', 600, 'arrival')]),
+    ('t4', 'G', [('G01N', 900, 'arrival')]),
+])
+
+def test_flatten_keeps_only_requested_lines():
+    snapshot = extract.flatten(FEED, ['A', 'C', 'S'])
+    assert len(snapshot) == 5
+    # H is reported as S; G isn't one of the lines
+    assert snapshot.trips_by_line.tolist() == [1, 1, 1]
+    assert snapshot.captured_at == datetime.fromtimestamp(HEADER_TIME)
+
+def test_delayed_applies_the_threshold():
+    snapshot = extract.flatten(FEED, ['A', 'C', 'S'])
+    observations, by_line = extract.delayed(snapshot)
+    assert observations == [
+        {'line': 'A', 'trip_id': 't1', 'stop_id': 'A01N', 'delay_seconds': 300, 'delay_minutes': 5.0},
+        {'line': 'A', 'trip_id': 't1', 'stop_id': 'A03N', 'delay_seconds': 121, 'delay_minutes': 2.0},
+        {'line': 'S', 'trip_id': 't3', 'stop_id': 'H01N', 'delay_seconds': 600, 'delay_minutes': 10.0},
+    ]
+    assert by_line.tolist() == [2, 0, 1]
+
+def test_delayed_with_a_custom_threshold():
+    snapshot = extract.flatten(FEED, ['A', 'C', 'S'])
+    observations, by_line = extract.delayed(snapshot, threshold=0)
+    assert len(observations) == 5
+    assert by_line.tolist() == [3, 1, 1]
+
+def test_empty_feed():
+    snapshot = extract.flatten(feed([]), ['A'])
+    observations, by_line = extract.delayed(snapshot)
+    assert observations == []
+    assert by_line.tolist() == [0]
@@ -0,0 +1,94 @@
+from datetime import datetime
+import pytest
+import hot_window
+from delay_events import DelayEvent
+from hot_window import LineWindow, HotWindow
+
+HOUR = 3600
+# An hour boundary, so slots are easy to reason about
+T0 = 1_800_000_000 - 1_800_000_000 % HOUR
+
+def test_ring_buffer_keeps_the_newest_samples():
+    window = LineWindow(capacity=3, hours=2)
+    for i in range(5):
+        window.add_sample(T0 + i, float(i))
+    assert window.size == 3
+    # Only samples 2, 3 and 4 are left
+    assert window.recent(T0) == (3, 3.0)
+    assert window.recent(T0 + 4) == (1, 4.0)
+    assert window.recent(T0 + 5) == (0, None)
+
+def test_hourly_slots_accumulate_and_roll_over():
+    window = LineWindow(capacity=4, hours=2)
+    window.add_event(T0 + 10, 1, 5.0, 5.0)
+    window.add_event(T0 + 20, 1, 7.0, 7.0)
+    window.add_event(T0 + HOUR, 1, 3.0, 3.0)
+    summary = window.summary(T0 + HOUR)
+    assert summary['total_delays'] == 3
+    assert summary['avg_delay'] == 5.0
+    assert summary['max_delay'] == 7.0
+    assert [h['delay_count'] for h in summary['hourly']] == [2, 1]
+    # Two hours on, the first hour's slot is reused
+    window.add_event(T0 + 2 * HOUR, 1, 9.0, 9.0)
+    summary = window.summary(T0 + 2 * HOUR)
+    assert summary['total_delays'] == 2
+    assert summary['max_delay'] == 9.0
+
+def test_events_older_than_the_window_are_ignored():
+    window = LineWindow(capacity=4, hours=2)
+    window.add_event(T0 + 2 * HOUR, 1, 4.0, 4.0)
+    window.add_event(T0, 1, 8.0, 8.0)
+    assert window.summary(T0 + 2 * HOUR)['total_delays'] == 1
+
+def test_memory_is_fixed_by_capacity():
+    window = LineWindow(capacity=100, hours=24)
+    before = window.memory_bytes()
+    for i in range(1000):
+        window.add_sample(T0 + i, 1.0)
+        window.add_event(T0 + i * 60, 1, 1.0, 1.0)
+    assert window.memory_bytes() == before
+
+def test_grown_events_count_once():
+    started = datetime.fromtimestamp(T0 + 60)
+    event = DelayEvent('A', 't1', 'A01N', started, 300, started)
+    hot = HotWindow(capacity=4, hours=2)
+    hot.record_events([event])
+    event.previous_delay, event.delay_seconds = 300, 600
+    hot.record_events([event])
+    summary = hot._lines['A'].summary(T0 + 60)
+    assert summary['total_delays'] == 1
+    assert summary['avg_delay'] == 10.0
+
+def test_load_rebuilds_the_hourly_slots(make_conn):
+    hot = HotWindow(capacity=4, hours=2)
+    hot.record_open([DelayEvent('C', 't9', 'A01N', datetime.fromtimestamp(T0), 60, None)],
+                    datetime.fromtimestamp(T0))
+    assert hot.load(make_conn([('A', datetime.fromtimestamp(T0 + 5), 4)])) == 1
+    assert hot.loaded
+    # Not trusted until the next scrape records the open delays
+    assert hot.updated_at is None
+    assert set(hot._lines) == {'A'}
+    assert hot._lines['A'].summary(T0 + 5)['total_delays'] == 1
+
+def test_a_scrape_marks_the_window_updated():
+    hot = HotWindow(capacity=4, hours=2)
+    now = datetime.fromtimestamp(T0)
+    hot.record_open([], now)
+    assert hot.updated_at == now
+
+@pytest.mark.parametrize('body', [
+    None,
+    # A standby scheduler: never loaded, never scraped
+    {'lines': {}, 'loaded': False, 'updated_at': None, 'memory_bytes': 0},
+    # Just restarted: loaded, no scrape yet
+    {'lines': {}, 'loaded': True, 'updated_at': None, 'memory_bytes': 0},
+])
+def test_fetch_lines_needs_a_loaded_and_scraped_window(monkeypatch, body):
+    monkeypatch.setattr(hot_window, 'fetch', lambda path, timeout: body)
+    assert hot_window.fetch_lines() is None
+
+def test_fetch_lines_returns_a_live_window(monkeypatch):
+    body = {'lines': {'A': {'total_delays': 1}}, 'loaded': True, 'updated_at': '2026-03-02 08:00:00',
+            'memory_bytes': 64}
+    monkeypatch.setattr(hot_window, 'fetch', lambda path, timeout: body)
+    assert hot_window.fetch_lines() == {'A': {'total_delays': 1}}
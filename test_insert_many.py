@@ -0,0 +1,24 @@
+from db import insert_many
+
+def test_one_statement_per_batch(conn):
+    rows = [(i, f"line{i}") for i in range(5)]
+    assert insert_many(conn, 'delays', ['id', 'line'], rows, batch_size=2) == 5
+    assert len(conn.statements) == 3
+    sql, params = conn.statements[0]
+    assert sql == "INSERT INTO delays (id, line) VALUES (:p0_0, :p0_1), (:p1_0, :p1_1)"
+    assert params == {'p0_0': 0, 'p0_1': 'line0', 'p1_0': 1, 'p1_1': 'line1'}
+    assert conn.statements[2][1] == {'p0_0': 4, 'p0_1': 'line4'}
+
+def test_suffix_is_appended_to_every_statement(conn):
+    insert_many(conn, 'alerts', ['id'], [(1,), (2,), (3,)], batch_size=2, suffix=' ON CONFLICT DO NOTHING')
+    assert all(sql.endswith(' ON CONFLICT DO NOTHING') for sql, _ in conn.statements)
+
+def test_batch_shrinks_to_the_parameter_limit(conn):
+    columns = [f"c{i}" for i in range(10000)]
+    insert_many(conn, 'wide', columns, [tuple(range(10000))] * 4, batch_size=500)
+    # 32767 // 10000 = 3 rows per statement
+    assert [len(params) for _, params in conn.statements] == [30000, 10000]
+
+def test_no_rows_runs_nothing(conn):
+    assert insert_many(conn, 'delays', ['id'], []) == 0
+    assert conn.statements == []
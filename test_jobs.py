@@ -0,0 +1,59 @@
+import pytest
+import jobs
+from jobs import Scheduler
+
+@pytest.fixture
+def skipped(monkeypatch):
+    counts = []
+    monkeypatch.setattr(jobs.job_skipped, 'inc', lambda n=1, **labels: counts.append(n))
+    return counts
+
+def make_job(next_run=100.0, interval=30):
+    scheduler = Scheduler()
+    job = scheduler.add('feeds', lambda: None, interval)
+    job.next_run = next_run
+    return scheduler, job
+
+def test_on_time_tick_moves_one_interval(skipped):
+    scheduler, job = make_job()
+    scheduler._advance(job, 100.0)
+    assert job.next_run == 130.0
+    assert skipped == []
+
+def test_late_tick_stays_on_grid(skipped):
+    scheduler, job = make_job()
+    scheduler._advance(job, 112.5)
+    assert job.next_run == 130.0
+    assert skipped == []
+
+def test_missed_ticks_are_skipped_and_counted(skipped):
+    scheduler, job = make_job()
+    scheduler._advance(job, 195.0)
+    assert job.next_run == 220.0
+    assert skipped == [3]
+
+def test_exactly_on_a_later_tick(skipped):
+    scheduler, job = make_job()
+    scheduler._advance(job, 160.0)
+    assert job.next_run == 190.0
+    assert skipped == [2]
+
+def test_schedule_from_splits_leader_only_jobs():
+    scheduler = Scheduler()
+    leader = scheduler.add('alerts', lambda: None, 120, delay=5)
+    shared = scheduler.add('feeds', lambda: None, 30, delay=2, leader_only=False)
+    scheduler._schedule_from(50.0, leader_only=False)
+    assert (leader.next_run, shared.next_run) == (None, 52.0)
+    scheduler._schedule_from(80.0)
+    assert (leader.next_run, shared.next_run) == (85.0, 52.0)
+
+def test_callable_delay_is_asked_when_leadership_starts():
+    scheduler = Scheduler()
+    phase = [5.0]
+    coordinator = scheduler.add('coordinator', lambda: None, 30, delay=lambda: phase[0])
+    scheduler._schedule_from(50.0)
+    assert coordinator.next_run == 55.0
+    # Becoming leader again later lines the grid up anew
+    phase[0] = 12.0
+    scheduler._schedule_from(200.0)
+    assert coordinator.next_run == 212.0
@@ -0,0 +1,63 @@
+from datetime import datetime
+import json
+import pytest
+from delay_events import DelayEvent
+import live
+from live import Broker
+
+@pytest.fixture
+def broker(monkeypatch):
+    # No LISTEN connection; events are dispatched by hand
+    monkeypatch.setattr(Broker, '_ensure_listener', lambda self: None)
+    monkeypatch.setattr(live, 'broker', Broker())
+    return live.broker
+
+def test_clients_get_only_their_lines(broker):
+    a = broker.subscribe(['A'])
+    everything = broker.subscribe([])
+    broker.dispatch({'type': 'line_stats', 'line': 'A'})
+    broker.dispatch({'type': 'line_stats', 'line': 'C'})
+    assert a.qsize() == 1
+    assert [everything.get_nowait()['line'] for _ in range(2)] == ['A', 'C']
+
+def test_every_event_reaches_on_event(broker):
+    seen = []
+    broker.on_event = seen.append
+    broker.dispatch({'type': 'report', 'line': 'A'})
+    assert seen == [{'type': 'report', 'line': 'A'}]
+
+def test_a_client_that_falls_behind_is_dropped(broker, monkeypatch):
+    monkeypatch.setattr(live, 'CLIENT_QUEUE_SIZE', 2)
+    slow = broker.subscribe(['A'])
+    for _ in range(3):
+        broker.dispatch({'type': 'line_stats', 'line': 'A'})
+    assert broker.client_count() == 0
+    assert slow.full()
+
+def test_sse_stream_formats_events_and_ends_on_drop(broker):
+    stream = live.sse_stream(['A'])
+    assert next(stream) == "retry: 5000\n\n"
+    [client] = broker._subscribers
+    client.put_nowait({'type': 'alert', 'line': 'A', 'data': {'action': 'new'}})
+    client.put_nowait(None)
+    chunk = next(stream)
+    assert chunk.startswith("event: alert\ndata: ")
+    assert json.loads(chunk.split('data: ', 1)[1])['data'] == {'action': 'new'}
+    assert list(stream) == []
+    assert broker.client_count() == 0
+
+def payloads(conn):
+    return [json.loads(params['payload']) for _, params in conn.statements]
+
+def test_delay_changes_are_summarized_per_line(conn):
+    now = datetime(2026, 3, 2, 8, 0)
+    new = DelayEvent('A', 't1', 'A01N', now, 300, now)
+    grown = DelayEvent('A', 't2', 'A02N', now, 720, now)
+    grown.previous_delay = 300
+    cleared = DelayEvent('C', 't3', 'A03N', now, 300, now)
+    live.publish_delay_changes(conn, [new, grown], [cleared], {'A': 4})
+    by_line = {p['line']: p['data'] for p in payloads(conn)}
+    assert by_line['A'] == {'new_delays': 1, 'updated_delays': 1, 'cleared_delays': 0, 'max_delay': 12.0,
+                            'open_delays': 4}
+    assert by_line['C'] == {'new_delays': 0, 'updated_delays': 0, 'cleared_delays': 1, 'max_delay': 0,
+                            'open_delays': 0}
@@ -0,0 +1,73 @@
+import pytest
+import metrics
+from metrics import Registry
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+def test_counter_and_gauge_render(registry):
+    requests = registry.counter('test_requests_total', 'Requests', ['route'])
+    requests.inc(route='/a')
+    requests.inc(2, route='/a')
+    registry.gauge('test_open', 'Open things').set(1.5)
+    text = registry.render()
+    assert '# TYPE test_requests_total counter' in text
+    assert 'test_requests_total{route="/a"} 3' in text
+    assert 'test_open 1.5' in text
+
+def test_registry_returns_the_same_metric_by_name(registry):
+    assert registry.counter('test_x', 'X') is registry.counter('test_x', 'X')
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = registry.histogram('test_seconds', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value)
+    text = registry.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 3' in text
+    assert 'test_seconds_bucket{le="+Inf"} 4' in text
+    assert 'test_seconds_sum 6.05' in text
+    assert 'test_seconds_count 4' in text
+
+def test_label_values_are_escaped(registry):
+    registry.counter('test_total', 'T', ['q']).inc(q='say "hi"\n')
+    assert 'test_total{q="say \\"hi\\"\\n"} 1' in registry.render()
+
+def test_collectors_run_at_render_and_failures_are_skipped(registry):
+    gauge = registry.gauge('test_pool', 'Pool')
+    registry.add_collector(lambda: gauge.set(4))
+    registry.add_collector(lambda: 1 / 0)
+    assert 'test_pool 4' in registry.render()
+
+@pytest.mark.parametrize('sql, label', [
+    ("SELECT line FROM delay_rollups_hourly WHERE x", 'SELECT delay_rollups_hourly'),
+    ("  INSERT INTO delays (a) VALUES (1)", 'INSERT delays'),
+    ("UPDATE reports SET upvotes = 1", 'UPDATE reports'),
+    ("CREATE TABLE IF NOT EXISTS delays_p20260302 PARTITION OF delays", 'CREATE delays_p20260302'),
+    ("WITH raw AS (SELECT 1 FROM delays) SELECT 1", 'CTE delays'),
+    ("SELECT 1", 'SELECT'),
+])
+def test_query_label(sql, label):
+    assert metrics.query_label(sql) == label
+
+def test_phases_add_up_in_the_cycle(monkeypatch):
+    logged = []
+    monkeypatch.setattr(metrics, 'log', lambda event, **fields: logged.append((event, fields)))
+    with metrics.cycle('test', budget=60) as trace:
+        with metrics.phase('parse'):
+            pass
+        with metrics.phase('parse'):
+            pass
+    assert list(trace.phases) == ['parse']
+    event, fields = logged[-1]
+    assert event == 'cycle' and fields['cycle'] == 'test' and not fields['overrun']
+
+def test_overrun_is_counted(monkeypatch):
+    monkeypatch.setattr(metrics, 'log', lambda event, **fields: None)
+    before = metrics.cycle_overruns.samples()
+    with metrics.cycle('test-overrun', budget=-1):
+        pass
+    after = dict(((name, key), value) for name, key, _, value in metrics.cycle_overruns.samples())
+    assert after[('subway_cycle_overruns_total', ('test-overrun',))] == 1
+    assert len(after) == len(before) + 1
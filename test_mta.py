@@ -0,0 +1,92 @@
+import threading
+import pytest
+import feeds
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+@pytest.fixture
+def mta(monkeypatch):
+    # Stands in for the MTA: answers each URL from a queue of responses
+    # and records the headers it was sent
+    monkeypatch.setattr(feeds, 'RETRY_BACKOFF', 0)
+    feeds.forget_validators()
+    server = {'responses': {}, 'requests': []}
+    def get(url, headers=None, timeout=None):
+        server['requests'].append((url, dict(headers or {})))
+        queue = server['responses'][url]
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+    monkeypatch.setattr(feeds.requests, 'get', get)
+    yield server
+    feeds.forget_validators()
+
+ACE = feeds.feed_url('A')
+
+def test_lines_sharing_a_feed_fetch_it_once(mta):
+    mta['responses'] = {feeds.feed_url(line): [FakeResponse(content=line.encode())] for line in 'A1L'}
+    results = feeds.fetch_feeds(['A', 'C', 'E', '1', '2', 'L'])
+    assert len(mta['requests']) == 3
+    by_name = {r.name: r for r in results}
+    assert by_name['gtfs-ace'].lines == ['A', 'C', 'E']
+    assert all(r.status == 'ok' for r in results)
+
+def test_server_errors_are_retried(mta):
+    mta['responses'][ACE] = [FakeResponse(503), FakeResponse(content=b'feed')]
+    [result] = feeds.fetch_feeds(['A'], retries=2)
+    assert result.status == 'ok'
+    assert result.attempts == 2
+    assert result.error is None
+
+def test_gives_up_after_the_last_retry(mta):
+    mta['responses'][ACE] = [FakeResponse(500)]
+    [result] = feeds.fetch_feeds(['A'], retries=1)
+    assert result.status == 'error'
+    assert result.attempts == 2
+    assert result.content is None
+
+def test_validators_are_sent_only_once_remembered(mta):
+    full = FakeResponse(content=b'feed', headers={'ETag': '"v1"'})
+    mta['responses'][ACE] = [full, full, FakeResponse(304)]
+    [first] = feeds.fetch_feeds(['A'])
+    # Not applied yet, so the next cycle downloads it again in full
+    [again] = feeds.fetch_feeds(['A'])
+    assert 'If-None-Match' not in mta['requests'][1][1]
+    assert again.status == 'ok'
+    feeds.remember_validators([first])
+    [third] = feeds.fetch_feeds(['A'])
+    assert mta['requests'][2][1]['If-None-Match'] == '"v1"'
+    assert third.status == 'not_modified'
+
+def test_same_body_counts_as_not_modified(mta):
+    mta['responses'][ACE] = [FakeResponse(content=b'feed')]
+    [first] = feeds.fetch_feeds(['A'])
+    feeds.remember_validators([first])
+    [second] = feeds.fetch_feeds(['A'])
+    assert second.status == 'not_modified'
+    assert second.content is None
+
+def test_deadline_turns_slow_downloads_into_errors(monkeypatch):
+    release = threading.Event()
+    def get(url, headers=None, timeout=None):
+        release.wait(5)
+        return FakeResponse(content=b'late')
+    monkeypatch.setattr(feeds.requests, 'get', get)
+    try:
+        [result] = feeds.fetch_feeds(['A'], deadline=0.05)
+    finally:
+        release.set()
+    assert result.status == 'error'
+    assert isinstance(result.error, TimeoutError)
+
+def test_route_aliases():
+    assert feeds.route_to_line(' gs ') == 'S'
+    assert feeds.route_to_line('6X') == '6'
+    assert feeds.route_to_line('A') == 'A'
+    assert feeds.route_to_line(None) == ''
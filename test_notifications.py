@@ -0,0 +1,44 @@
+import notifications
+from notifications import TokenBucket
+
+class Clock:
+    # Stands in for the time module inside notifications
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+def test_burst_then_rate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(notifications, 'time', clock)
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [0.5]
+    bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+
+def test_refills_up_to_capacity(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(notifications, 'time', clock)
+    bucket = TokenBucket(rate=4, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 60
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [0.25]
+
+def test_zero_burst_still_allows_one():
+    assert TokenBucket(rate=1, burst=0).capacity == 1
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+import pytest
+import pagination
+from pagination import BadRequest, encode_cursor, decode_cursor, time_range
+
+app = Flask(__name__)
+
+def test_cursor_round_trip():
+    at = datetime(2026, 3, 2, 8, 15, 30, 123456)
+    cursor = encode_cursor(at, 42)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (at, 42)
+
+@pytest.mark.parametrize('cursor', ['', 'not-a-cursor', encode_cursor(datetime(2026, 1, 1), 1)[:-3]])
+def test_invalid_cursor(cursor):
+    with pytest.raises(BadRequest):
+        decode_cursor(cursor)
+
+def test_aware_cursor_is_local_naive():
+    at = datetime(2026, 3, 2, 13, 0, tzinfo=timezone.utc)
+    decoded, row_id = decode_cursor(encode_cursor(at, 7))
+    assert decoded.tzinfo is None
+    assert decoded == at.astimezone().replace(tzinfo=None)
+    assert row_id == 7
+
+def test_finish_page_cursor_points_at_last_row():
+    rows = [(3, datetime(2026, 1, 3)), (2, datetime(2026, 1, 2)), (1, datetime(2026, 1, 1))]
+    page, cursor = pagination.finish_page(rows, 2, created_at_index=1)
+    assert page == rows[:2]
+    assert decode_cursor(cursor) == (datetime(2026, 1, 2), 2)
+    assert pagination.finish_page(rows[:2], 2, created_at_index=1) == (rows[:2], None)
+
+def test_time_range_default():
+    with app.test_request_context('/'):
+        since, until = time_range(timedelta(days=7), timedelta(days=90))
+    assert until - since == timedelta(days=7)
+    assert abs((datetime.now() - until).total_seconds()) < 5
+
+def test_time_range_explicit_and_capped():
+    with app.test_request_context('/?since=2026-01-01&until=2026-01-03T12:00'):
+        assert time_range(timedelta(days=7), timedelta(days=90)) == (datetime(2026, 1, 1), datetime(2026, 1, 3, 12))
+    with app.test_request_context('/?since=2026-01-01&until=2026-01-10'):
+        assert time_range(timedelta(days=7), timedelta(days=2)) == (datetime(2026, 1, 8), datetime(2026, 1, 10))
+    with app.test_request_context('/?hours=3&until=2026-01-10T12:00'):
+        assert time_range(timedelta(days=7), timedelta(days=2)) == (datetime(2026, 1, 10, 9), datetime(2026, 1, 10, 12))
+
+def test_time_range_aware_values():
+    since = datetime(2026, 6, 1, 12, 0, tzinfo=timezone.utc)
+    until = datetime(2026, 6, 1, 18, 0, tzinfo=timezone.utc)
+    with app.test_request_context('/', query_string={'since': since.isoformat(), 'until': '2026-06-01T18:00:00Z'}):
+        got_since, got_until = time_range(timedelta(days=7), timedelta(days=90))
+    assert got_since.tzinfo is None and got_until.tzinfo is None
+    assert got_since == since.astimezone().replace(tzinfo=None)
+    assert got_until == until.astimezone().replace(tzinfo=None)
+
+@pytest.mark.parametrize('query', ['/?since=2026-01-02&until=2026-01-01', '/?since=yesterday'])
+def test_time_range_rejects(query):
+    with app.test_request_context(query):
+        with pytest.raises(BadRequest):
+            time_range(timedelta(days=7), timedelta(days=90))
+
+@pytest.mark.parametrize('query', ['/?hours=inf', '/?hours=nan', '/?days=-inf', '/?hours=0', '/?days=-2',
+                                   '/?until=0001-01-01'])
+def test_time_range_rejects_out_of_range_spans(query):
+    with app.test_request_context(query):
+        with pytest.raises(BadRequest):
+            time_range(timedelta(days=7), timedelta(days=90))
+
+@pytest.mark.parametrize('query', ['/?days=1e300&until=2026-06-01', '/?hours=1e308&until=2026-06-01'])
+def test_time_range_clamps_huge_spans(query):
+    with app.test_request_context(query):
+        assert time_range(timedelta(days=7), timedelta(days=90)) == (datetime(2026, 3, 3), datetime(2026, 6, 1))
@@ -0,0 +1,76 @@
+from datetime import date, datetime, timedelta
+import re
+import pytest
+import init_db
+import partitions
+
+@pytest.fixture
+def delays(make_conn):
+    # A connection tracking delays' partitions by name in `partitions`
+    def make(names=(), bounds=(None, None)):
+        conn = make_conn()
+        conn.partitions = set(names)
+
+        def created(sql, params):
+            name = re.search(r'(delays_p\d+) PARTITION OF', sql)
+            if name:
+                conn.partitions.add(name.group(1))
+            return []
+
+        def detached(sql, params):
+            conn.partitions.discard(re.search(r'DETACH PARTITION (\w+)', sql).group(1))
+            return []
+
+        conn.on('FROM pg_inherits', lambda sql, params: [[name] for name in sorted(conn.partitions)])
+        conn.on('SELECT MIN(timestamp)', [list(bounds)])
+        conn.on('PARTITION OF', created)
+        conn.on('DETACH PARTITION', detached)
+        return conn
+    return make
+
+def test_partition_names():
+    assert partitions.partition_name(date(2026, 3, 2)) == 'delays_p20260302'
+
+def test_ensure_partitions_creates_only_missing_days(delays):
+    conn = delays(['delays_p20260302'])
+    created = partitions.ensure_partitions(conn, date(2026, 3, 1), date(2026, 3, 3))
+    assert created == ['delays_p20260301', 'delays_p20260303']
+    assert any("FROM ('2026-03-03') TO ('2026-03-04')" in sql for sql in conn.sql())
+
+def test_list_partitions_ignores_other_children(delays):
+    conn = delays(['delays_p20260302', 'delays_default'])
+    assert partitions.list_partitions(conn) == [('delays_p20260302', date(2026, 3, 2))]
+
+def test_expired_partitions_are_dropped(delays):
+    today = datetime.now().date()
+    old, kept = partitions.partition_name(today - timedelta(days=91)), partitions.partition_name(today - timedelta(days=90))
+    conn = delays([old, kept])
+    assert partitions.expire_partitions(conn, retention_days=90, archive=False) == [old]
+    assert conn.partitions == {kept}
+    assert f"DROP TABLE {old}" in conn.sql()
+
+def test_expired_partitions_can_be_archived(delays):
+    old = partitions.partition_name(datetime.now().date() - timedelta(days=10))
+    conn = delays([old])
+    assert partitions.expire_partitions(conn, retention_days=5, archive=True) == [old]
+    assert f"ALTER TABLE {old} SET SCHEMA {partitions.ARCHIVE_SCHEMA}" in conn.sql()
+    assert not any(sql.startswith('DROP TABLE') for sql in conn.sql())
+
+def test_migration_copies_rows_into_daily_partitions(delays):
+    conn = delays(bounds=(datetime(2026, 3, 1, 23, 0), datetime(2026, 3, 3, 1, 0)))
+    init_db.migrate_to_partitioned(conn)
+    assert conn.partitions == {'delays_p20260301', 'delays_p20260302', 'delays_p20260303'}
+    order = [i for i, sql in enumerate(conn.sql()) if sql.startswith((
+        'ALTER TABLE delays RENAME TO delays_unpartitioned',
+        'CREATE TABLE IF NOT EXISTS delays (',
+        'CREATE TABLE IF NOT EXISTS delays_p20260301',
+        'INSERT INTO delays',
+        "SELECT setval('delays_id_seq'",
+        'DROP TABLE delays_unpartitioned'))]
+    assert len(order) == 6 and order == sorted(order)
+
+def test_migration_of_an_empty_table_creates_no_partitions(delays):
+    conn = delays()
+    init_db.migrate_to_partitioned(conn)
+    assert conn.partitions == set()
+    assert conn.sql()[-1] == 'DROP TABLE delays_unpartitioned'
@@ -0,0 +1,54 @@
+from datetime import datetime
+import pytest
+from delay_events import DelayEvent
+import rollups
+
+T0 = datetime(2026, 3, 2, 8, 10, 0)
+
+def event(line, seconds, started_at=T0, previous=None, trip='t1'):
+    e = DelayEvent(line, trip, 'A01N', started_at, seconds, started_at)
+    e.previous_delay = previous
+    return e
+
+def test_new_events_add_to_the_count():
+    deltas = rollups._deltas([event('A', 300), event('A', 600, T0.replace(minute=50), trip='t2')], 'hour')
+    assert deltas == {('A', datetime(2026, 3, 2, 8)): [2, 15.0, 10.0, T0.replace(minute=50)]}
+
+def test_grown_events_move_only_sum_and_max():
+    deltas = rollups._deltas([event('A', 600, previous=300)], 'hour')
+    assert deltas == {('A', datetime(2026, 3, 2, 8)): [0, 5.0, 10.0, T0]}
+
+def test_buckets_by_start_time_and_line():
+    events = [event('A', 300), event('A', 300, T0.replace(hour=9), trip='t2'), event('C', 300, trip='t3')]
+    hourly = rollups._deltas(events, 'hour')
+    daily = rollups._deltas(events, 'day')
+    assert sorted(hourly) == [('A', datetime(2026, 3, 2, 8)), ('A', datetime(2026, 3, 2, 9)),
+                              ('C', datetime(2026, 3, 2, 8))]
+    assert daily[('A', datetime(2026, 3, 2))][0] == 2
+
+def test_apply_events_upserts_both_tables(conn):
+    rollups.apply_events(conn, [event('A', 300)])
+    assert len(conn.statements) == 2
+    for (sql, params), table in zip(conn.statements, rollups.ROLLUP_TABLES.values()):
+        assert sql.startswith(f"INSERT INTO {table} ")
+        assert f"delay_count = {table}.delay_count + EXCLUDED.delay_count" in sql
+        assert params['p0_2'] == 1 and params['p0_3'] == 5.0
+
+def test_apply_events_with_nothing_writes_nothing(conn):
+    rollups.apply_events(conn, [])
+    assert conn.statements == []
+
+def test_check_consistency_reports_each_mismatch(make_conn):
+    bucket = datetime(2026, 3, 2, 8)
+    conn = make_conn([['A', bucket, 2, 10.0, 5.0, 3, 15.0, 5.0]])
+    mismatches = rollups.check_consistency(conn, since=T0)
+    assert mismatches == [
+        (table, 'A', bucket, (2, 10.0, 5.0), (3, 15.0, 5.0)) for table in rollups.ROLLUP_TABLES.values()
+    ]
+    # `since` is rounded down to each table's bucket
+    assert [params['since'] for _, params in conn.statements] == [bucket, datetime(2026, 3, 2)]
+
+@pytest.mark.parametrize('argv', [['rollups.py'], ['rollups.py', 'rebuild']])
+def test_main_usage(argv, capsys):
+    assert rollups.main(argv) == 2
+    assert 'Usage' in capsys.readouterr().out
@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+from datetime import datetime
+import pytest
+import anomalies
+import hot_window
+import notifications
+import scheduler
+from notifications import NotificationPipeline, FakeSender
+
+class Subscribers:
+    """email_subscriptions and email_alert_log behind a recording
+    connection. The eligible-lines query is answered the way its unnest /
+    JOIN / NOT EXISTS would be; `in_use` is True while the connection is
+    checked out."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.subscriptions = {}
+        self.alerted = set()
+        self.in_use = False
+        conn.on('JOIN email_subscriptions', self._eligible)
+
+    def _eligible(self, sql, params):
+        return [[line, avg, sorted(self.subscriptions[line])]
+                for line, avg in zip(params['lines'], params['avgs'])
+                if self.subscriptions.get(line) and line not in self.alerted]
+
+    @contextmanager
+    def connection(self):
+        self.in_use = True
+        try:
+            yield self.conn
+        finally:
+            self.in_use = False
+
+@pytest.fixture
+def subscribers(conn, monkeypatch):
+    subscribers = Subscribers(conn)
+    monkeypatch.setattr(scheduler.db, 'connection', subscribers.connection)
+    return subscribers
+
+@pytest.fixture
+def pipeline(subscribers, monkeypatch):
+    # Not started: submitted jobs stay on the queue. Records whether the
+    # connection was still checked out when each job was submitted.
+    pipeline = NotificationPipeline(sender=FakeSender(latency=0))
+    pipeline.submitted = []
+    submit = pipeline.submit
+    def recording_submit(job):
+        pipeline.submitted.append((job, subscribers.in_use))
+        return submit(job)
+    monkeypatch.setattr(pipeline, 'submit', recording_submit)
+    monkeypatch.setattr(notifications, '_pipeline', pipeline)
+    return pipeline
+
+@pytest.fixture
+def recent(monkeypatch):
+    # line -> (samples, average delay) in the hot window's last 5 minutes;
+    # every line is untrained unless a test says otherwise
+    window = {}
+    monkeypatch.setattr(scheduler.shards, 'SHARDING', False)
+    monkeypatch.setattr(hot_window.window, 'recent', lambda seconds: window)
+    monkeypatch.setattr(anomalies.detector, 'active', lambda: {})
+    monkeypatch.setattr(anomalies.detector, 'is_trained', lambda line, now: False)
+    return window
+
+def test_no_candidates_touches_nothing(subscribers, pipeline, recent, conn):
+    subscribers.subscriptions = {'A': ['a@example.com']}
+    recent['A'] = (0, None)
+    scheduler.send_delay_alerts()
+    assert conn.statements == []
+    assert pipeline.submitted == []
+
+def test_lines_in_their_cooldown_are_skipped(subscribers, pipeline, recent, conn):
+    subscribers.subscriptions = {'A': ['a@example.com'], 'C': ['c@example.com']}
+    subscribers.alerted = {'A'}
+    recent.update({'A': (3, 6.5), 'C': (2, 4.0)})
+    scheduler.send_delay_alerts()
+    sql, _ = conn.statements[0]
+    assert "l.sent_at > NOW() - INTERVAL '1 hour'" in sql
+    assert [job.line for job, _ in pipeline.submitted] == ['C']
+    # Only C's recipients are logged as queued
+    [(log_sql, log_params)] = conn.statements[1:]
+    assert log_sql.startswith('INSERT INTO email_alert_log')
+    assert [v for k, v in log_params.items() if k.endswith('_0')] == ['c@example.com']
+
+def test_each_line_with_subscribers_gets_one_job(subscribers, pipeline, recent, conn):
+    subscribers.subscriptions = {'A': ['b@example.com', 'a@example.com'], 'C': ['c@example.com'], 'E': []}
+    recent.update({'A': (3, 6.5), 'C': (2, 4.0), 'E': (1, 3.0)})
+    scheduler.send_delay_alerts()
+    sql, params = conn.statements[0]
+    assert 'unnest(CAST(:lines AS text[]), CAST(:avgs AS numeric[]))' in sql
+    assert params == {'lines': ['A', 'C', 'E'], 'avgs': ['6.5', '4.0', '3.0']}
+    jobs = {job.line: job for job, _ in pipeline.submitted}
+    assert sorted(jobs) == ['A', 'C']
+    assert jobs['A'].emails == ['a@example.com', 'b@example.com']
+    # Handed to the workers only once the connection is back in the pool
+    assert not any(in_use for _, in_use in pipeline.submitted)
+    assert pipeline.pending() == 2
+
+def test_trained_lines_alert_only_while_anomalous(recent, monkeypatch):
+    monkeypatch.setattr(scheduler, 'ALERT_ON_ANOMALIES', True)
+    monkeypatch.setattr(anomalies.detector, 'active', lambda: {'E': object()})
+    monkeypatch.setattr(anomalies.detector, 'is_trained', lambda line, now: line in ('A', 'E'))
+    recent.update({'A': (3, 6.5), 'C': (2, 4.0), 'E': (5, 9.0)})
+    assert scheduler.delayed_lines() == [('C', 4.0), ('E', 9.0)]
+    monkeypatch.setattr(scheduler, 'ALERT_ON_ANOMALIES', False)
+    assert scheduler.delayed_lines() == [('A', 6.5), ('C', 4.0), ('E', 9.0)]
+
+def test_sharded_leader_reads_the_anomaly_filter_from_the_database(conn, monkeypatch):
+    monkeypatch.setattr(scheduler, 'ALERT_ON_ANOMALIES', True)
+    conn.on('FROM delays', [['A', 6.5], ['C', 4.0], ['E', 9.0]])
+    conn.on('FROM delay_anomalies', [['E']])
+    conn.on('FROM delay_baselines', [['A'], ['E']])
+    assert scheduler.delayed_lines_from_db(conn) == [('C', 4.0), ('E', 9.0)]
+    _, params = conn.statements[-1]
+    assert params == {'slot': anomalies.hour_of_week(datetime.now()), 'min': anomalies.MIN_SAMPLES}
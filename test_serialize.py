@@ -0,0 +1,48 @@
+from datetime import date, datetime
+from decimal import Decimal
+import json
+import pytest
+import serialize
+from serialize import RowEncoder
+
+FIELDS = ['line', 'count', 'avg', 'ratio', 'ok', 'note', 'at', 'day']
+ROWS = [
+    ('A', 3, Decimal('4.2'), 0.5, True, None, datetime(2026, 1, 1, 5, 0), date(2026, 1, 1)),
+    ('Ñ "q"', 0, Decimal('10'), 1e-3, False, 'x\ny', datetime(2026, 1, 1, 5, 0, 0, 250000), date(2026, 12, 31)),
+]
+EXPECTED = [
+    {'line': 'A', 'count': 3, 'avg': '4.2', 'ratio': 0.5, 'ok': True, 'note': None,
+     'at': '2026-01-01 05:00:00', 'day': '2026-01-01'},
+    {'line': 'Ñ "q"', 'count': 0, 'avg': '10', 'ratio': 0.001, 'ok': False, 'note': 'x\ny',
+     'at': '2026-01-01 05:00:00.250000', 'day': '2026-12-31'},
+]
+
+def test_encode_rows_stdlib(monkeypatch):
+    monkeypatch.setattr(serialize, 'orjson', None)
+    assert json.loads(RowEncoder(FIELDS).encode_rows(ROWS)) == EXPECTED
+
+def test_encode_rows_default_path():
+    assert json.loads(RowEncoder(FIELDS).encode_rows(ROWS)) == EXPECTED
+
+def test_encode_no_rows(monkeypatch):
+    assert RowEncoder(FIELDS).encode_rows([]) == b'[]'
+    monkeypatch.setattr(serialize, 'orjson', None)
+    assert RowEncoder(FIELDS).encode_rows([]) == b'[]'
+
+def test_iter_rows_joins_chunks():
+    rows = ROWS * 5
+    body = b''.join(RowEncoder(FIELDS).iter_rows(rows, chunk_rows=3))
+    assert json.loads(body) == EXPECTED * 5
+    assert b''.join(RowEncoder(FIELDS).iter_rows([], chunk_rows=3)) == b'[]'
+
+def test_timestamps_match_str():
+    # The format the API has always sent
+    at = datetime(2026, 1, 1, 5, 0)
+    assert json.loads(serialize.dumps({'at': at, 'day': date(2026, 1, 1)})) == {'at': str(at), 'day': '2026-01-01'}
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_non_finite_floats_are_null(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(serialize, 'orjson', None)
+    body = RowEncoder(['a', 'b', 'c', 'd']).encode_rows([(float('nan'), float('inf'), float('-inf'), 1.5)])
+    assert body == b'[{"a":null,"b":null,"c":null,"d":1.5}]'
@@ -0,0 +1,105 @@
+import pytest
+import shards
+from shards import rebalance, cycle_number
+
+FEEDS = ['gtfs', 'gtfs-ace', 'gtfs-bdfm', 'gtfs-g', 'gtfs-jz', 'gtfs-l', 'gtfs-nqrw', 'gtfs-si']
+
+class Leases:
+    # Just enough of scrape_workers and scrape_leases for rebalance(),
+    # answered through a recording connection; a lease or worker is live
+    # until it is marked expired
+    def __init__(self, conn):
+        self.conn = conn
+        self.workers = {}
+        self.leases = {}
+        conn.on('INSERT INTO scrape_workers', self._heartbeat)
+        conn.on('INSERT INTO scrape_leases', self._add)
+        conn.on('SELECT COUNT(*) FROM scrape_workers', lambda sql, params: [[sum(self.workers.values())]])
+        conn.on('SELECT feed, owner', self._select)
+        conn.on('SET owner = NULL', self._release)
+        conn.on('UPDATE scrape_leases', self._claim)
+        conn.on('', self._unexpected)
+
+    def _heartbeat(self, sql, params):
+        self.workers[params['worker']] = True
+        return []
+
+    def _add(self, sql, params):
+        for feed in params['feeds']:
+            self.leases.setdefault(feed, (None, False))
+        return []
+
+    def _select(self, sql, params):
+        return [[feed, owner, live] for feed, (owner, live) in sorted(self.leases.items())
+                if feed in params['feeds']]
+
+    def _release(self, sql, params):
+        for feed in params['feeds']:
+            if self.leases[feed][0] == params['worker']:
+                self.leases[feed] = (None, False)
+        return []
+
+    def _claim(self, sql, params):
+        for feed in params['feeds']:
+            self.leases[feed] = (params['worker'], True)
+        return []
+
+    def _unexpected(self, sql, params):
+        raise AssertionError(f"unexpected statement: {sql}")
+
+    def expire(self, worker_id):
+        self.workers[worker_id] = False
+        for feed, (owner, live) in self.leases.items():
+            if owner == worker_id:
+                self.leases[feed] = (owner, False)
+
+    def owners(self):
+        return {feed: owner for feed, (owner, live) in self.leases.items() if live}
+
+@pytest.fixture
+def leases(conn):
+    return Leases(conn)
+
+def test_single_worker_takes_everything(conn, leases):
+    assert rebalance(conn, FEEDS, 'w1') == sorted(FEEDS)
+    assert set(leases.owners().values()) == {'w1'}
+
+def test_new_worker_gets_its_share_after_release(conn, leases):
+    rebalance(conn, FEEDS, 'w1')
+    # w2 joins while w1 still holds everything, so nothing is free yet
+    assert rebalance(conn, FEEDS, 'w2') == []
+    w1 = rebalance(conn, FEEDS, 'w1')
+    assert len(w1) == 4
+    w2 = rebalance(conn, FEEDS, 'w2')
+    assert len(w2) == 4
+    assert set(w1).isdisjoint(w2)
+    assert set(w1) | set(w2) == set(FEEDS)
+
+def test_expired_worker_feeds_move_to_survivors(conn, leases):
+    for worker in ('w1', 'w2', 'w3', 'w1', 'w2', 'w3'):
+        rebalance(conn, FEEDS, worker)
+    assert len(leases.owners()) == len(FEEDS)
+    leases.expire('w3')
+    rebalance(conn, FEEDS, 'w1')
+    rebalance(conn, FEEDS, 'w2')
+    owners = leases.owners()
+    assert sorted(owners) == sorted(FEEDS)
+    assert set(owners.values()) == {'w1', 'w2'}
+
+def test_renewal_keeps_the_same_feeds(conn, leases):
+    rebalance(conn, FEEDS, 'w1')
+    rebalance(conn, FEEDS, 'w2')
+    first = rebalance(conn, FEEDS, 'w1')
+    assert rebalance(conn, FEEDS, 'w1') == first
+
+def test_cycle_number_floors():
+    assert cycle_number(30, 59.999) == 1
+    assert cycle_number(30, 60.0) == 2
+    assert cycle_number(30, 89.9) == 2
+
+def test_aligned_delay_with_an_offset(monkeypatch):
+    monkeypatch.setattr(shards.time, 'time', lambda: 3610.0)
+    assert shards.aligned_delay(30) == pytest.approx(20.0)
+    assert shards.aligned_delay(30, offset=15) == pytest.approx(5.0)
+    monkeypatch.setattr(shards.time, 'time', lambda: 3628.0)
+    assert shards.aligned_delay(30, offset=15) == pytest.approx(17.0)
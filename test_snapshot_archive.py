@@ -0,0 +1,84 @@
+from datetime import date, datetime, timedelta
+import numpy as np
+import pytest
+import extract
+import snapshot_archive
+from snapshot_archive import ArchiveWriter
+
+T0 = datetime(2026, 3, 2, 8, 0, 0)
+
+def snapshot(lines, rows, captured_at=T0):
+    # rows: (line, trip_id, stop_id, delay_seconds)
+    s = extract.FeedSnapshot()
+    s.lines = list(lines)
+    s.line_codes = np.array([lines.index(r[0]) for r in rows], dtype=np.int16)
+    s.trip_id = np.array([r[1] for r in rows], dtype=object)
+    s.stop_id = np.array([r[2] for r in rows], dtype=object)
+    s.delay_seconds = np.array([r[3] for r in rows], dtype=np.int32)
+    s.arrival = np.zeros(len(rows), dtype=np.int64)
+    s.trips_by_line = np.zeros(len(lines), dtype=np.int32)
+    s.captured_at = captured_at
+    return s
+
+ACE = ['A', 'C', 'E']
+L = ['L']
+
+@pytest.fixture(params=['arrow', 'parquet'])
+def writer(request, tmp_path):
+    return ArchiveWriter(str(tmp_path), fmt=request.param, batch_cycles=2)
+
+def test_files_are_written_per_batch_of_cycles(writer, tmp_path):
+    writer.add('gtfs-ace', snapshot(ACE, [('A', 't1', 'A01N', 300)]), T0)
+    assert snapshot_archive.files(str(tmp_path)) == []
+    writer.add('gtfs-ace', snapshot(ACE, [('C', 't2', 'A02N', 60)]), T0 + timedelta(seconds=30))
+    [(day, feed, path)] = snapshot_archive.files(str(tmp_path))
+    assert (day, feed) == (date(2026, 3, 2), 'gtfs-ace')
+    table = snapshot_archive.read_file(path)
+    assert table.num_rows == 2
+    assert table.column('line').to_pylist() == ['A', 'C']
+    assert table.column('delay_seconds').to_pylist() == [300, 60]
+    assert writer.stats['files'] == 1 and writer.stats['rows'] == 2
+
+def test_a_new_day_starts_a_new_partition(writer, tmp_path):
+    writer.add('gtfs-l', snapshot(L, [('L', 't1', 'L01N', 300)]), T0)
+    writer.add('gtfs-l', snapshot(L, [('L', 't1', 'L01N', 300)]), T0 + timedelta(days=1))
+    writer.flush()
+    assert [day for day, _, _ in snapshot_archive.files(str(tmp_path))] == [date(2026, 3, 2), date(2026, 3, 3)]
+    # Days outside the range aren't opened
+    assert len(snapshot_archive.files(str(tmp_path), since=date(2026, 3, 3))) == 1
+    assert snapshot_archive.files(str(tmp_path), feeds=['gtfs-ace']) == []
+
+def test_only_requested_columns_are_read(writer, tmp_path):
+    writer.add('gtfs-l', snapshot(L, [('L', 't1', 'L01N', 300)]), T0)
+    writer.flush()
+    table = snapshot_archive.read(str(tmp_path), columns=['trip_id', 'delay_seconds'])
+    assert table.column_names == ['trip_id', 'delay_seconds']
+
+def test_disabled_writer_does_nothing(tmp_path):
+    writer = ArchiveWriter(None)
+    assert not writer.enabled
+    writer.add('gtfs-l', snapshot(L, []), T0)
+    writer.close()
+
+def test_init_writer_is_off_without_a_directory():
+    assert snapshot_archive.init_writer(None) is None
+
+def test_cycles_merge_feeds_back_together(writer, tmp_path):
+    for i in range(2):
+        cycle_at = T0 + timedelta(seconds=30 * i)
+        writer.add('gtfs-ace', snapshot(ACE, [('A', 't1', 'A01N', 300 + i), ('E', 't2', 'A02N', 60)]), cycle_at)
+        writer.add('gtfs-l', snapshot(L, [('L', 't3', 'L01N', 400)]), cycle_at)
+    writer.flush()
+    merged = list(snapshot_archive.cycles(str(tmp_path)))
+    assert [c[0] for c in merged] == [T0, T0 + timedelta(seconds=30)]
+    cycle_at, seen_lines, observations = merged[1]
+    assert seen_lines == {'A', 'C', 'E', 'L'}
+    assert sorted((o['line'], o['trip_id'], o['delay_seconds']) for o in observations) == [
+        ('A', 't1', 301), ('L', 't3', 400)]
+
+def test_dry_run_replay_counts_events(writer, tmp_path):
+    writer.add('gtfs-l', snapshot(L, [('L', 't1', 'L01N', 300)]), T0)
+    writer.add('gtfs-l', snapshot(L, [('L', 't1', 'L01N', 900)]), T0 + timedelta(seconds=30))
+    writer.flush()
+    totals = snapshot_archive.replay(str(tmp_path), date(2026, 3, 2), date(2026, 3, 3), dry_run=True)
+    assert totals == {'cycles': 2, 'new': 1, 'updated': 1, 'closed': 0}
@@ -0,0 +1,77 @@
+from datetime import datetime
+import pytest
+from delay_events import DelayEvent
+from stations import StationDirectory, StationBoard
+
+STOPS = """stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station
+101N,Van Cortlandt Park-242 St,40.889248,-73.898583,0,101
+101,Van Cortlandt Park-242 St,40.889248,-73.898583,1,
+101S,Van Cortlandt Park-242 St,40.889248,-73.898583,0,101
+A27,42 St-Port Authority Bus Terminal,40.757308,-73.989735,1,
+R16,Times Sq-42 St,40.754672,-73.986754,1,
+"""
+
+NOW = datetime(2026, 3, 2, 8, 30)
+
+@pytest.fixture
+def directory(tmp_path):
+    path = tmp_path / 'stops.txt'
+    path.write_text(STOPS)
+    return StationDirectory().load(str(path))
+
+def event(stop_id, seconds, line='1', trip='t1', previous=None, started_at=NOW):
+    e = DelayEvent(line, trip, stop_id, started_at, seconds, started_at)
+    e.previous_delay = previous
+    return e
+
+def test_platforms_resolve_to_their_station(directory):
+    assert len(directory) == 3
+    assert directory.station_id('101N') == '101'
+    assert directory.station_id('101') == '101'
+    # A platform that isn't listed falls back to the station
+    assert directory.station_id('A27N') == 'A27'
+    assert directory.station_id('X99N') is None
+    assert directory.stop_ids('101') == ['101', '101N', '101S']
+
+def test_open_delays_rank_the_worst_stations(directory):
+    board = StationBoard(directory, hours=4, worst_size=2)
+    events = [event('101N', 300, trip='t1'), event('101S', 600, trip='t2'), event('A27N', 240, line='A', trip='t3'),
+              event('R16S', 180, line='N', trip='t4')]
+    board.record_events(events)
+    board.record_open(events, NOW)
+    worst = board.worst()
+    assert [s['station_id'] for s in worst] == ['101', 'A27']
+    assert worst[0]['open_delays'] == 2
+    assert worst[0]['max_open_delay'] == 10.0
+    assert worst[0]['stops'] == {'101N': {'open_delays': 1, 'max_open_delay': 5.0},
+                                 '101S': {'open_delays': 1, 'max_open_delay': 10.0}}
+    assert board.worst(1) == worst[:1]
+
+def test_station_summary_counts_grown_events_once(directory):
+    board = StationBoard(directory, hours=4)
+    board.record_events([event('101N', 300)])
+    board.record_events([event('101N', 600, previous=300)])
+    board.record_open([], NOW)
+    summary = board.station('101N')
+    assert summary['total_delays'] == 1
+    assert summary['avg_delay'] == 10.0
+    assert summary['open_delays'] == 0
+
+def test_quiet_and_unknown_stations(directory):
+    board = StationBoard(directory, hours=4)
+    board.record_open([], NOW)
+    assert board.station('R16')['total_delays'] == 0
+    assert board.station('R16')['name'] == 'Times Sq-42 St'
+    assert board.station('X99') is None
+
+def test_unmatched_stops_are_counted(directory):
+    board = StationBoard(directory, hours=4)
+    board.record_events([event('X99N', 300)])
+    assert board.unmatched == 1
+
+def test_memory_is_fixed_by_station_count(directory):
+    board = StationBoard(directory, hours=24)
+    board.record_open([], NOW)
+    before = board.memory_bytes()
+    board.record_events([event('101N', 300, trip=str(i)) for i in range(500)])
+    assert board.memory_bytes() == before > 0
@@ -0,0 +1,145 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pg8000.exceptions import DatabaseError, InterfaceError
+import pytest
+import write_behind
+from write_behind import ReportWriteBehind
+
+class FakeReports:
+    """The reports table and its id sequence, answered through recording
+    connections. Writes made in a transaction only land when it commits;
+    `down` makes every statement fail as if the connection were gone."""
+
+    def __init__(self, make_conn):
+        self.make_conn = make_conn
+        self.rows = {}
+        self.sequence = 0
+        self.down = False
+        self.transactions = 0
+
+    @contextmanager
+    def transaction(self):
+        if self.down:
+            raise InterfaceError('connection refused')
+        inserted, upvoted = {}, {}
+        conn = self.make_conn()
+        conn.on('nextval', self._reserve)
+        conn.on('pg_notify', [])
+        conn.on('INSERT INTO reports', lambda sql, params: self._insert(params, inserted))
+        conn.on('UPDATE reports', lambda sql, params: self._upvote(params, inserted, upvoted))
+        conn.on('', AssertionError('unexpected statement'))
+        yield conn
+        self.transactions += 1
+        self.rows.update(inserted)
+        for report_id, n in upvoted.items():
+            self.rows[report_id]['upvotes'] += n
+
+    connection = transaction
+
+    def _reserve(self, sql, params):
+        start = self.sequence
+        self.sequence += params['n']
+        return [[i] for i in range(start + 1, start + params['n'] + 1)]
+
+    def _insert(self, params, inserted):
+        for i in range(len(params) // 5):
+            report_id, line = params[f"p{i}_0"], params[f"p{i}_1"]
+            if len(line) > write_behind.LINE_MAX_LENGTH:
+                raise DatabaseError('value too long for type character varying(10)')
+            inserted[report_id] = {'line': line, 'upvotes': 0}
+        return []
+
+    def _upvote(self, params, inserted, upvoted):
+        if any(i > write_behind.REPORT_ID_MAX for i in params['ids']):
+            raise DatabaseError('integer out of range')
+        matched = [i for i in params['ids'] if i in self.rows or i in inserted]
+        for i, n in zip(params['ids'], params['counts']):
+            if i in matched:
+                upvoted[i] = upvoted.get(i, 0) + n
+        return [[i] for i in matched]
+
+@pytest.fixture
+def table(monkeypatch, make_conn):
+    fake = FakeReports(make_conn)
+    monkeypatch.setattr(write_behind.db, 'transaction', fake.transaction)
+    monkeypatch.setattr(write_behind.db, 'connection', fake.connection)
+    return fake
+
+@pytest.fixture
+def buffer(table, monkeypatch):
+    # Flushed by hand: no background thread
+    monkeypatch.setattr(ReportWriteBehind, '_ensure_started', lambda self: None)
+    monkeypatch.setattr(write_behind, 'ID_BLOCK_SIZE', 3)
+    return ReportWriteBehind()
+
+def test_ids_are_reserved_in_blocks(buffer, table):
+    ids = [buffer.submit('A', 'delay', '').id for _ in range(4)]
+    assert ids == [1, 2, 3, 4]
+    assert table.sequence == 6
+
+def test_flush_writes_reports_then_their_upvotes(buffer, table):
+    report = buffer.submit('A', 'delay', 'stuck')
+    buffer.upvote(report.id)
+    buffer.upvote(report.id)
+    before = table.transactions
+    assert buffer.flush() == 2
+    assert table.rows[report.id] == {'line': 'A', 'upvotes': 2}
+    assert table.transactions == before + 1
+    assert buffer.pending() == 0
+
+def test_overlay_shows_unflushed_writes(buffer, table):
+    table.rows[7] = {'line': 'A', 'upvotes': 1}
+    stored = [(7, 'A', 'delay', '', 1, datetime(2026, 1, 1, 8))]
+    buffer.upvote(7)
+    new = buffer.submit('A', 'crowding', '')
+    buffer.submit('C', 'delay', '')
+    rows = buffer.overlay(stored, line='A')
+    assert [(r[0], r[4]) for r in rows] == [(new.id, 0), (7, 2)]
+    # Later pages only get the upvotes
+    assert buffer.overlay(stored, line='A', include_new=False) == [stored[0][:4] + (2,) + stored[0][5:]]
+    # New reports outside the time range are left out
+    assert [r[0] for r in buffer.overlay(stored, since=datetime.now())] == [7]
+
+def test_everything_is_requeued_when_the_database_is_down(buffer, table):
+    report = buffer.submit('A', 'delay', '')
+    buffer.upvote(report.id)
+    table.down = True
+    with pytest.raises(InterfaceError):
+        buffer.flush()
+    assert buffer.pending() == 2
+    # Still visible while it waits
+    assert buffer.overlay([], line='A')[0][0] == report.id
+    table.down = False
+    buffer.flush()
+    assert table.rows[report.id]['upvotes'] == 1
+    assert buffer.metrics()['failures'] == 1
+
+def test_a_rejected_report_is_quarantined(buffer, table):
+    good = buffer.submit('A', 'delay', '')
+    buffer.submit('X' * 20, 'delay', '')
+    buffer.upvote(good.id)
+    buffer.flush()
+    assert set(table.rows) == {good.id}
+    assert table.rows[good.id]['upvotes'] == 1
+    assert buffer.pending() == 0
+    assert buffer.metrics()['dropped_reports'] == 1
+
+def test_a_rejected_upvote_id_does_not_block_the_others(buffer, table):
+    table.rows[5] = {'line': 'A', 'upvotes': 0}
+    for _ in range(3):
+        buffer.upvote(5)
+    buffer.upvote(write_behind.REPORT_ID_MAX + 1)
+    buffer.flush()
+    assert table.rows[5]['upvotes'] == 3
+    assert buffer.pending() == 0
+    assert buffer.metrics()['dropped_upvotes'] == 1
+
+def test_upvotes_for_missing_rows_are_retried_then_dropped(buffer, table, monkeypatch):
+    buffer.upvote(99)
+    buffer.flush()
+    # Another worker may not have flushed report 99 yet
+    assert buffer.pending() == 1
+    monkeypatch.setattr(write_behind, 'UPVOTE_RETRY_SECONDS', 0)
+    buffer.flush()
+    assert buffer.pending() == 0
+    assert buffer.metrics()['dropped_upvotes'] == 1
@@ -0,0 +1,326 @@
+from pg8000.exceptions import DatabaseError
+from dotenv import load_dotenv
+from datetime import datetime
+import threading
+import atexit
+import time
+import os
+import db
+import live
+import metrics
+
+load_dotenv()
+
+FLUSH_SECONDS = float(os.getenv('WRITE_BEHIND_FLUSH_SECONDS', 1))
+# Pending upvote ids plus pending reports that trigger an early flush
+FLUSH_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', 200))
+# Report ids reserved from the sequence per round trip
+ID_BLOCK_SIZE = int(os.getenv('WRITE_BEHIND_ID_BLOCK', 50))
+# An upvote for an id with no row yet is usually for a report another
+# worker hasn't flushed; it is retried for this long before being dropped
+UPVOTE_RETRY_SECONDS = float(os.getenv('WRITE_BEHIND_UPVOTE_RETRY_SECONDS', 30))
+
+# Column sizes of the reports table, checked before a report is buffered
+LINE_MAX_LENGTH = 10
+ISSUE_TYPE_MAX_LENGTH = 50
+# reports.id is a SERIAL (int4); larger ids are turned away before buffering
+REPORT_ID_MAX = 2 ** 31 - 1
+
+flushes = metrics.registry.counter(
+    'subway_write_behind_flushes_total', 'Write-behind flushes by outcome', ['status'])
+flushed = metrics.registry.counter(
+    'subway_write_behind_flushed_total', 'Rows and increments written by write-behind flushes', ['kind'])
+
+class PendingReport:
+    __slots__ = ('id', 'line', 'issue_type', 'description', 'created_at')
+
+    def __init__(self, report_id, line, issue_type, description, created_at):
+        self.id = report_id
+        self.line = line
+        self.issue_type = issue_type
+        self.description = description
+        self.created_at = created_at
+
+    def as_row(self, upvotes=0):
+        # Same column order as the report read queries
+        return (self.id, self.line, self.issue_type, self.description, upvotes, self.created_at)
+
+class ReportWriteBehind:
+    """Buffers report submissions and upvotes in process and writes them in
+    batches.
+
+    Upvotes are coalesced per report id, so a hot report costs one UPDATE
+    per flush instead of one per click. Submissions get their id from a
+    block reserved from the reports sequence, so a new report can be shown
+    and upvoted before it is written. Anything not yet committed is applied
+    to reads by overlay() so a user sees their own write immediately, on
+    the worker that took it; other workers see it after the next flush.
+
+    A batch the database rejects is retried one report and one upvoted id
+    at a time, and only the ones that fail on their own are dropped.
+    """
+
+    def __init__(self, flush_seconds=FLUSH_SECONDS, max_pending=FLUSH_MAX_PENDING):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._upvotes = {}
+        self._reports = []
+        # Taken out of the buffers by a flush that hasn't committed yet;
+        # still visible to overlay()
+        self._inflight_upvotes = {}
+        self._inflight_reports = []
+        self._ids = []
+        self._ids_lock = threading.Lock()
+        # Report id -> when an upvote for it first found no row
+        self._unmatched_since = {}
+        self.stats = {'upvotes': 0, 'reports': 0, 'flushes': 0, 'failures': 0, 'dropped_reports': 0,
+                      'dropped_upvotes': 0}
+
+    def _ensure_started(self):
+        # Started lazily so each forked worker gets its own flush thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._upvotes, self._reports, self._ids = {}, [], []
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _next_id(self):
+        with self._ids_lock:
+            if not self._ids:
+                with db.connection() as conn:
+                    rows = conn.run(
+                        "SELECT nextval(pg_get_serial_sequence('reports', 'id')) FROM generate_series(1, :n)",
+                        n=ID_BLOCK_SIZE
+                    )
+                self._ids = [r[0] for r in reversed(rows)]
+            return self._ids.pop()
+
+    def upvote(self, report_id):
+        self._ensure_started()
+        with self._lock:
+            self._upvotes[report_id] = self._upvotes.get(report_id, 0) + 1
+            self.stats['upvotes'] += 1
+            full = len(self._upvotes) + len(self._reports) >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def submit(self, line, issue_type, description):
+        self._ensure_started()
+        report = PendingReport(self._next_id(), line, issue_type, description, datetime.now())
+        with self._lock:
+            self._reports.append(report)
+            self.stats['reports'] += 1
+            full = len(self._upvotes) + len(self._reports) >= self.max_pending
+        if full:
+            self._wake.set()
+        return report
+
+    def overlay(self, rows, line=None, since=None, until=None, include_new=True):
+        # rows: (id, line, issue_type, description, upvotes, created_at),
+        # newest first. Adds uncommitted upvotes and, when include_new,
+        # uncommitted reports matching the same filters.
+        with self._lock:
+            upvotes = dict(self._inflight_upvotes)
+            for report_id, n in self._upvotes.items():
+                upvotes[report_id] = upvotes.get(report_id, 0) + n
+            pending = self._inflight_reports + self._reports if include_new else []
+        if not upvotes and not pending:
+            return rows
+
+        out = [r if r[0] not in upvotes else r[:4] + (r[4] + upvotes[r[0]],) + r[5:] for r in rows]
+        added = [
+            p.as_row(upvotes.get(p.id, 0)) for p in pending
+            if (line is None or p.line == line)
+            and (since is None or p.created_at > since)
+            and (until is None or p.created_at <= until)
+        ]
+        if added:
+            out = sorted(added + out, key=lambda r: (r[5], r[0]), reverse=True)
+        return out
+
+    def pending(self):
+        with self._lock:
+            return len(self._upvotes) + len(self._reports)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Write-behind flush failed, will retry: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._upvotes and not self._reports:
+                    return 0
+                upvotes, self._upvotes = self._upvotes, {}
+                reports, self._reports = self._reports, []
+                self._inflight_upvotes = upvotes
+                self._inflight_reports = reports
+            try:
+                with db.transaction() as conn:
+                    unmatched = self._write(conn, upvotes, reports)
+            except DatabaseError as e:
+                # The database rejected something in the batch; find out
+                # what by writing the reports one at a time
+                print(f"❌ Write-behind batch rejected, retrying row by row: {e}")
+                self._flush_each(upvotes, reports)
+                flushes.inc(status='retried')
+                return len(reports) + len(upvotes)
+            except Exception:
+                self._requeue(upvotes, reports)
+                flushes.inc(status='error')
+                raise
+            self._finish(upvotes, reports, unmatched)
+            flushes.inc(status='ok')
+            return len(reports) + len(upvotes)
+
+    def _flush_each(self, upvotes, reports):
+        written = []
+        for i, report in enumerate(reports):
+            try:
+                with db.transaction() as conn:
+                    self._write(conn, {}, [report])
+                written.append(report)
+            except DatabaseError as e:
+                print(f"❌ Dropped report {report.id} the database rejected: {e}")
+                with self._lock:
+                    self.stats['dropped_reports'] += 1
+            except Exception:
+                # Lost the database itself; keep the rest for the next flush
+                self._requeue(upvotes, reports[i:])
+                raise
+        try:
+            with db.transaction() as conn:
+                unmatched = self._write(conn, upvotes, [])
+        except DatabaseError as e:
+            print(f"❌ Write-behind upvotes rejected, retrying id by id: {e}")
+            upvotes, unmatched = self._upvote_each(upvotes)
+        except Exception:
+            self._requeue(upvotes, [])
+            raise
+        self._finish(upvotes, written, unmatched)
+
+    def _upvote_each(self, upvotes):
+        # Returns the upvotes that were written and the ids among them that
+        # had no row; ids the database rejects on their own are dropped
+        written = {}
+        unmatched = set()
+        items = sorted(upvotes.items())
+        for i, (report_id, n) in enumerate(items):
+            try:
+                with db.transaction() as conn:
+                    unmatched |= self._write(conn, {report_id: n}, [])
+                written[report_id] = n
+            except DatabaseError as e:
+                print(f"❌ Dropped {n} upvote(s) for report {report_id} the database rejected: {e}")
+                with self._lock:
+                    self.stats['dropped_upvotes'] += n
+            except Exception:
+                self._requeue(dict(items[i:]), [])
+                raise
+        return written, unmatched
+
+    def _requeue(self, upvotes, reports):
+        # Merge back in front of anything buffered since
+        with self._lock:
+            for report_id, n in upvotes.items():
+                self._upvotes[report_id] = self._upvotes.get(report_id, 0) + n
+            self._reports = reports + self._reports
+            self._inflight_upvotes, self._inflight_reports = {}, []
+            self.stats['failures'] += 1
+
+    def _finish(self, upvotes, reports, unmatched):
+        now = time.monotonic()
+        with self._lock:
+            for report_id in upvotes:
+                if report_id not in unmatched:
+                    self._unmatched_since.pop(report_id, None)
+                    continue
+                first = self._unmatched_since.setdefault(report_id, now)
+                if now - first < UPVOTE_RETRY_SECONDS:
+                    self._upvotes[report_id] = self._upvotes.get(report_id, 0) + upvotes[report_id]
+                else:
+                    del self._unmatched_since[report_id]
+                    self.stats['dropped_upvotes'] += upvotes[report_id]
+                    print(f"❌ Dropped {upvotes[report_id]} upvote(s) for report {report_id}, which doesn't exist")
+            self._inflight_upvotes, self._inflight_reports = {}, []
+            self.stats['flushes'] += 1
+        flushed.inc(len(reports), kind='reports')
+        flushed.inc(sum(n for i, n in upvotes.items() if i not in unmatched), kind='upvotes')
+
+    def _write(self, conn, upvotes, reports):
+        # New reports go first so upvotes on them find their row. Returns the
+        # upvoted ids that had no row.
+        if reports:
+            db.insert_many(
+                conn, 'reports', ['id', 'line', 'issue_type', 'description', 'created_at'],
+                [(r.id, r.line, r.issue_type, r.description, r.created_at) for r in reports]
+            )
+            for r in reports:
+                live.publish(conn, 'report', (r.line or '').upper(), {
+                    'id': r.id,
+                    'issue_type': r.issue_type,
+                    'description': (r.description or '')[:live.MAX_TEXT],
+                    'created_at': str(r.created_at)
+                })
+        if upvotes:
+            ids = sorted(upvotes)
+            # Rows are locked in id order so concurrent flushes from other
+            # workers can't deadlock
+            updated = conn.run("""
+                UPDATE reports r
+                SET upvotes = r.upvotes + v.n
+                FROM (
+                    SELECT locked.id, v.n
+                    FROM (SELECT id FROM reports WHERE id = ANY(CAST(:ids AS int[])) ORDER BY id FOR UPDATE) locked
+                    JOIN unnest(CAST(:ids AS int[]), CAST(:counts AS int[])) AS v(id, n) ON v.id = locked.id
+                ) v
+                WHERE r.id = v.id
+                RETURNING r.id
+            """, ids=ids, counts=[upvotes[i] for i in ids])
+            return set(upvotes) - {row[0] for row in updated}
+        return set()
+
+    def close(self, timeout=10):
+        # Graceful shutdown: stop the thread and write whatever is left
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Write-behind flush on shutdown failed: {e}")
+                time.sleep(0.5)
+        if self.pending():
+            print(f"❌ Dropped {self.pending()} buffered report writes on shutdown")
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, pending_upvotes=len(self._upvotes), pending_reports=len(self._reports))
+
+reports = None
+
+def init_reports():
+    # Created by the web app factory, which owns the flush-on-exit hook
+    global reports
+    if reports is None:
+        reports = ReportWriteBehind()
+        atexit.register(reports.close)
+    return reports